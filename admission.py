@@ -0,0 +1,123 @@
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from config import FLOW_LIMITS
+
+logger = logging.getLogger(__name__)
+
+class AdmissionRejected(Exception):
+    """Очередь потока переполнена — запрос отклонён сразу"""
+
+    def __init__(self, flow: str):
+        super().__init__(f"Очередь '{flow}' переполнена")
+        self.flow = flow
+
+class FlowGate:
+    """FIFO-семафор с ограниченной очередью ожидания для одного типа потока"""
+
+    def __init__(self, name: str, concurrency: int, max_queue: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        self.rejected = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, on_queued: Optional[Callable[[int], Awaitable]] = None) -> bool:
+        """Занимает слот. Возвращает True, если пришлось ждать в очереди"""
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+            return False
+
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected(self.name)
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        position = len(self._waiters)
+
+        try:
+            if on_queued:
+                try:
+                    await on_queued(position)
+                except Exception as e:
+                    logger.debug(f"Не удалось показать позицию в очереди: {e}")
+            await future
+        except BaseException:
+            if future.done() and not future.cancelled():
+                # Слот уже передан нам, но ожидание прервано — отдаём дальше
+                self.release()
+            else:
+                future.cancel()
+                try:
+                    self._waiters.remove(future)
+                except ValueError:
+                    pass
+            raise
+        return True
+
+    def release(self):
+        # Слот передаётся первому живому ожидающему без уменьшения active
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+class AdmissionController:
+    """Ограничивает число одновременно выполняемых дорогих потоков (LLM, голос)"""
+
+    def __init__(self, limits: Dict[str, Tuple[int, int]] = FLOW_LIMITS):
+        self._gates = {
+            flow: FlowGate(flow, concurrency, max_queue)
+            for flow, (concurrency, max_queue) in limits.items()
+        }
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        flow: str,
+        on_queued: Optional[Callable[[int], Awaitable]] = None,
+        on_admitted: Optional[Callable[[], Awaitable]] = None
+    ):
+        """async with admission.slot("recipe", ...): — выполнение внутри слота.
+
+        on_queued(position) вызывается, если запрос встал в очередь;
+        on_admitted() — когда дождался слота. При переполнении очереди
+        бросает AdmissionRejected.
+        """
+        gate = self._gates[flow]
+        was_queued = await gate.acquire(on_queued)
+        try:
+            if was_queued and on_admitted:
+                try:
+                    await on_admitted()
+                except Exception as e:
+                    logger.debug(f"Ошибка on_admitted: {e}")
+            yield
+        finally:
+            gate.release()
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        return {
+            name: {
+                "active": gate.active,
+                "queued": gate.queued,
+                "rejected": gate.rejected,
+                "concurrency": gate.concurrency,
+                "max_queue": gate.max_queue,
+            }
+            for name, gate in self._gates.items()
+        }
+
+# Глобальный экземпляр
+admission = AdmissionController()
@@ -0,0 +1,225 @@
+"""Микробенчмарки горячих чисто-питоновских функций.
+
+Всё, что выполняется на каждое сообщение: определение намерения, очистка
+ввода для промптов, разбор JSON из ответа LLM, клавиатуры и сериализация
+сессии. Корпуса — реалистичные русские и английские сообщения.
+
+    python benchmarks.py                  # просто замер
+    python benchmarks.py --save           # сохранить baseline
+    python benchmarks.py --compare        # сравнить с baseline, exit 1 при регрессии
+    python benchmarks.py -k intent --threshold 0.3
+
+Время — лучшее из нескольких повторов (мкс на вызов), это устойчивее к шуму,
+чем среднее. Baseline зависит от машины, поэтому хранится локально в .benchmarks/.
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+
+# Модули бота читают конфиг при импорте
+os.environ.setdefault("DATABASE_URL", "postgresql://benchmark@localhost/benchmark")
+os.environ.setdefault("TELEGRAM_TOKEN", "123456:BENCHMARK")
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".benchmarks", "baseline.json")
+
+# ==================== КОРПУСА ====================
+
+USER_MESSAGES = [
+    "яйца, молоко, сыр",
+    "Дай рецепт борща",
+    "дай рецепт: сырники со сметаной",
+    "рецепт плова по-узбекски",
+    "Как приготовить пасту карбонара?",
+    "картошка лук морковь курица",
+    "у меня есть гречка, говядина и чеснок",
+    "помидоры огурцы",
+    "хочу приготовить что-нибудь на ужин",
+    "спасибо",
+    "How to cook pancakes",
+    "recipe for chicken curry please",
+    "eggs, milk, flour, sugar, butter",
+    "I have rice, chicken and broccoli",
+    "сделай салат цезарь",
+    "приготовь омлет",
+    "мука, сахар, яйца, сливочное масло, разрыхлитель, ванилин, какао, молоко",
+    "ну вот у меня в холодильнике лежит кабачок, полбанки сметаны и немного фарша",
+    "make lasagna",
+    "ingredients: tofu, soy sauce, ginger",
+]
+
+# Распознанные голосовые и пограничные случаи для определения намерения
+INTENT_CORPUS = USER_MESSAGES + [
+    "рецепты блинов на кефире",
+    "рецептура",
+    "спасибо!",
+    "Спасибо за рецепт",
+    "дай рецепт пожалуйста борща",
+    "Приготовь, пожалуйста, омлет",
+    "как готовить гречку с грибами в мультиварке",
+    "куриное филе две штуки помидоры черри моцарелла базилик",
+    "cookies",
+    "thank you",
+    "i want to make something with tuna and pasta",
+    "   ",
+]
+
+LLM_RESPONSES = [
+    '["mix", "soup", "main", "salad"]',
+    '```json\n["main", "soup"]\n```',
+    'Вот категории: ["breakfast", "dessert"]. Приятного аппетита!',
+    '{"valid": true, "reason": "продукты"}',
+    '```json\n[{"name": "Омлет с сыром", "desc": "Нежный омлет"}, {"name": "Сырники", "desc": "Пышные"},'
+    ' {"name": "Запеканка", "desc": "Как в детском саду"}, {"name": "Блины", "desc": "Тонкие"}]\n```',
+    'Конечно! Вот меню:\n[{"name": "Soup (Суп)", "desc": "Лёгкий"}, {"name": "Main course (Второе блюдо)", "desc": "Сытное"}]',
+]
+
+RECIPE_SNIPPET = (
+    "🍽️ <b>Борщ</b>\n\n📦 <b>Ингредиенты:</b>\n🔸 Свёкла - 2 шт\n🔸 Капуста - 300 г\n"
+    "🔸 Картофель - 3 шт\n🔸 Морковь - 1 шт\n\n⏱ <b>Время:</b> 90 минут\n👥 <b>Порции:</b> 4 человека\n"
+)
+
+CATEGORIES = ["mix", "soup", "main", "salad"]
+DISHES = [{"name": f"Блюдо номер {i} с длинным названием для кнопки", "desc": "Аппетитное описание"} for i in range(6)]
+HISTORY = [
+    {"role": "bot" if i % 2 else "user", "text": RECIPE_SNIPPET * 3, "timestamp": "2026-01-19T12:00:00"}
+    for i in range(8)
+]
+
+# ==================== БЕНЧМАРКИ ====================
+
+def build_benchmarks() -> dict:
+    """name -> функция без аргументов, которая проходит по корпусу один раз"""
+    import handlers
+    from database import jsonb_encode, jsonb_decode
+    from recipe_bodies import make_body
+    from recipe_parser import parse_recipe
+    from pantry import _Postings
+    from groq_service import GroqService
+    from intent import intent_engine
+
+    def over(func, corpus):
+        def run():
+            for item in corpus:
+                func(item)
+        run.ops = len(corpus)
+        return run
+
+    def once(func):
+        def run():
+            func()
+        run.ops = 1
+        return run
+
+    long_inputs = [msg * 12 for msg in USER_MESSAGES[:5]]
+    session_json = (CATEGORIES, DISHES, HISTORY)
+    session_text = [json.dumps(value) for value in session_json]
+    session_wire = [jsonb_encode(value) for value in session_json]
+    # Индекс на 10 000 рецептов из словаря в 300 ингредиентов
+    rng = random.Random(0)
+    vocabulary = ["свекла", "капуста", "картофель", "морковь", "лук"] + [f"продукт {i}" for i in range(295)]
+    pantry = _Postings.build([
+        {"hash": i.to_bytes(4, "big"), "dish_name": f"Блюдо {i}", "ingredients": rng.sample(vocabulary, rng.randint(3, 10))}
+        for i in range(10_000)
+    ])
+
+    return {
+        "intent.detect": over(intent_engine.detect, INTENT_CORPUS),
+        "groq.sanitize_input": over(GroqService._sanitize_input, USER_MESSAGES + long_inputs),
+        "groq.extract_json": over(GroqService._extract_json, LLM_RESPONSES),
+        "groq.detect_input_language": over(GroqService._detect_input_language, USER_MESSAGES + [RECIPE_SNIPPET]),
+        "keyboard.confirmation": once(handlers.get_confirmation_keyboard),
+        "keyboard.categories": once(lambda: handlers.get_categories_keyboard(CATEGORIES)),
+        "keyboard.dishes": once(lambda: handlers.get_dishes_keyboard(DISHES)),
+        # Сериализация jsonb-полей на одну запись сессии: было (json.dumps) и стало (кодек пула)
+        "session.encode.stdlib": once(lambda: [json.dumps(value) for value in session_json]),
+        "session.encode.jsonb": once(lambda: [jsonb_encode(value) for value in session_json]),
+        "session.decode.stdlib": once(lambda: [json.loads(value) for value in session_text]),
+        "session.decode.jsonb": once(lambda: [jsonb_decode(value) for value in session_wire]),
+        "recipe.make_body": once(lambda: make_body(RECIPE_SNIPPET)),
+        "recipe.parse": once(lambda: parse_recipe(RECIPE_SNIPPET)),
+        "pantry.match": once(lambda: pantry.match("свекла, капуста, картофель, морковь, лук", 3, 0.8)),
+    }
+
+def measure(func, min_time: float = 0.1, repeat: int = 7) -> float:
+    """Лучшее время одного вызова (в микросекундах); GC на время замера выключен, как в timeit"""
+    gc.collect()
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _measure(func, min_time, repeat)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+def _measure(func, min_time: float, repeat: int) -> float:
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed == 0 else max(2, int(min_time / elapsed) + 1)
+
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best / func.ops * 1e6
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Микробенчмарки горячих функций бота")
+    parser.add_argument("-k", dest="keyword", default="", help="запускать только бенчмарки с подстрокой")
+    parser.add_argument("--save", action="store_true", help="сохранить результаты как baseline")
+    parser.add_argument("--compare", action="store_true", help="сравнить с baseline и упасть при регрессии")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=0.2, help="допустимое замедление (0.2 = +20%%)")
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+
+    benchmarks = {name: func for name, func in build_benchmarks().items() if args.keyword in name}
+
+    baseline = {}
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"❌ Baseline не найден: {args.baseline} (сначала запустите с --save)")
+            return 2
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    regressions = []
+    print(f"{'benchmark':<30}{'µs/op':>12}{'baseline':>12}{'Δ':>9}")
+    for name, func in benchmarks.items():
+        value = measure(func, repeat=args.repeat)
+        results[name] = value
+        line = f"{name:<30}{value:>12.3f}"
+        if name in baseline:
+            delta = value / baseline[name] - 1
+            line += f"{baseline[name]:>12.3f}{delta:>+9.1%}"
+            if delta > args.threshold:
+                regressions.append(name)
+                line += "  ❌"
+        print(line)
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "results": results}, f, indent=2)
+        print(f"💾 Baseline сохранён: {args.baseline}")
+
+    if regressions:
+        print(f"❌ Регрессия больше {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
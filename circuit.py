@@ -0,0 +1,81 @@
+import logging
+import time
+
+from metrics import CIRCUIT_STATE
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+class CircuitBreaker:
+    """Размыкатель для внешней зависимости.
+
+    После failure_threshold сбоев подряд цепь размыкается: вызовы сразу
+    отклоняются, не дожидаясь таймаутов. Через reset_timeout пропускается
+    один пробный вызов (half-open): успех замыкает цепь, сбой снова
+    размыкает её на reset_timeout.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 10.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        CIRCUIT_STATE.labels(name).set(0)
+
+    def _set_state(self, state: str):
+        if state == self.state:
+            return
+        self.state = state
+        CIRCUIT_STATE.labels(self.name).set(_STATE_VALUES[state])
+        if state == OPEN:
+            logger.warning(f"🔌 {self.name}: цепь разомкнута на {self.reset_timeout:.0f} сек")
+        elif state == CLOSED:
+            logger.info(f"🔌 {self.name}: цепь снова замкнута")
+
+    @property
+    def closed(self) -> bool:
+        return self.state == CLOSED
+
+    def allow(self) -> bool:
+        """Можно ли сейчас выполнять вызов"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._set_state(HALF_OPEN)
+        # half-open: только один пробный вызов за раз
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def record_success(self):
+        self._probe_in_flight = False
+        self.failures = 0
+        self._set_state(CLOSED)
+
+    def record_failure(self):
+        self._probe_in_flight = False
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+    def record_neutral(self):
+        """Вызов завершился без вердикта о здоровье (отмена, ошибка запроса)"""
+        if self._probe_in_flight:
+            self._probe_in_flight = False
+            self.failures = 0
+            self._set_state(CLOSED)
+
+    def snapshot(self) -> dict:
+        return {"state": self.state, "failures": self.failures}
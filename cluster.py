@@ -0,0 +1,277 @@
+"""Горизонтальное масштабирование: диспетчер + N воркеров.
+
+Сессии живут в памяти воркера (StateManagerDB._cache), поэтому все апдейты
+одного пользователя должны попадать на один и тот же воркер. Диспетчер
+принимает апдейты от Telegram (webhook или polling) и пересылает каждый
+на воркер, выбранный rendezvous-хешированием user_id по живым воркерам.
+
+Воркеры регистрируются heartbeat'ами. Когда воркер приходит или уходит,
+меняется владелец только у ~1/N пользователей; первый апдейт такого
+пользователя помечается заголовком X-Shard-Moved, и новый воркер
+перечитывает сессию из БД вместо устаревшего кеша.
+"""
+import asyncio
+import hashlib
+import hmac
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from config import (
+    CLUSTER_SECRET, DISPATCHER_URL, WORKER_URL, WORKER_ID,
+    CLUSTER_HEARTBEAT_SECONDS, CLUSTER_WORKER_TTL
+)
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Cluster-Secret"
+MOVED_HEADER = "X-Shard-Moved"
+FORWARD_TIMEOUT = 10
+MAX_TRACKED_USERS = 200_000
+
+# Поля апдейта, в которых лежит объект с отправителем
+_USER_FIELDS = (
+    "message", "edited_message", "callback_query", "inline_query", "chosen_inline_result",
+    "shipping_query", "pre_checkout_query", "my_chat_member", "chat_member", "chat_join_request",
+)
+
+def shard_key(update: Dict[str, Any]) -> int:
+    """user_id отправителя (или chat_id), иначе update_id — такие апдейты ни к кому не привязаны"""
+    for field in _USER_FIELDS:
+        payload = update.get(field)
+        if not payload:
+            continue
+        user = payload.get("from")
+        if user:
+            return user["id"]
+        chat = payload.get("chat")
+        if chat:
+            return chat["id"]
+    return update.get("update_id", 0)
+
+def _score(worker_id: str, key: int) -> int:
+    digest = hashlib.blake2b(f"{worker_id}:{key}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+def rank_workers(key: int, worker_ids: List[str]) -> List[str]:
+    """Rendezvous (HRW) хеширование: первый — владелец, дальше — запасные"""
+    return sorted(worker_ids, key=lambda worker_id: _score(worker_id, key), reverse=True)
+
+def _check_secret(request: web.Request):
+    if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), CLUSTER_SECRET):
+        raise web.HTTPForbidden()
+
+# ==================== ДИСПЕТЧЕР ====================
+
+class WorkerRegistry:
+    """Живые воркеры по heartbeat'ам"""
+
+    def __init__(self, ttl: float = CLUSTER_WORKER_TTL):
+        self.ttl = ttl
+        self._workers: Dict[str, Dict[str, Any]] = {}
+
+    def heartbeat(self, worker_id: str, url: str):
+        worker = self._workers.get(worker_id)
+        if worker is None or not self._is_alive(worker):
+            logger.info(f"➕ Воркер {worker_id} в кластере: {url}")
+        self._workers[worker_id] = {"url": url, "seen": time.monotonic()}
+
+    def remove(self, worker_id: str, reason: str):
+        if self._workers.pop(worker_id, None) is not None:
+            logger.warning(f"➖ Воркер {worker_id} выведен из кластера: {reason}")
+
+    def _is_alive(self, worker: Dict[str, Any]) -> bool:
+        return time.monotonic() - worker["seen"] < self.ttl
+
+    def alive(self) -> Dict[str, str]:
+        for worker_id, worker in list(self._workers.items()):
+            if not self._is_alive(worker):
+                self.remove(worker_id, "нет heartbeat")
+        return {worker_id: worker["url"] for worker_id, worker in self._workers.items()}
+
+class NoWorkersAvailable(Exception):
+    pass
+
+class ClusterDispatcher:
+    """Принимает апдейты и пересылает их воркеру-владельцу пользователя"""
+
+    def __init__(self):
+        self.registry = WorkerRegistry()
+        self.forwarded = 0
+        self.moved = 0
+        self._owners: "OrderedDict[int, str]" = OrderedDict()
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _remember_owner(self, key: int, worker_id: str) -> bool:
+        """Запоминает владельца; True, если пользователь переехал с другого воркера"""
+        previous = self._owners.pop(key, None)
+        self._owners[key] = worker_id
+        if len(self._owners) > MAX_TRACKED_USERS:
+            self._owners.popitem(last=False)
+        return previous is not None and previous != worker_id
+
+    async def forward(self, update: Dict[str, Any]):
+        key = shard_key(update)
+        workers = self.registry.alive()
+        if not workers:
+            raise NoWorkersAvailable("нет живых воркеров")
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=FORWARD_TIMEOUT))
+
+        for worker_id in rank_workers(key, list(workers)):
+            moved = self._remember_owner(key, worker_id)
+            try:
+                async with self._session.post(
+                    f"{workers[worker_id]}/worker/update",
+                    json=update,
+                    headers={SECRET_HEADER: CLUSTER_SECRET, MOVED_HEADER: "1" if moved else "0"},
+                ) as response:
+                    if response.status == 200:
+                        self.forwarded += 1
+                        self.moved += moved
+                        return
+                    reason = f"HTTP {response.status}"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                reason = repr(e)
+            # Воркер недоступен — следующий по рейтингу становится владельцем
+            self.registry.remove(worker_id, reason)
+        raise NoWorkersAvailable("ни один воркер не принял апдейт")
+
+    # --- HTTP ---
+
+    async def handle_heartbeat(self, request: web.Request) -> web.Response:
+        _check_secret(request)
+        data = await request.json()
+        self.registry.heartbeat(data["worker_id"], data["url"])
+        return web.json_response({"ok": True})
+
+    async def handle_leave(self, request: web.Request) -> web.Response:
+        _check_secret(request)
+        data = await request.json()
+        self.registry.remove(data["worker_id"], "штатная остановка")
+        return web.json_response({"ok": True})
+
+    async def handle_status(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "workers": self.registry.alive(),
+            "forwarded": self.forwarded,
+            "moved": self.moved,
+            "tracked_users": len(self._owners),
+        })
+
+    def make_webhook_handler(self, secret_token: Optional[str]):
+        """Webhook от Telegram: 200 — апдейт у воркера, 503 — Telegram повторит позже"""
+        async def handle_webhook(request: web.Request) -> web.Response:
+            if secret_token and not hmac.compare_digest(
+                request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), secret_token
+            ):
+                raise web.HTTPUnauthorized()
+            try:
+                await self.forward(await request.json())
+            except NoWorkersAvailable as e:
+                logger.error(f"❌ Апдейт не доставлен: {e}")
+                return web.Response(status=503)
+            return web.Response()
+        return handle_webhook
+
+    def register(self, app: web.Application, webhook_path: Optional[str] = None, secret_token: Optional[str] = None):
+        app.router.add_post("/cluster/heartbeat", self.handle_heartbeat)
+        app.router.add_post("/cluster/leave", self.handle_leave)
+        app.router.add_get("/cluster/status", self.handle_status)
+        if webhook_path:
+            app.router.add_post(webhook_path, self.make_webhook_handler(secret_token))
+
+    async def poll(self, bot: Bot, allowed_updates: List[str]):
+        """Long polling: offset сдвигается только после доставки апдейта воркеру"""
+        offset = None
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+            except Exception as e:
+                logger.error(f"Ошибка getUpdates: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                raw = update.model_dump(mode="json", by_alias=True, exclude_none=True)
+                while True:
+                    try:
+                        await self.forward(raw)
+                        break
+                    except NoWorkersAvailable as e:
+                        logger.error(f"❌ {e}, повтор через 2 сек")
+                        await asyncio.sleep(2)
+                offset = update.update_id + 1
+
+    async def close(self):
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+# ==================== ВОРКЕР ====================
+
+class WorkerAgent:
+    """Принимает пересланные апдейты и держит регистрацию у диспетчера"""
+
+    def __init__(self, dp: Dispatcher, bot: Bot):
+        self.dp = dp
+        self.bot = bot
+        self.worker_id = WORKER_ID or WORKER_URL
+        self._tasks = set()
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        _check_secret(request)
+        update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        moved = request.headers.get(MOVED_HEADER) == "1"
+        # Как handle_in_background у webhook: диспетчер сразу получает 200
+        task = asyncio.create_task(self.dp.feed_update(self.bot, update, shard_moved=moved))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    def register(self, app: web.Application):
+        app.router.add_post("/worker/update", self.handle_update)
+
+    async def _post(self, path: str):
+        async with self._session.post(
+            f"{DISPATCHER_URL}{path}",
+            json={"worker_id": self.worker_id, "url": WORKER_URL},
+            headers={SECRET_HEADER: CLUSTER_SECRET},
+        ) as response:
+            response.raise_for_status()
+
+    async def _heartbeat_loop(self):
+        while True:
+            try:
+                await self._post("/cluster/heartbeat")
+            except Exception as e:
+                logger.warning(f"Heartbeat диспетчеру не прошёл: {e}")
+            await asyncio.sleep(CLUSTER_HEARTBEAT_SECONDS)
+
+    async def join(self):
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5))
+        await self._post("/cluster/heartbeat")
+        self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+        logger.info(f"🧩 Воркер {self.worker_id} зарегистрирован у {DISPATCHER_URL}")
+
+    async def leave(self):
+        if self._heartbeat:
+            self._heartbeat.cancel()
+        if self._session:
+            try:
+                await self._post("/cluster/leave")
+            except Exception as e:
+                logger.warning(f"Не удалось выйти из кластера: {e}")
+            await self._session.close()
+        # Даём дообработаться уже принятым апдейтам
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=30)
+
+# Глобальный экземпляр (используется в роли dispatcher)
+cluster_dispatcher = ClusterDispatcher()
@@ -22,4 +22,120 @@ GROQ_MAX_TOKENS = 2000
 TEMP_DIR = "temp"
 os.makedirs(TEMP_DIR, exist_ok=True)
 
-MAX_HISTORY_MESSAGES = 8
\ No newline at end of file
+MAX_HISTORY_MESSAGES = 8
+
+# Режим получения обновлений: "polling" или "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+if BOT_MODE == "webhook" and not WEBHOOK_BASE_URL:
+    raise ValueError("WEBHOOK_BASE_URL обязателен в режиме BOT_MODE=webhook!")
+# Без секрета маршрут вебхука принимал бы апдейты от кого угодно
+if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+    raise ValueError("WEBHOOK_SECRET обязателен в режиме BOT_MODE=webhook!")
+
+# Лимиты исходящих запросов к Telegram (сообщений в секунду)
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "25"))
+TG_CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))
+TG_CHAT_BURST = float(os.getenv("TG_CHAT_BURST", "3"))
+TG_GROUP_RATE = float(os.getenv("TG_GROUP_RATE", str(20 / 60)))
+TG_MAX_RETRIES = int(os.getenv("TG_MAX_RETRIES", "3"))
+
+# Окно склейки быстрых сообщений с продуктами (0 — выключено)
+INPUT_DEBOUNCE_SECONDS = float(os.getenv("INPUT_DEBOUNCE_SECONDS", "1.2"))
+INPUT_DEBOUNCE_MAX_SECONDS = float(os.getenv("INPUT_DEBOUNCE_MAX_SECONDS", "2.5"))
+
+# Допуск дорогих потоков: (одновременно выполняется, максимум в очереди)
+FLOW_LIMITS = {
+    "recipe": (int(os.getenv("RECIPE_MAX_CONCURRENCY", "8")), int(os.getenv("RECIPE_MAX_QUEUE", "40"))),
+    "menu": (int(os.getenv("MENU_MAX_CONCURRENCY", "8")), int(os.getenv("MENU_MAX_QUEUE", "40"))),
+    "voice": (int(os.getenv("VOICE_MAX_CONCURRENCY", "4")), int(os.getenv("VOICE_MAX_QUEUE", "20"))),
+}
+
+# Трейсинг: "" (выключен), "jsonl" или "otlp"
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "").lower()
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.05"))
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", "5"))
+TRACE_FILE = os.getenv("TRACE_FILE", "traces/traces.jsonl")
+TRACE_FILE_MAX_BYTES = int(os.getenv("TRACE_FILE_MAX_BYTES", str(20 * 1024 * 1024)))
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+
+# Мониторинг event loop: порог «зависания» и токен для /debug/* (без токена эндпоинты выключены)
+LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", "0.1"))
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.05"))
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN", "")
+
+# Кластер: "single" (один процесс), "dispatcher" (принимает апдейты и раздаёт) или "worker"
+CLUSTER_ROLE = os.getenv("CLUSTER_ROLE", "single").lower()
+CLUSTER_SECRET = os.getenv("CLUSTER_SECRET", "")
+DISPATCHER_URL = os.getenv("DISPATCHER_URL", "").rstrip("/")
+WORKER_URL = os.getenv("WORKER_URL", "").rstrip("/")
+WORKER_ID = os.getenv("WORKER_ID", "")
+CLUSTER_HEARTBEAT_SECONDS = float(os.getenv("CLUSTER_HEARTBEAT_SECONDS", "5"))
+CLUSTER_WORKER_TTL = float(os.getenv("CLUSTER_WORKER_TTL", "15"))
+if CLUSTER_ROLE not in ("single", "dispatcher", "worker"):
+    raise ValueError(f"Неизвестный CLUSTER_ROLE: {CLUSTER_ROLE}")
+if CLUSTER_ROLE != "single" and not CLUSTER_SECRET:
+    raise ValueError("CLUSTER_SECRET обязателен для CLUSTER_ROLE=dispatcher/worker!")
+if CLUSTER_ROLE == "worker" and not (DISPATCHER_URL and WORKER_URL):
+    raise ValueError("Для CLUSTER_ROLE=worker нужны DISPATCHER_URL и WORKER_URL!")
+
+# Хранилище сессий: "postgres" (по умолчанию), "local" (только память) или "redis" (общее для инстансов)
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "postgres").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# Фоновые задачи: lease advisory lock продлевается раз в JOB_LEASE_SECONDS.
+# Нужно прямое соединение: через transaction pooler (порт 6543) задачи не запускаются
+JOBS_DATABASE_URL = os.getenv("JOBS_DATABASE_URL", DATABASE_URL)
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "15"))
+SESSION_RETENTION_DAYS = int(os.getenv("SESSION_RETENTION_DAYS", "7"))
+
+# Деградация при проблемах с БД: дедлайн на вызов, размыкатель и журнал записей
+DB_CALL_TIMEOUT = float(os.getenv("DB_CALL_TIMEOUT", "5"))
+DB_BREAKER_FAILURES = int(os.getenv("DB_BREAKER_FAILURES", "5"))
+DB_BREAKER_RESET_SECONDS = float(os.getenv("DB_BREAKER_RESET_SECONDS", "10"))
+DB_JOURNAL_PATH = os.getenv("DB_JOURNAL_PATH", "journal/writes.jsonl")
+DB_JOURNAL_REPLAY_BATCH = int(os.getenv("DB_JOURNAL_REPLAY_BATCH", "50"))
+# Предел журнала: без БД (или при долгом сбое) он иначе растёт без ограничений
+DB_JOURNAL_MAX_MB = float(os.getenv("DB_JOURNAL_MAX_MB", "100"))
+
+# Пул соединений: границы и адаптивный предел (растёт, пока ожидание соединения дольше DB_POOL_WAIT_TARGET)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_ADAPTIVE = os.getenv("DB_POOL_ADAPTIVE", "1") == "1"
+DB_POOL_WAIT_TARGET = float(os.getenv("DB_POOL_WAIT_TARGET", "0.02"))
+if DB_POOL_MIN_SIZE > DB_POOL_MAX_SIZE:
+    raise ValueError("DB_POOL_MIN_SIZE не может быть больше DB_POOL_MAX_SIZE!")
+
+# Режим подключения к БД: "auto" (по адресу), "direct", "session" или "transaction" (пулер,
+# prepared statements не переживают транзакцию — кеш выключен, горячие запросы идут через функции из migrations/003)
+DB_POOL_MODE = os.getenv("DB_POOL_MODE", "auto").lower()
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+if DB_POOL_MODE not in ("auto", "direct", "session", "transaction"):
+    raise ValueError(f"Неизвестный DB_POOL_MODE: {DB_POOL_MODE}")
+
+# Ответ на "Дай рецепт X" из сохранённых рецептов (полнотекстовый поиск) вместо запроса к Groq
+RECIPE_SEARCH_CACHE = os.getenv("RECIPE_SEARCH_CACHE", "1") == "1"
+RECIPE_SEARCH_EXTRA_TERMS = int(os.getenv("RECIPE_SEARCH_EXTRA_TERMS", "1"))
+
+# История рецептов в /stats: размер страницы и время жизни кеша страниц (сек)
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "5"))
+HISTORY_CACHE_SECONDS = float(os.getenv("HISTORY_CACHE_SECONDS", "60"))
+
+# recipes секционирована по месяцам (migrations/007): сколько секций создавать вперёд
+# и сколько месяцев хранить (0 — хранить всё; старые секции удаляются целиком)
+RECIPE_PARTITIONS_AHEAD = int(os.getenv("RECIPE_PARTITIONS_AHEAD", "3"))
+RECIPE_RETENTION_MONTHS = int(os.getenv("RECIPE_RETENTION_MONTHS", "0"))
+
+# Мгновенные подсказки из сохранённых рецептов по продуктам пользователя (0 — выключено):
+# сколько предлагать, минимальная доля ингредиентов рецепта, которые есть у пользователя,
+# и как часто (сек) перечитывать индекс из БД — рецепты с других инстансов
+PANTRY_SUGGESTIONS = int(os.getenv("PANTRY_SUGGESTIONS", "3"))
+PANTRY_MIN_COVERAGE = float(os.getenv("PANTRY_MIN_COVERAGE", "0.8"))
+PANTRY_INDEX_REFRESH_SECONDS = float(os.getenv("PANTRY_INDEX_REFRESH_SECONDS", "600"))
+
+# /quick: сохранённые рецепты, которые готовятся не дольше QUICK_RECIPE_MINUTES (migrations/008)
+QUICK_RECIPE_MINUTES = int(os.getenv("QUICK_RECIPE_MINUTES", "30"))
+QUICK_RECIPE_LIMIT = int(os.getenv("QUICK_RECIPE_LIMIT", "5"))
\ No newline at end of file
@@ -1,42 +1,340 @@
 import asyncpg
-from typing import List, Dict, Any, Optional
+import asyncio
+import functools
+import os
+import socket
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from urllib.parse import urlparse
+from typing import Awaitable, Callable, List, Dict, Any, Optional
 import json
 import logging
 from datetime import datetime
-from config import DATABASE_URL  # Импортируем из config.py
+from config import (  # Импортируем из config.py
+    DATABASE_URL, JOBS_DATABASE_URL, JOB_LEASE_SECONDS,
+    DB_CALL_TIMEOUT, DB_BREAKER_FAILURES, DB_BREAKER_RESET_SECONDS,
+    DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_ADAPTIVE, DB_POOL_WAIT_TARGET,
+    DB_POOL_MODE, DB_STATEMENT_CACHE_SIZE
+)
+from metrics import (
+    observe_db, JOB_LAST_DURATION_SECONDS, JOB_LEADER, JOB_ERRORS, RECIPE_STORAGE_BYTES, RECIPE_BODIES,
+    DB_POOL_ACQUIRE_SECONDS, DB_POOL_IN_USE, DB_POOL_WAITING, DB_POOL_LIMIT, DB_POOL_OPEN
+)
+from circuit import CircuitBreaker
+import recipe_bodies
+import recipe_parser
+
+try:
+    import orjson  # Быстрый JSON для jsonb; без него — стандартный json
+except ImportError:
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+# ==================== JSONB ====================
+
+# Версия бинарного формата jsonb в протоколе PostgreSQL
+_JSONB_VERSION = b"\x01"
+
+if orjson is not None:
+    JSONB_FORMAT = "binary"
+
+    def jsonb_encode(value: Any) -> bytes:
+        return _JSONB_VERSION + orjson.dumps(value)
+
+    def jsonb_decode(data: bytes) -> Any:
+        return orjson.loads(data[1:])
+else:
+    JSONB_FORMAT = "text"
+
+    def jsonb_encode(value: Any) -> str:
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+    jsonb_decode = json.loads
+
+async def _init_connection(conn: asyncpg.Connection):
+    """Кодек jsonb на каждом соединении пула: list/dict пишутся и читаются без ручного json"""
+    await conn.set_type_codec(
+        "jsonb", schema="pg_catalog", encoder=jsonb_encode, decoder=jsonb_decode, format=JSONB_FORMAT
+    )
+
+# ==================== РЕЖИМ ПОДКЛЮЧЕНИЯ ====================
+
+# Порт transaction pooler Supabase (Supavisor); session pooler слушает 5432
+TRANSACTION_POOLER_PORT = 6543
+
+# Функции горячих путей для transaction pooler (migrations/003_hot_path_functions.sql)
+HOT_PATH_FUNCTIONS = ("bot_upsert_session", "bot_get_session", "bot_save_recipe")
+
+def detect_pool_mode(dsn: str, configured: str = "auto") -> str:
+    """direct, session или transaction: явно из DB_POOL_MODE либо по адресу подключения"""
+    if configured != "auto":
+        return configured
+    parsed = urlparse(dsn or "")
+    try:
+        port = parsed.port
+    except ValueError:
+        port = None
+    if port == TRANSACTION_POOLER_PORT:
+        return "transaction"
+    if parsed.hostname and ".pooler." in parsed.hostname:
+        return "session"
+    return "direct"
+
+# jsonb-поля сессии и их значение по умолчанию
+SESSION_JSON_FIELDS = {"categories": [], "generated_dishes": [], "history": []}
+
+class DatabaseUnavailable(Exception):
+    """БД недоступна: нет пула, размыкатель разомкнут или вызов не уложился в дедлайн"""
+
+# Сбои связи с БД (в отличие от ошибок самого запроса) — повод разомкнуть цепь
+TRANSIENT_ERRORS = (
+    asyncio.TimeoutError,
+    OSError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.InterfaceError,
+    asyncpg.CannotConnectNowError,
+    asyncpg.TooManyConnectionsError,
+    asyncpg.QueryCanceledError,
+)
+
+def guarded(func=None, *, timeout: Optional[float] = None):
+    """Дедлайн на вызов метода Database (DB_CALL_TIMEOUT или timeout) и учёт в размыкателе"""
+    if func is None:
+        return functools.partial(guarded, timeout=timeout)
+
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        if self.pool is None:
+            raise DatabaseUnavailable("нет подключения к БД")
+        if not self.breaker.allow():
+            raise DatabaseUnavailable("размыкатель БД разомкнут")
+        try:
+            result = await asyncio.wait_for(func(self, *args, **kwargs), timeout or self.call_timeout)
+        except TRANSIENT_ERRORS as e:
+            self.breaker.record_failure()
+            raise DatabaseUnavailable(f"{func.__name__}: {e!r}") from e
+        except BaseException:
+            self.breaker.record_neutral()
+            raise
+        self.breaker.record_success()
+        return result
+
+    return wrapper
+
+class AdaptivePoolLimit:
+    """Предел одновременно занятых соединений пула.
+
+    asyncpg не меняет размер живого пула, поэтому пул создаётся на
+    max_size, а фактический предел держит этот счётчик. Раз в WINDOW
+    секунд он смотрит на ожидание соединения: дольше wait_target —
+    предел растёт, соединения простаивают — снижается. Лишние
+    простаивающие соединения пул закрывает сам
+    (max_inactive_connection_lifetime).
+    """
+
+    WINDOW = 2.0
+
+    def __init__(self, min_size: int, max_size: int, wait_target: float, adaptive: bool = True):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.wait_target = wait_target
+        self.adaptive = adaptive
+        self.limit = min_size if adaptive else max_size
+        self.in_use = 0
+        self._waiters: deque = deque()
+        self._window_start = time.monotonic()
+        self._window_waits = 0.0
+        self._window_count = 0
+        self._window_peak = 0
+        DB_POOL_LIMIT.set(self.limit)
+
+    async def acquire(self) -> float:
+        """Ждёт свободный слот; возвращает время ожидания"""
+        start = time.monotonic()
+        if self.in_use < self.limit and not self._waiters:
+            self.in_use += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            DB_POOL_WAITING.set(len(self._waiters))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # Слот успели передать, а задачу уже отменили — возвращаем его
+                if waiter.done() and not waiter.cancelled():
+                    self.release()
+                raise
+        waited = time.monotonic() - start
+        self._observe(waited)
+        DB_POOL_IN_USE.set(self.in_use)
+        return waited
+
+    def release(self):
+        self.in_use -= 1
+        self._wake()
+        DB_POOL_IN_USE.set(self.in_use)
+
+    def _wake(self):
+        while self._waiters and self.in_use < self.limit:
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue  # ожидавшего отменили
+            self.in_use += 1
+            waiter.set_result(None)
+        DB_POOL_WAITING.set(len(self._waiters))
+
+    def _observe(self, waited: float):
+        self._window_waits += waited
+        self._window_count += 1
+        self._window_peak = max(self._window_peak, self.in_use)
+        now = time.monotonic()
+        if now - self._window_start < self.WINDOW:
+            return
+
+        mean_wait = self._window_waits / self._window_count
+        if self.adaptive:
+            if mean_wait > self.wait_target and self.limit < self.max_size:
+                # Растём сразу на длину очереди: ждущим нужны соединения сейчас
+                self._resize(min(self.max_size, self.limit + max(1, len(self._waiters))), mean_wait)
+            elif mean_wait < self.wait_target / 4 and self._window_peak < self.limit and self.limit > self.min_size:
+                self._resize(self.limit - 1, mean_wait)
+        self._window_start = now
+        self._window_waits = 0.0
+        self._window_count = 0
+        self._window_peak = self.in_use
+
+    def _resize(self, limit: int, mean_wait: float):
+        logger.info(f"🔧 Пул БД: предел {self.limit} → {limit} (ожидание {mean_wait * 1000:.1f} мс)")
+        self.limit = limit
+        DB_POOL_LIMIT.set(limit)
+        self._wake()
+
+    def snapshot(self) -> dict:
+        return {
+            "limit": self.limit, "in_use": self.in_use, "waiting": len(self._waiters),
+            "min_size": self.min_size, "max_size": self.max_size, "adaptive": self.adaptive,
+        }
+
+class _SharedConnection:
+    """Соединение, закреплённое за логической операцией (см. Database.connection)"""
+
+    def __init__(self, conn: asyncpg.Connection):
+        self.conn: Optional[asyncpg.Connection] = conn
+        # Задачи, порождённые внутри операции, наследуют контекст — не даём
+        # им выполнять запросы на одном соединении одновременно
+        self.lock = asyncio.Lock()
+
+_shared_connection: ContextVar[Optional[_SharedConnection]] = ContextVar("db_shared_connection", default=None)
+
 class Database:
     def __init__(self):
         self.pool: Optional[asyncpg.Pool] = None
+        self.pool_mode = detect_pool_mode(DATABASE_URL, DB_POOL_MODE)
+        # В transaction-режиме горячие запросы идут через серверные функции (если они есть)
+        self.use_functions = False
+        # Тела рецептов в recipe_bodies (migrations/005); до миграции — текстом в recipes
+        self.has_recipe_bodies = False
+        # recipes секционирована по месяцам (migrations/007)
+        self.recipes_partitioned = False
+        # Разобранная структура рецепта в recipe_bodies (migrations/008)
+        self.has_recipe_structure = False
+        # Последний снимок объёма хранения рецептов (фоновая задача recipe_bodies_compact)
+        self.recipe_storage: Dict[str, int] = {}
+        self.limit = AdaptivePoolLimit(DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_WAIT_TARGET, DB_POOL_ADAPTIVE)
+        self.call_timeout = DB_CALL_TIMEOUT
+        self.breaker = CircuitBreaker("database", DB_BREAKER_FAILURES, DB_BREAKER_RESET_SECONDS)
+
+    @property
+    def available(self) -> bool:
+        """Пул есть и размыкатель не запрещает вызовы"""
+        return self.pool is not None and self.breaker.state != "open"
 
     async def connect(self):
         """Подключение к базе данных Supabase"""
+        transaction_pooler = self.pool_mode == "transaction"
         try:
             self.pool = await asyncpg.create_pool(
                 DATABASE_URL,
-                min_size=1,
-                max_size=5,
-                statement_cache_size=0,  # КРИТИЧЕСКИ ВАЖНО для Supabase
+                min_size=DB_POOL_MIN_SIZE,
+                max_size=DB_POOL_MAX_SIZE,
+                # Transaction pooler отдаёт каждую транзакцию любому серверному соединению:
+                # prepared statements там КРИТИЧЕСКИ нельзя кешировать
+                statement_cache_size=0 if transaction_pooler else DB_STATEMENT_CACHE_SIZE,
                 command_timeout=60,
-                max_inactive_connection_lifetime=300
+                max_inactive_connection_lifetime=300,
+                init=_init_connection
             )
             await self._check_tables()
-            logger.info("✅ Успешное подключение к Supabase PostgreSQL")
+            async with self.acquire() as conn:
+                self.has_recipe_bodies = await conn.fetchval("SELECT to_regclass('recipe_bodies') IS NOT NULL")
+                self.recipes_partitioned = await conn.fetchval(
+                    "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('recipes'))"
+                )
+                self.has_recipe_structure = await conn.fetchval(
+                    """
+                    SELECT EXISTS (SELECT 1 FROM information_schema.columns
+                                   WHERE table_name = 'recipe_bodies' AND column_name = 'structure')
+                    """
+                )
+            if transaction_pooler:
+                await self._check_functions()
+            logger.info(f"✅ Успешное подключение к Supabase PostgreSQL (режим {self.pool_mode})")
         except Exception as e:
             logger.error(f"❌ Ошибка подключения к БД: {e}")
             raise
 
+    @asynccontextmanager
+    async def acquire(self):
+        """Соединение из пула с учётом адаптивного предела и метрик ожидания.
+
+        Внутри connection() отдаёт уже взятое операцией соединение.
+        """
+        shared = _shared_connection.get()
+        if shared is not None and shared.conn is not None:
+            async with shared.lock:
+                yield shared.conn
+            return
+
+        start = time.perf_counter()
+        await asyncio.wait_for(self.limit.acquire(), self.call_timeout)
+        try:
+            async with self.pool.acquire(timeout=self.call_timeout) as conn:
+                DB_POOL_ACQUIRE_SECONDS.observe(time.perf_counter() - start)
+                DB_POOL_OPEN.set(self.pool.get_size())
+                yield conn
+        finally:
+            self.limit.release()
+
+    @asynccontextmanager
+    async def connection(self):
+        """Одно соединение на логическую операцию: методы Database внутри
+        блока выполняются на нём, а не берут из пула каждый своё"""
+        if self.pool is None or not self.breaker.closed or _shared_connection.get() is not None:
+            # Без пула методы сами сообщат о недоступности; вложенный блок — то же соединение
+            yield
+            return
+        async with self.acquire() as conn:
+            shared = _SharedConnection(conn)
+            token = _shared_connection.set(shared)
+            try:
+                yield
+            finally:
+                shared.conn = None
+                _shared_connection.reset(token)
+
     async def close(self):
         """Graceful shutdown пула соединений"""
         if self.pool:
             await self.pool.close()
+            self.pool = None
             logger.info("💤 Соединение с БД закрыто")
 
     async def _check_tables(self):
         """Проверяем существование таблиц (не создаём автоматически)"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             tables = await conn.fetch("""
                 SELECT tablename 
                 FROM pg_tables 
@@ -47,8 +345,21 @@ class Database:
                 logger.warning("⚠️  Некоторые таблицы отсутствуют. Убедись, что выполнил SQL из шага 2!")
                 logger.warning(f"Найдены таблицы: {[t['tablename'] for t in tables]}")
 
+    async def _check_functions(self):
+        """Есть ли функции горячих путей (migrations/003); без них — обычные запросы"""
+        async with self.acquire() as conn:
+            found = await conn.fetchval(
+                "SELECT count(DISTINCT proname) FROM pg_proc WHERE proname = ANY($1::text[])",
+                list(HOT_PATH_FUNCTIONS)
+            )
+        self.use_functions = found == len(HOT_PATH_FUNCTIONS)
+        if not self.use_functions:
+            logger.warning("⚠️  Transaction pooler без функций горячих путей: примени migrations/003_hot_path_functions.sql")
+
     # ==================== ПОЛЬЗОВАТЕЛИ ====================
 
+    @observe_db
+    @guarded
     async def get_or_create_user(
         self, 
         telegram_id: int, 
@@ -58,7 +369,7 @@ class Database:
         language: str = 'ru'
     ) -> Dict:
         """Создаём или получаем пользователя"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             # Пробуем найти существующего
             user = await conn.fetchrow(
                 "SELECT * FROM users WHERE id = $1",
@@ -94,9 +405,11 @@ class Database:
             
             return dict(user)
 
+    @observe_db
+    @guarded
     async def update_user_language(self, telegram_id: int, language: str):
         """Обновляем язык пользователя"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             await conn.execute(
                 "UPDATE users SET language = $1 WHERE id = $2",
                 language, telegram_id
@@ -104,6 +417,22 @@ class Database:
 
     # ==================== СЕССИИ ====================
 
+    @staticmethod
+    def _decode_session(session: asyncpg.Record) -> Dict:
+        """Строка sessions -> dict; jsonb-поля уже разобраны кодеком, здесь только проверка типа"""
+        session_dict = dict(session)
+        for field, default in SESSION_JSON_FIELDS.items():
+            value = session_dict.get(field)
+            if value is None:
+                session_dict[field] = list(default)
+            elif not isinstance(value, list):
+                logger.warning(f"⚠️ Поле сессии {field} user_id={session_dict.get('user_id')}: "
+                               f"ожидался список, получен {type(value).__name__}")
+                session_dict[field] = list(default)
+        return session_dict
+
+    @observe_db
+    @guarded
     async def create_or_update_session(
         self,
         telegram_id: int,
@@ -115,11 +444,19 @@ class Database:
         history: Optional[List[Dict]] = None
     ) -> Dict:
         """Создаёт или обновляет сессию пользователя"""
-        async with self.pool.acquire() as conn:
-            # Преобразуем Python объекты в JSON
-            categories_json = json.dumps(categories) if categories else None
-            dishes_json = json.dumps(generated_dishes) if generated_dishes else None
-            history_json = json.dumps(history) if history else None
+        async with self.acquire() as conn:
+            # jsonb кодирует кодек соединения; пустое значение — поле не меняется
+            categories_json = categories or None
+            dishes_json = generated_dishes or None
+            history_json = history or None
+
+            if self.use_functions:
+                session = await conn.fetchrow(
+                    "SELECT * FROM bot_upsert_session($1, $2, $3, $4, $5, $6, $7)",
+                    telegram_id, products, state, categories_json,
+                    dishes_json, current_dish, history_json
+                )
+                return dict(session) if session else None
 
             # Проверяем существующую сессию
             existing = await conn.fetchrow(
@@ -161,66 +498,51 @@ class Database:
             
             return dict(session) if session else None
 
+    @observe_db
+    @guarded
     async def get_session(self, telegram_id: int) -> Optional[Dict]:
         """Получаем текущую сессию пользователя"""
-        async with self.pool.acquire() as conn:
-            session = await conn.fetchrow(
-                """
-                SELECT * FROM sessions 
-                WHERE user_id = $1
-                ORDER BY updated_at DESC 
-                LIMIT 1
-                """,
-                telegram_id
-            )
+        async with self.acquire() as conn:
+            if self.use_functions:
+                session = await conn.fetchrow("SELECT * FROM bot_get_session($1)", telegram_id)
+            else:
+                session = await conn.fetchrow(
+                    """
+                    SELECT * FROM sessions 
+                    WHERE user_id = $1
+                    ORDER BY updated_at DESC 
+                    LIMIT 1
+                    """,
+                    telegram_id
+                )
             
-            if session:
-                # Преобразуем JSON поля обратно в Python объекты
-                session_dict = dict(session)
-                
-                # categories
-                if session_dict.get('categories'):
-                    try:
-                        session_dict['categories'] = json.loads(session_dict['categories'])
-                    except:
-                        session_dict['categories'] = []
-                
-                # generated_dishes
-                if session_dict.get('generated_dishes'):
-                    try:
-                        session_dict['generated_dishes'] = json.loads(session_dict['generated_dishes'])
-                    except:
-                        session_dict['generated_dishes'] = []
-                
-                # history
-                if session_dict.get('history'):
-                    try:
-                        session_dict['history'] = json.loads(session_dict['history'])
-                    except:
-                        session_dict['history'] = []
-                
-                return session_dict
-            return None
+            return self._decode_session(session) if session else None
 
+    @observe_db
+    @guarded
     async def update_session_state(self, telegram_id: int, state: str):
         """Обновляем только состояние сессии"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             await conn.execute(
                 "UPDATE sessions SET state = $1, updated_at = NOW() WHERE user_id = $2",
                 state, telegram_id
             )
 
+    @observe_db
+    @guarded
     async def update_session_products(self, telegram_id: int, products: str):
         """Обновляем только продукты в сессии"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             await conn.execute(
                 "UPDATE sessions SET products = $1, updated_at = NOW() WHERE user_id = $2",
                 products, telegram_id
             )
 
+    @observe_db
+    @guarded
     async def clear_session(self, telegram_id: int):
         """Очищаем сессию пользователя (мягкое удаление)"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             await conn.execute(
                 """
                 UPDATE sessions 
@@ -238,9 +560,11 @@ class Database:
             )
             logger.info(f"🧹 Сессия очищена для пользователя {telegram_id}")
 
+    @observe_db
+    @guarded
     async def delete_session(self, telegram_id: int):
         """Полное удаление сессии"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             await conn.execute(
                 "DELETE FROM sessions WHERE user_id = $1",
                 telegram_id
@@ -248,6 +572,8 @@ class Database:
 
     # ==================== РЕЦЕПТЫ ====================
 
+    @observe_db
+    @guarded
     async def save_recipe(
         self,
         telegram_id: int,
@@ -255,9 +581,29 @@ class Database:
         recipe_text: str,
         products_used: Optional[str] = None
     ) -> int:
-        """Сохраняем рецепт в историю"""
-        async with self.pool.acquire() as conn:
-            recipe = await conn.fetchrow(
+        """Сохраняем рецепт в историю (тело — один раз на одинаковый текст, см. recipe_bodies)"""
+        async with self.acquire() as conn:
+            for attempt in range(2):
+                try:
+                    recipe_id = await self._insert_recipe(conn, telegram_id, dish_name, recipe_text, products_used)
+                    break
+                except asyncpg.ForeignKeyViolationError:
+                    # Тело удалила уборка сирот между «уже есть» и ссылкой на него — вставляем заново
+                    if attempt:
+                        raise
+            logger.info(f"📝 Рецепт сохранён: {dish_name} для пользователя {telegram_id}")
+            return recipe_id
+
+    async def _insert_recipe(
+        self, conn: asyncpg.Connection, telegram_id: int, dish_name: str, recipe_text: str, products_used: Optional[str]
+    ) -> int:
+        if self.use_functions:
+            return await conn.fetchval(
+                "SELECT bot_save_recipe($1, $2, $3, $4)",
+                telegram_id, dish_name, recipe_text, products_used
+            )
+        if not self.has_recipe_bodies:
+            return await conn.fetchval(
                 """
                 INSERT INTO recipes (user_id, dish_name, recipe_text, products_used)
                 VALUES ($1, $2, $3, $4)
@@ -265,40 +611,472 @@ class Database:
                 """,
                 telegram_id, dish_name, recipe_text, products_used
             )
-            logger.info(f"📝 Рецепт сохранён: {dish_name} для пользователя {telegram_id}")
-            return recipe['id']
+        body = recipe_bodies.make_body(recipe_text)
+        if self.has_recipe_structure:
+            structure = recipe_parser.parse_recipe(body.text)
+            return await conn.fetchval(
+                """
+                WITH body AS (
+                    INSERT INTO recipe_bodies (
+                        hash, body, codec, raw_size, stored_size,
+                        structure, ingredients, cook_minutes, servings, difficulty, kcal
+                    )
+                    VALUES ($4, $5, $6, $7, $8, $10, $11, $12, $13, $14, $15)
+                    ON CONFLICT (hash) DO NOTHING
+                )
+                INSERT INTO recipes (user_id, dish_name, products_used, body_hash, search_vector)
+                VALUES ($1, $2, $3, $4, recipe_search_vector($2, $9))
+                RETURNING id
+                """,
+                telegram_id, dish_name, products_used,
+                body.hash, body.data, body.codec, body.raw_size, len(body.data), body.text,
+                *self._structure_columns(structure)
+            )
+        return await conn.fetchval(
+            """
+            WITH body AS (
+                INSERT INTO recipe_bodies (hash, body, codec, raw_size, stored_size)
+                VALUES ($4, $5, $6, $7, $8)
+                ON CONFLICT (hash) DO NOTHING
+            )
+            INSERT INTO recipes (user_id, dish_name, products_used, body_hash, search_vector)
+            VALUES ($1, $2, $3, $4, recipe_search_vector($2, $9))
+            RETURNING id
+            """,
+            telegram_id, dish_name, products_used,
+            body.hash, body.data, body.codec, body.raw_size, len(body.data), body.text
+        )
+
+    @staticmethod
+    def _structure_columns(structure: Dict) -> tuple:
+        """Структура рецепта -> (structure, ingredients, cook_minutes, servings, difficulty, kcal)"""
+        def small(value: Optional[int]) -> Optional[int]:
+            return value if value is not None and 0 < value < 32768 else None  # SMALLINT
+        return (
+            structure,
+            recipe_parser.ingredient_names(structure),
+            small(structure["time_minutes"]),
+            small(structure["servings"]),
+            structure["difficulty"],
+            structure["nutrition"]["kcal"],
+        )
+
+    @staticmethod
+    def _with_recipe_text(row: asyncpg.Record) -> Dict:
+        """Строка recipes (+ body/codec из recipe_bodies) -> dict с распакованным recipe_text"""
+        recipe = dict(row)
+        body = recipe.pop("body", None)
+        codec = recipe.pop("codec", None)
+        if recipe.get("recipe_text") is None and body is not None:
+            recipe["recipe_text"] = recipe_bodies.decompress(body, codec)
+        return recipe
+
+    @observe_db
+    @guarded
+    async def clear_recipes(self, telegram_id: int):
+        """Удаляем историю рецептов пользователя"""
+        async with self.acquire() as conn:
+            await conn.execute("DELETE FROM recipes WHERE user_id = $1", telegram_id)
 
+    @observe_db
+    @guarded
     async def get_user_recipes(self, telegram_id: int, limit: int = 10) -> List[Dict]:
         """Получаем историю рецептов пользователя"""
-        async with self.pool.acquire() as conn:
-            recipes = await conn.fetch(
+        async with self.acquire() as conn:
+            if self.has_recipe_bodies:
+                recipes = await conn.fetch(
+                    """
+                    SELECT r.*, b.body, b.codec FROM recipes r
+                    LEFT JOIN recipe_bodies b ON b.hash = r.body_hash
+                    WHERE r.user_id = $1 
+                    ORDER BY r.created_at DESC 
+                    LIMIT $2
+                    """,
+                    telegram_id, limit
+                )
+            else:
+                recipes = await conn.fetch(
+                    """
+                    SELECT * FROM recipes 
+                    WHERE user_id = $1 
+                    ORDER BY created_at DESC 
+                    LIMIT $2
+                    """,
+                    telegram_id, limit
+                )
+            return [self._with_recipe_text(r) for r in recipes]
+
+    @observe_db
+    @guarded
+    async def get_recipe_page(
+        self,
+        telegram_id: int,
+        limit: int,
+        cursor: Optional[tuple] = None,
+        newer: bool = False
+    ) -> List[Dict]:
+        """Страница истории (keyset по (created_at, id)): только id, название и дата.
+
+        cursor — (created_at, id) записи, от которой листаем; newer=True —
+        записи новее курсора, по возрастанию (вызывающий разворачивает).
+        Отдельное условие на created_at дублирует сравнение строк: по нему
+        планировщик отсекает секции recipes.
+        """
+        async with self.acquire() as conn:
+            if cursor is None:
+                rows = await conn.fetch(
+                    """
+                    SELECT id, dish_name, created_at FROM recipes
+                    WHERE user_id = $1
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT $2
+                    """,
+                    telegram_id, limit
+                )
+            elif newer:
+                rows = await conn.fetch(
+                    """
+                    SELECT id, dish_name, created_at FROM recipes
+                    WHERE user_id = $1 AND created_at >= $3 AND (created_at, id) > ($3, $4)
+                    ORDER BY created_at, id
+                    LIMIT $2
+                    """,
+                    telegram_id, limit, *cursor
+                )
+            else:
+                rows = await conn.fetch(
+                    """
+                    SELECT id, dish_name, created_at FROM recipes
+                    WHERE user_id = $1 AND created_at <= $3 AND (created_at, id) < ($3, $4)
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT $2
+                    """,
+                    telegram_id, limit, *cursor
+                )
+            return [dict(r) for r in rows]
+
+    @observe_db
+    @guarded
+    async def get_recipe(self, telegram_id: int, recipe_id: int, created_at: datetime) -> Optional[Dict]:
+        """Один рецепт пользователя с текстом (created_at — для поиска по индексу)"""
+        async with self.acquire() as conn:
+            if self.has_recipe_bodies:
+                row = await conn.fetchrow(
+                    """
+                    SELECT r.id, r.dish_name, r.recipe_text, r.created_at, b.body, b.codec
+                    FROM recipes r
+                    LEFT JOIN recipe_bodies b ON b.hash = r.body_hash
+                    WHERE r.user_id = $1 AND r.created_at = $3 AND r.id = $2
+                    """,
+                    telegram_id, recipe_id, created_at
+                )
+            else:
+                row = await conn.fetchrow(
+                    """
+                    SELECT id, dish_name, recipe_text, created_at FROM recipes
+                    WHERE user_id = $1 AND created_at = $3 AND id = $2
+                    """,
+                    telegram_id, recipe_id, created_at
+                )
+            return self._with_recipe_text(row) if row else None
+
+    @observe_db
+    @guarded
+    async def search_recipes(self, query: str, limit: int = 5, extra_terms: int = 1) -> List[Dict]:
+        """Полнотекстовый поиск по всем сохранённым рецептам (migrations/004).
+
+        exact — все слова запроса есть в названии блюда, и в названии не
+        больше extra_terms лишних слов: такой рецепт можно отдать вместо
+        генерации.
+        """
+        async with self.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                WITH q AS (
+                    SELECT plainto_tsquery('russian', $1) AS ru,
+                           plainto_tsquery('english', $1) AS en,
+                           length(to_tsvector('russian', $1)) AS terms
+                ), hits AS (
+                    SELECT r.id, r.dish_name, r.recipe_text, r.body_hash, r.created_at,
+                           ts_rank(r.search_vector, q.ru || q.en) AS rank
+                    FROM recipes r, q
+                    WHERE r.search_vector @@ (q.ru || q.en)
+                    ORDER BY rank DESC, r.created_at DESC
+                    LIMIT $2
+                )
+                SELECT hits.*, names.exact, b.body, b.codec
+                FROM hits
+                CROSS JOIN q
+                LEFT JOIN recipe_bodies b ON b.hash = hits.body_hash,
+                     LATERAL (SELECT length(to_tsvector('russian', hits.dish_name)) AS terms) name_terms,
+                     LATERAL (SELECT (to_tsvector('russian', hits.dish_name) @@ q.ru
+                                      OR to_tsvector('english', hits.dish_name) @@ q.en)
+                                     AND name_terms.terms <= q.terms + $3 AS exact) names
+                -- Среди точных совпадений — название без лишних слов
+                ORDER BY names.exact DESC, name_terms.terms, hits.rank DESC, hits.created_at DESC
+                """,
+                query, limit, extra_terms
+            )
+            return [self._with_recipe_text(r) for r in rows]
+
+    @observe_db
+    @guarded
+    async def quick_recipes(self, max_minutes: int, limit: int = 10) -> List[Dict]:
+        """Сохранённые рецепты, которые готовятся не дольше max_minutes: диапазон и
+        сортировка по индексу cook_minutes (migrations/008), название — последнее для тела"""
+        if not self.has_recipe_structure:
+            return []
+        async with self.acquire() as conn:
+            rows = await conn.fetch(
                 """
-                SELECT * FROM recipes 
-                WHERE user_id = $1 
-                ORDER BY created_at DESC 
+                SELECT b.hash, r.dish_name, b.cook_minutes, b.difficulty, b.kcal
+                FROM recipe_bodies b
+                CROSS JOIN LATERAL (
+                    SELECT dish_name FROM recipes
+                    WHERE body_hash = b.hash
+                    ORDER BY created_at DESC
+                    LIMIT 1
+                ) r
+                WHERE b.cook_minutes <= $1
+                ORDER BY b.cook_minutes, b.hash
+                LIMIT $2
+                """,
+                max_minutes, limit
+            )
+            return [dict(r) for r in rows]
+
+    @observe_db
+    @guarded
+    async def ingredient_stats(self, telegram_id: int, limit: int = 10) -> List[Dict]:
+        """Самые частые ингредиенты в истории пользователя: [{"ingredient", "recipes"}]"""
+        if not self.has_recipe_structure:
+            return []
+        async with self.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT i.ingredient, COUNT(*) AS recipes
+                FROM recipes r
+                JOIN recipe_bodies b ON b.hash = r.body_hash
+                CROSS JOIN LATERAL unnest(b.ingredients) AS i(ingredient)
+                WHERE r.user_id = $1
+                GROUP BY i.ingredient
+                ORDER BY recipes DESC, i.ingredient
                 LIMIT $2
                 """,
                 telegram_id, limit
             )
-            return [dict(r) for r in recipes]
+            return [dict(r) for r in rows]
+
+    @observe_db
+    @guarded(timeout=120)
+    async def get_pantry_entries(self, min_ingredients: int = 2) -> List[Dict]:
+        """Тела с разобранными ингредиентами и последним названием блюда — для индекса pantry"""
+        if not self.has_recipe_structure:
+            return []
+        async with self.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT b.hash, b.ingredients, r.dish_name
+                FROM recipe_bodies b
+                CROSS JOIN LATERAL (
+                    SELECT dish_name FROM recipes
+                    WHERE body_hash = b.hash
+                    ORDER BY created_at DESC
+                    LIMIT 1
+                ) r
+                WHERE cardinality(b.ingredients) >= $1
+                ORDER BY b.created_at
+                """,
+                min_ingredients
+            )
+            return [dict(r) for r in rows]
+
+    @observe_db
+    @guarded
+    async def get_recipe_body(self, body_hash: bytes) -> Optional[Dict]:
+        """Сохранённый рецепт по хешу тела: dish_name и recipe_text"""
+        if not self.has_recipe_bodies:
+            return None
+        async with self.acquire() as conn:
+            row = await conn.fetchrow(
+                """
+                SELECT r.dish_name, b.body, b.codec
+                FROM recipe_bodies b
+                CROSS JOIN LATERAL (
+                    SELECT dish_name FROM recipes
+                    WHERE body_hash = b.hash
+                    ORDER BY created_at DESC
+                    LIMIT 1
+                ) r
+                WHERE b.hash = $1
+                """,
+                body_hash
+            )
+            return self._with_recipe_text(row) if row else None
+
+    @observe_db
+    @guarded(timeout=120)
+    async def parse_recipe_bodies(self, batch: int = 500) -> int:
+        """Разбирает тела без структуры: бэкфилл и тела от bot_save_recipe
+        (фоновая задача recipe_bodies_parse)"""
+        if not self.has_recipe_structure:
+            return 0
+        async with self.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT hash, body, codec FROM recipe_bodies WHERE structure IS NULL ORDER BY created_at LIMIT $1",
+                batch
+            )
+            if not rows:
+                return 0
+            parsed = await asyncio.to_thread(
+                lambda: [
+                    (row["hash"], *self._structure_columns(
+                        recipe_parser.parse_recipe(recipe_bodies.decompress(row["body"], row["codec"]))
+                    ))
+                    for row in rows
+                ]
+            )
+            await conn.executemany(
+                """
+                UPDATE recipe_bodies
+                SET structure = $2, ingredients = $3, cook_minutes = $4, servings = $5, difficulty = $6, kcal = $7
+                WHERE hash = $1 AND structure IS NULL
+                """,
+                parsed
+            )
+        logger.info(f"🧩 Разобрано тел рецептов: {len(parsed)}")
+        return len(parsed)
+
+    @observe_db
+    @guarded(timeout=120)
+    async def compact_recipe_bodies(self, batch: int = 500, orphan_age_hours: int = 24) -> Dict[str, int]:
+        """Сжимает тела, записанные без сжатия, удаляет тела без ссылок и
+        обновляет метрики объёма (фоновая задача recipe_bodies_compact)"""
+        if not self.has_recipe_bodies:
+            return {}
+        async with self.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT hash, body FROM recipe_bodies WHERE codec = 'none' ORDER BY created_at LIMIT $1",
+                batch
+            )
+            if rows:
+                codec = recipe_bodies.DEFAULT_CODEC
+                compressed = await asyncio.to_thread(
+                    lambda: [(row["hash"], recipe_bodies.compress(row["body"], codec)) for row in rows]
+                )
+                await conn.executemany(
+                    "UPDATE recipe_bodies SET body = $2, codec = $3, stored_size = $4 WHERE hash = $1 AND codec = 'none'",
+                    [(digest, data, codec, len(data)) for digest, data in compressed]
+                )
+            orphans = await conn.execute(
+                """
+                DELETE FROM recipe_bodies b
+                WHERE b.created_at < NOW() - make_interval(hours => $1)
+                  AND NOT EXISTS (SELECT 1 FROM recipes r WHERE r.body_hash = b.hash)
+                """,
+                orphan_age_hours
+            )
+            # У секционированной recipes (migrations/007) своих данных нет — объём по секциям
+            recipes_bytes = (
+                "(SELECT COALESCE(SUM(pg_total_relation_size(relid)), 0) FROM pg_partition_tree('recipes'))"
+                if self.recipes_partitioned else "pg_total_relation_size('recipes')"
+            )
+            storage = await conn.fetchrow(
+                f"""
+                SELECT COUNT(*) AS bodies,
+                       COALESCE(SUM(raw_size), 0) AS raw_bytes,
+                       COALESCE(SUM(stored_size), 0) AS stored_bytes,
+                       {recipes_bytes} AS recipes_table_bytes,
+                       pg_total_relation_size('recipe_bodies') AS bodies_table_bytes
+                FROM recipe_bodies
+                """
+            )
+        self.recipe_storage = {key: int(value) for key, value in dict(storage).items()}
+        RECIPE_BODIES.set(self.recipe_storage["bodies"])
+        for kind in ("raw_bytes", "stored_bytes", "recipes_table_bytes", "bodies_table_bytes"):
+            RECIPE_STORAGE_BYTES.labels(kind).set(self.recipe_storage[kind])
+        result = {"compressed": len(rows), "orphans_deleted": int(orphans.split()[-1])}
+        logger.info(f"🗜 Тела рецептов: сжато {result['compressed']}, удалено сирот {result['orphans_deleted']}")
+        return result
+
+    @observe_db
+    @guarded(timeout=120)
+    async def maintain_recipe_partitions(self, ahead: int, keep_months: int = 0) -> Dict[str, Any]:
+        """Секции recipes на ahead месяцев вперёд и удаление секций старше keep_months
+        (0 — без удаления); фоновая задача recipe_partitions"""
+        if not self.recipes_partitioned:
+            return {}
+        async with self.acquire() as conn:
+            created = await conn.fetchval("SELECT recipes_ensure_partitions(CURRENT_DATE, $1)", ahead)
+            dropped = []
+            if keep_months > 0:
+                dropped = [row[0] for row in await conn.fetch("SELECT * FROM recipes_drop_partitions($1)", keep_months)]
+        if created or dropped:
+            logger.info(f"🗂 Секции recipes: создано {created}, удалено {dropped or 'нет'}")
+        return {"created": created, "dropped": dropped}
 
     # ==================== АДМИНИСТРАТИВНЫЕ ====================
 
+    @observe_db
+    @guarded(timeout=120)
     async def cleanup_old_sessions(self, days_old: int = 7):
         """Удаляем старые сессии"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             result = await conn.execute(
                 """
                 DELETE FROM sessions 
-                WHERE updated_at < NOW() - INTERVAL '$1 days'
+                WHERE updated_at < NOW() - make_interval(days => $1)
                 """,
                 days_old
             )
             logger.info(f"🧹 Удалены старые сессии: {result}")
 
+    @observe_db
+    @guarded(timeout=120)
+    async def refresh_stats(self):
+        """Пересчитывает снимок bot_stats (фоновая задача stats_refresh)"""
+        async with self.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO bot_stats (id, users, active_sessions, saved_recipes, refreshed_at)
+                SELECT 1,
+                    (SELECT COUNT(*) FROM users),
+                    (SELECT COUNT(*) FROM sessions),
+                    (SELECT COUNT(*) FROM recipes),
+                    NOW()
+                ON CONFLICT (id) DO UPDATE SET
+                    users = EXCLUDED.users,
+                    active_sessions = EXCLUDED.active_sessions,
+                    saved_recipes = EXCLUDED.saved_recipes,
+                    refreshed_at = EXCLUDED.refreshed_at
+                """
+            )
+
+    @observe_db
+    @guarded
+    async def ping(self):
+        """Пробный вызов: через guarded он же замыкает размыкатель после восстановления БД"""
+        async with self.acquire() as conn:
+            await conn.fetchval("SELECT 1")
+
+    @observe_db
+    @guarded
     async def get_stats(self) -> Dict:
-        """Статистика базы данных"""
-        async with self.pool.acquire() as conn:
+        """Статистика базы данных: снимок bot_stats, а если его ещё нет — живой подсчёт"""
+        async with self.acquire() as conn:
+            try:
+                snapshot = await conn.fetchrow(
+                    "SELECT users, active_sessions, saved_recipes FROM bot_stats WHERE id = 1"
+                )
+            except asyncpg.UndefinedTableError:
+                snapshot = None  # миграция 002 ещё не применена
+            if snapshot:
+                return {
+                    "users": snapshot["users"],
+                    "active_sessions": snapshot["active_sessions"],
+                    "saved_recipes": snapshot["saved_recipes"]
+                }
+
             users_count = await conn.fetchval("SELECT COUNT(*) FROM users")
             sessions_count = await conn.fetchval("SELECT COUNT(*) FROM sessions")
             recipes_count = await conn.fetchval("SELECT COUNT(*) FROM recipes")
@@ -309,5 +1087,200 @@ class Database:
                 "saved_recipes": recipes_count
             }
 
-# Глобальный экземпляр для использования
+# ==================== ФОНОВЫЕ ЗАДАЧИ ====================
+
+class BackgroundJob:
+    __slots__ = ("name", "interval", "func", "holds_lock", "task", "last_duration", "last_error", "runs", "unrecorded")
+
+    def __init__(self, name: str, interval: float, func: Callable[[], Awaitable]):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.holds_lock = False
+        self.task: Optional[asyncio.Task] = None
+        self.last_duration: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.runs = 0
+        # Итог последнего запуска ещё не записан в job_runs (БД сбоила) — допишем на тике
+        self.unrecorded = False
+
+class JobRunner:
+    """Периодические задачи, которые выполняются ровно на одном инстансе.
+
+    Каждая задача — это session-level advisory lock на отдельном соединении
+    (не из пула). Кто взял lock, тот и лидер для задачи. Lease продлевается
+    на каждом тике проверкой соединения. Если соединение или процесс умер,
+    Postgres сам снимает lock, и на следующем тике его берёт другой инстанс.
+    Время последнего запуска хранится в job_runs, поэтому новый лидер не
+    повторяет задачу раньше срока.
+    """
+
+    # Первый ключ двухключевого advisory lock — пространство имён бота
+    LOCK_NAMESPACE = 0x0F00D
+
+    def __init__(self, database: "Database", tick: float = JOB_LEASE_SECONDS, dsn: str = JOBS_DATABASE_URL):
+        self.database = database
+        self.tick = tick
+        self.dsn = dsn
+        self.instance = f"{socket.gethostname()}:{os.getpid()}"
+        self.jobs: Dict[str, BackgroundJob] = {}
+        self._conn: Optional[asyncpg.Connection] = None
+        self._loop_task: Optional[asyncio.Task] = None
+
+    def add(self, name: str, interval: float, func: Callable[[], Awaitable]):
+        self.jobs[name] = BackgroundJob(name, interval, func)
+
+    @property
+    def pool_mode(self) -> str:
+        # DB_POOL_MODE описывает DATABASE_URL; отдельный JOBS_DATABASE_URL определяем по адресу
+        return detect_pool_mode(self.dsn, DB_POOL_MODE if self.dsn == DATABASE_URL else "auto")
+
+    async def start(self):
+        if self.pool_mode == "transaction":
+            # Через transaction pooler lock берётся на случайном серверном соединении:
+            # его может «перехватить» другой инстанс, а после смерти держателя он не снимается
+            raise RuntimeError(
+                "фоновые задачи не запущены: JOBS_DATABASE_URL ведёт в transaction pooler, "
+                "задай прямое подключение к Postgres (порт 5432)"
+            )
+        if self.jobs and self._loop_task is None:
+            self._loop_task = asyncio.create_task(self._run())
+            logger.info(f"⏰ Фоновые задачи: {', '.join(self.jobs)} (инстанс {self.instance})")
+
+    async def stop(self):
+        if self._loop_task:
+            self._loop_task.cancel()
+            self._loop_task = None
+        await self._release_all("остановка")
+
+    async def _run(self):
+        while True:
+            try:
+                await self._tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"⚠️ Lease фоновых задач потерян: {e}")
+                await self._release_all("потеря соединения")
+            await asyncio.sleep(self.tick)
+
+    async def _tick(self):
+        if self._conn is None or self._conn.is_closed():
+            self._conn = await asyncpg.connect(self.dsn, statement_cache_size=0, timeout=10)
+        else:
+            # Продление lease: соединение живо — значит, и наши locks на месте
+            await self._conn.fetchval("SELECT 1", timeout=10)
+
+        for job in self.jobs.values():
+            if not self.database.available:
+                break  # БД в деградации — задачи подождут
+            if not job.holds_lock:
+                job.holds_lock = await self._conn.fetchval(
+                    "SELECT pg_try_advisory_lock($1, hashtext($2))", self.LOCK_NAMESPACE, job.name, timeout=10
+                )
+                if job.holds_lock:
+                    JOB_LEADER.labels(job.name).set(1)
+                    logger.info(f"👑 Задача {job.name}: выполняется на этом инстансе")
+            if not job.holds_lock or (job.task is not None and not job.task.done()):
+                continue
+            # Сбой запросов к job_runs через пул — не повод отпускать lease: задача подождёт тика
+            try:
+                if job.unrecorded:
+                    await self._record_finish(job)
+                due = await self._is_due(job)
+            except Exception as e:
+                logger.warning(f"⚠️ Задача {job.name}: job_runs недоступна: {e}")
+                continue
+            if due:
+                job.task = asyncio.create_task(self._execute(job))
+
+    async def _is_due(self, job: BackgroundJob) -> bool:
+        async with self.database.acquire() as conn:
+            return await conn.fetchval(
+                """
+                SELECT COALESCE(
+                    (SELECT last_started < NOW() - make_interval(secs => $2) FROM job_runs WHERE name = $1),
+                    TRUE
+                )
+                """,
+                job.name, float(job.interval)
+            )
+
+    async def _execute(self, job: BackgroundJob):
+        try:
+            async with self.database.acquire() as conn:
+                await conn.execute(
+                    """
+                    INSERT INTO job_runs (name, last_started, instance) VALUES ($1, NOW(), $2)
+                    ON CONFLICT (name) DO UPDATE SET last_started = NOW(), instance = $2
+                    """,
+                    job.name, self.instance
+                )
+        except Exception as e:
+            # Без отметки о старте не запускаем: новый лидер не знал бы, что задача шла
+            logger.warning(f"⚠️ Задача {job.name} отложена: не удалось отметить запуск: {e}")
+            return
+        start = time.perf_counter()
+        job.last_error = None
+        try:
+            await job.func()
+        except Exception as e:
+            job.last_error = repr(e)[:500]
+            JOB_ERRORS.labels(job.name).inc()
+            logger.error(f"❌ Фоновая задача {job.name}: {e}")
+        finally:
+            job.last_duration = time.perf_counter() - start
+            job.runs += 1
+            JOB_LAST_DURATION_SECONDS.labels(job.name).set(job.last_duration)
+            job.unrecorded = True
+
+        logger.info(f"✅ Фоновая задача {job.name}: {job.last_duration * 1000:.0f} мс")
+        try:
+            await self._record_finish(job)
+        except Exception as e:
+            logger.warning(f"⚠️ Задача {job.name}: итог не записан в job_runs, повторим на тике: {e}")
+
+    async def _record_finish(self, job: BackgroundJob):
+        async with self.database.acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE job_runs
+                SET last_finished = NOW(), last_duration_ms = $2, last_error = $3
+                WHERE name = $1
+                """,
+                job.name, job.last_duration * 1000, job.last_error
+            )
+        job.unrecorded = False
+
+    async def _release_all(self, reason: str):
+        """Locks отпускаются вместе с соединением; выполняющиеся задачи отменяем —
+        их может подхватить другой инстанс"""
+        for job in self.jobs.values():
+            if job.holds_lock:
+                logger.info(f"👋 Задача {job.name}: lease отпущен ({reason})")
+            job.holds_lock = False
+            JOB_LEADER.labels(job.name).set(0)
+            if job.task and not job.task.done():
+                job.task.cancel()
+        if self._conn is not None:
+            try:
+                await self._conn.close(timeout=5)
+            except Exception:
+                self._conn.terminate()
+            self._conn = None
+
+    async def history(self) -> List[Dict]:
+        """job_runs по всем инстансам + локальный статус"""
+        async with self.database.acquire() as conn:
+            rows = await conn.fetch("SELECT * FROM job_runs ORDER BY name")
+        result = []
+        for row in rows:
+            item = {key: (value.isoformat() if isinstance(value, datetime) else value) for key, value in dict(row).items()}
+            job = self.jobs.get(row["name"])
+            item["leader_here"] = bool(job and job.holds_lock)
+            result.append(item)
+        return result
+
+# Глобальные экземпляры для использования
 db = Database()
+job_runner = JobRunner(db)
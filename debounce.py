@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import time
+import weakref
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from aiogram.types import Message
+from config import INPUT_DEBOUNCE_SECONDS, INPUT_DEBOUNCE_MAX_SECONDS
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+class _PendingInput:
+    __slots__ = ("message", "texts", "progress", "started", "timer")
+
+    def __init__(self, message: Message):
+        self.message = message
+        self.texts: List[str] = []
+        self.progress = None
+        self.started = time.monotonic()
+        self.timer: Optional[asyncio.Task] = None
+
+class InputDebouncer:
+    """Склеивает быстрые последовательные сообщения с продуктами.
+
+    "яйца", "молоко", "сыр", пришедшие в пределах окна, превращаются в один
+    вызов handler(message, user_id, "яйца, молоко, сыр", progress): одна запись
+    в БД и один ответ. Окно продлевается с каждым сообщением, но не дольше
+    max_delay от первого. Обработка для пользователя строго последовательная.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[..., Awaitable],
+        window: float = INPUT_DEBOUNCE_SECONDS,
+        max_delay: float = INPUT_DEBOUNCE_MAX_SECONDS
+    ):
+        self.handler = handler
+        self.window = window
+        self.max_delay = max_delay
+        self._pending: Dict[int, _PendingInput] = {}
+        # Lock живёт, пока его кто-то ждёт или держит
+        self._locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def _lock(self, user_id: int) -> asyncio.Lock:
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[user_id] = lock
+        return lock
+
+    async def submit(self, message: Message, user_id: int, text: str, progress=None):
+        """Добавляет ввод в буфер пользователя и (пере)запускает таймер"""
+        if self.window <= 0:
+            async with self._lock(user_id):
+                await self.handler(message, user_id, text, progress)
+            return
+
+        pending = self._pending.get(user_id)
+        if pending is None:
+            pending = _PendingInput(message)
+            self._pending[user_id] = pending
+
+        pending.texts.append(text.strip().strip(","))
+        if progress:
+            if pending.progress is None:
+                pending.progress = progress
+            else:
+                # Ответ будет один — лишние заглушки убираем
+                await progress.discard()
+
+        if pending.timer:
+            pending.timer.cancel()
+        deadline = pending.started + self.max_delay
+        delay = max(0.0, min(self.window, deadline - time.monotonic()))
+        pending.timer = asyncio.create_task(self._fire(user_id, delay))
+
+    async def _fire(self, user_id: int, delay: float):
+        await asyncio.sleep(delay)
+        try:
+            # Исходный апдейт уже обработан — у склеенного ввода свой трейс
+            with tracer.trace("products.flush", user_id=user_id):
+                await self.flush(user_id)
+        except Exception as e:
+            logger.error(f"Ошибка обработки накопленного ввода user_id={user_id}: {e}")
+
+    async def flush(self, user_id: int):
+        """Немедленно обрабатывает буфер пользователя.
+
+        Вызывается перед любым другим событием пользователя (команда, callback,
+        запрос рецепта), чтобы оно видело уже применённые продукты.
+        """
+        pending = self._pending.pop(user_id, None)
+        if pending and pending.timer and pending.timer is not asyncio.current_task():
+            pending.timer.cancel()
+
+        async with self._lock(user_id):
+            if pending:
+                merged = ", ".join(t for t in pending.texts if t)
+                if len(pending.texts) > 1:
+                    logger.debug(f"🧺 Склеено {len(pending.texts)} сообщений user_id={user_id}")
+                await self.handler(pending.message, user_id, merged, pending.progress)
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import signal
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from typing import Dict, List, Optional
+
+from config import LOOP_LAG_THRESHOLD, LOOP_LAG_INTERVAL
+from metrics import EVENT_LOOP_LAG_SECONDS, EVENT_LOOP_STALLS
+
+logger = logging.getLogger(__name__)
+
+MAX_STACK_DEPTH = 30
+MAX_PROFILE_SECONDS = 60
+
+def _format_frame_stack(frame) -> List[str]:
+    """Стек от внешнего вызова к текущему, в виде 'file:line in func'"""
+    return [
+        f"{entry.filename}:{entry.lineno} in {entry.name}"
+        for entry in traceback.extract_stack(frame, limit=MAX_STACK_DEPTH)
+    ]
+
+# ==================== МОНИТОР ЗАДЕРЖКИ LOOP ====================
+
+class LoopLagMonitor:
+    """Замечает синхронную работу, которая блокирует event loop.
+
+    Сторожевой поток раз в interval ставит в loop пустой callback через
+    call_soon_threadsafe и ждёт, когда тот выполнится: это время и есть lag.
+    Если loop не отвечает дольше threshold, стек его потока снимается прямо
+    во время блокировки (потом будет поздно — виновник уже вернул управление).
+    """
+
+    def __init__(self, threshold: float = LOOP_LAG_THRESHOLD, interval: float = LOOP_LAG_INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self.events = deque(maxlen=50)
+        self.max_lag = 0.0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    async def start(self):
+        if self._watchdog:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stop.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(f"🩺 Мониторинг event loop: порог {self.threshold * 1000:.0f} мс")
+
+    async def stop(self):
+        if not self._watchdog:
+            return
+        self._stop.set()
+        self._watchdog = None
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            answered = threading.Event()
+            sent = time.monotonic()
+            try:
+                self._loop.call_soon_threadsafe(answered.set)
+            except RuntimeError:
+                return  # loop закрыт
+            stack = None
+            # Стек снимаем заранее, чтобы успеть застать виновника
+            if not answered.wait(self.threshold / 2):
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is not None:
+                    stack = _format_frame_stack(frame)
+                while not answered.wait(1.0):
+                    if self._stop.is_set():
+                        return
+            lag = time.monotonic() - sent
+            EVENT_LOOP_LAG_SECONDS.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.threshold:
+                self._record_stall(lag, stack)
+
+    def _record_stall(self, lag: float, stack: Optional[List[str]]):
+        EVENT_LOOP_STALLS.inc()
+        event = {
+            "at": time.time(),
+            "lag_ms": round(lag * 1000, 1),
+            "stack": stack or [],
+        }
+        self.events.append(event)
+        where = stack[-1] if stack else "стек не снят"
+        logger.warning(f"🐢 Event loop заблокирован на {event['lag_ms']} мс: {where}")
+        if stack:
+            logger.debug("Стек блокировки:\n" + "\n".join(stack))
+
+    def snapshot(self) -> Dict:
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "stalls": list(self.events),
+        }
+
+# ==================== ПРОФИЛИРОВАНИЕ ====================
+
+class SamplingProfiler:
+    """Сэмплирующий CPU-профайлер event loop.
+
+    Таймер ITIMER_PROF раз в interval процессорного времени присылает SIGPROF,
+    обработчик в главном потоке (там и крутится loop) запоминает «свёрнутый»
+    стек (формат flamegraph.pl / speedscope). Простой loop в select() почти
+    не тратит CPU и в профиль не попадает. Без инструментирования кода,
+    поэтому профиль можно снимать на проде.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self._lock = asyncio.Lock()
+
+    @property
+    def available(self) -> bool:
+        return hasattr(signal, "ITIMER_PROF") and threading.current_thread() is threading.main_thread()
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    async def profile(self, seconds: float) -> Dict:
+        if not self.available:
+            raise RuntimeError("профилирование доступно только для loop в главном потоке на Unix")
+        seconds = min(max(seconds, 0.1), MAX_PROFILE_SECONDS)
+        stacks = Counter()
+
+        def on_sample(signum, frame):
+            if frame is not None:
+                stacks[self._collapse(frame)] += 1
+
+        async with self._lock:
+            previous = signal.signal(signal.SIGPROF, on_sample)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                signal.setitimer(signal.ITIMER_PROF, 0, 0)
+                signal.signal(signal.SIGPROF, previous)
+
+        total = sum(stacks.values()) or 1
+        leaves = Counter()
+        for stack, count in stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return {
+            "seconds": seconds,
+            "samples": sum(stacks.values()),
+            "cpu_seconds": round(sum(stacks.values()) * self.interval, 3),
+            "top": [
+                {"frame": frame, "samples": count, "share": round(count / total, 3)}
+                for frame, count in leaves.most_common(25)
+            ],
+            "collapsed": "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()),
+        }
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        names = []
+        while frame is not None and len(names) < MAX_STACK_DEPTH * 2:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+def dump_tasks() -> List[Dict]:
+    """Текущие asyncio-задачи: имя, корутина и где она сейчас ждёт"""
+    result = []
+    for task in asyncio.all_tasks():
+        coro = task.get_coro()
+        result.append({
+            "name": task.get_name(),
+            "coro": getattr(coro, "__qualname__", repr(coro)),
+            "done": task.done(),
+            "stack": [
+                f"{frame.f_code.co_filename}:{frame.f_lineno} in {frame.f_code.co_name}"
+                for frame in task.get_stack(limit=MAX_STACK_DEPTH)
+            ],
+        })
+    result.sort(key=lambda item: item["coro"])
+    return result
+
+# Глобальные экземпляры
+loop_monitor = LoopLagMonitor()
+profiler = SamplingProfiler()
@@ -3,7 +3,10 @@ from config import GROQ_API_KEY, GROQ_MODEL
 from typing import Dict, List, Optional
 import json
 import re
+import time
 import logging
+from metrics import GROQ_REQUEST_SECONDS, GROQ_TOKENS, GROQ_ERRORS, GROQ_EMPTY_RESULTS
+from tracing import span
 
 client = AsyncGroq(api_key=GROQ_API_KEY)
 logger = logging.getLogger(__name__)
@@ -54,24 +57,40 @@ class GroqService:
         temperature: Optional[float] = None,
         max_tokens: Optional[int] = None
     ) -> str:
-        try:
-            config = GroqService.LLM_CONFIG.get(task_type, GroqService.LLM_CONFIG["generation"])
-            final_temperature = temperature if temperature is not None else config["temperature"]
-            final_max_tokens = max_tokens if max_tokens is not None else config["max_tokens"]
+        start = time.perf_counter()
+        with span("groq", task_type=task_type) as groq_span:
+            try:
+                config = GroqService.LLM_CONFIG.get(task_type, GroqService.LLM_CONFIG["generation"])
+                final_temperature = temperature if temperature is not None else config["temperature"]
+                final_max_tokens = max_tokens if max_tokens is not None else config["max_tokens"]
             
-            response = await client.chat.completions.create(
-                model=GROQ_MODEL,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_text}
-                ],
-                max_tokens=final_max_tokens,
-                temperature=final_temperature
-            )
-            return response.choices[0].message.content.strip()
-        except Exception as e:
-            logger.error(f"Groq API Error: {e}")
-            return ""
+                response = await client.chat.completions.create(
+                    model=GROQ_MODEL,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_text}
+                    ],
+                    max_tokens=final_max_tokens,
+                    temperature=final_temperature
+                )
+                result = (response.choices[0].message.content or "").strip()
+                if response.usage:
+                    groq_span.set(
+                        prompt_tokens=response.usage.prompt_tokens,
+                        completion_tokens=response.usage.completion_tokens
+                    )
+                    GROQ_TOKENS.labels(task_type, "prompt").inc(response.usage.prompt_tokens or 0)
+                    GROQ_TOKENS.labels(task_type, "completion").inc(response.usage.completion_tokens or 0)
+                if not result:
+                    GROQ_EMPTY_RESULTS.labels(task_type).inc()
+                return result
+            except Exception as e:
+                logger.error(f"Groq API Error: {e}")
+                GROQ_ERRORS.labels(task_type).inc()
+                groq_span.record_error(e)
+                return ""
+            finally:
+                GROQ_REQUEST_SECONDS.labels(task_type).observe(time.perf_counter() - start)
 
     @staticmethod
     def _extract_json(text: str) -> str:
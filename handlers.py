@@ -1,6 +1,8 @@
 import os
 import io
+import html
 import logging
+from typing import List, Optional
 from aiogram import Dispatcher, F
 from aiogram.filters import Command
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
@@ -8,6 +10,19 @@ from utils import VoiceProcessor
 from groq_service import GroqService
 from state_manager import state_manager
 from database import db as database
+from progress import ProgressMessage
+from debounce import InputDebouncer
+from admission import admission, AdmissionRejected
+from middlewares import InputDebounceFlushMiddleware
+from tracing import span
+from intent import intent_engine, IntentFilter, IntentResult, RECIPE, THANKS
+from config import RECIPE_SEARCH_CACHE, RECIPE_SEARCH_EXTRA_TERMS, QUICK_RECIPE_MINUTES, QUICK_RECIPE_LIMIT
+from history import (
+    recipe_history, HistoryPage, OLDER, NEWER, PAGE_PREFIX, OPEN_PREFIX,
+    page_callback, open_callback, parse_page_callback, parse_open_callback
+)
+from pantry import pantry_index, PantryMatch, CALLBACK_PREFIX as PANTRY_PREFIX, encode_callback, parse_callback
+from metrics import RECIPE_CACHE_LOOKUPS
 
 # Инициализация
 voice_processor = VoiceProcessor()
@@ -27,6 +42,12 @@ CATEGORY_MAP = {
     "mix": "🍱 Комплексный обед",
 }
 
+BUSY_TEXT = "😓 Сейчас очень много запросов. Попробуйте, пожалуйста, через минуту."
+
+def flow_slot(flow: str, progress: ProgressMessage):
+    """Слот допуска для дорогого потока: позиция в очереди показывается в заглушке"""
+    return admission.slot(flow, on_queued=progress.show_queue_position, on_admitted=progress.restore)
+
 # --- КЛАВИАТУРЫ ---
 
 def get_confirmation_keyboard():
@@ -57,6 +78,25 @@ def get_dishes_keyboard(dishes_list: list):
     builder.append([InlineKeyboardButton(text="⬅️ Назад к категориям", callback_data="back_to_categories")])
     return InlineKeyboardMarkup(inline_keyboard=builder)
 
+def with_proven_recipes(keyboard: InlineKeyboardMarkup, matches: List[PantryMatch]) -> InlineKeyboardMarkup:
+    """Кнопки сохранённых рецептов из продуктов пользователя — над основными"""
+    if not matches:
+        return keyboard
+    rows = [
+        [InlineKeyboardButton(text=f"⚡ {match.dish_name[:40]}", callback_data=encode_callback(match.body_hash))]
+        for match in matches
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=rows + keyboard.inline_keyboard)
+
+def proven_recipes_text(matches: List[PantryMatch]) -> str:
+    if not matches:
+        return ""
+    lines = ["⚡ <b>Уже готовили из таких продуктов:</b>"]
+    for match in matches:
+        missing = f" — не хватает: {html.escape(', '.join(match.missing))}" if match.missing else ""
+        lines.append(f"🔸 {html.escape(match.dish_name)}{missing}")
+    return "\n".join(lines) + "\n\n"
+
 def get_recipe_back_keyboard():
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🔄 Другой вариант", callback_data="repeat_recipe")],
@@ -66,11 +106,23 @@ def get_recipe_back_keyboard():
 def get_hide_keyboard():
     return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="🗑 Скрыть", callback_data="delete_msg")]])
 
-def get_stats_keyboard():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🗑 Очистить мою историю", callback_data="clear_my_history")],
-        [InlineKeyboardButton(text="❌ Закрыть", callback_data="delete_msg")]
-    ])
+def get_stats_keyboard(page: Optional[HistoryPage] = None):
+    """Клавиатура /stats: страница истории (рецепт — кнопка), листание ◀ ▶ и управление"""
+    buttons = []
+    if page:
+        for recipe in page.recipes:
+            label = f"🍽 {recipe['dish_name'][:40]} ({recipe['created_at'].strftime('%d.%m')})"
+            buttons.append([InlineKeyboardButton(text=label, callback_data=open_callback(recipe))])
+        nav = []
+        if page.has_newer:
+            nav.append(InlineKeyboardButton(text="◀", callback_data=page_callback(NEWER, page.recipes[0])))
+        if page.has_older:
+            nav.append(InlineKeyboardButton(text="▶", callback_data=page_callback(OLDER, page.recipes[-1])))
+        if nav:
+            buttons.append(nav)
+    buttons.append([InlineKeyboardButton(text="🗑 Очистить мою историю", callback_data="clear_my_history")])
+    buttons.append([InlineKeyboardButton(text="❌ Закрыть", callback_data="delete_msg")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 # --- ХЭНДЛЕРЫ КОМАНД ---
 
@@ -83,15 +135,17 @@ async def cmd_start(message: Message):
     
     # Создаем/получаем пользователя в БД
     try:
-        await database.get_or_create_user(
-            telegram_id=user_id,
-            username=username,
-            first_name=first_name,
-            last_name=last_name
-        )
-        
-        # Пытаемся загрузить предыдущую сессию из БД
-        await state_manager.load_user_session(user_id)
+        # Пользователь и сессия — на одном соединении из пула
+        async with database.connection():
+            await database.get_or_create_user(
+                telegram_id=user_id,
+                username=username,
+                first_name=first_name,
+                last_name=last_name
+            )
+            
+            # Пытаемся загрузить предыдущую сессию из БД
+            await state_manager.load_user_session(user_id)
         
         # Проверяем, есть ли активная сессия
         current_products = state_manager.get_products(user_id)
@@ -129,90 +183,130 @@ async def cmd_author(message: Message):
     """Показать информацию об авторе"""
     await message.answer("👨‍💻 Автор бота: @inikonoff")
 
+async def cmd_quick(message: Message):
+    """Быстрые рецепты из сохранённых: /quick [минут], по умолчанию QUICK_RECIPE_MINUTES"""
+    parts = message.text.split()
+    max_minutes = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else QUICK_RECIPE_MINUTES
+    try:
+        # Одно блюдо может быть сохранено несколькими текстами — берём с запасом и убираем повторы
+        rows = await database.quick_recipes(max_minutes, limit=QUICK_RECIPE_LIMIT * 3)
+    except Exception as e:
+        logger.error(f"Ошибка подбора быстрых рецептов: {e}")
+        await message.answer("❌ Ошибка подбора быстрых рецептов")
+        return
+    buttons = []
+    seen = set()
+    for row in rows:
+        if row["dish_name"].lower() in seen:
+            continue
+        seen.add(row["dish_name"].lower())
+        buttons.append([InlineKeyboardButton(
+            text=f"⏱ {row['cook_minutes']} мин · {row['dish_name'][:36]}",
+            callback_data=encode_callback(row["hash"])
+        )])
+        if len(buttons) == QUICK_RECIPE_LIMIT:
+            break
+    if not buttons:
+        await message.answer(f"Пока нет сохранённых рецептов до {max_minutes} минут.")
+        return
+    await message.answer(
+        f"⏱ <b>Быстрые рецепты (до {max_minutes} минут):</b>",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons),
+        parse_mode="HTML"
+    )
+
 async def cmd_stats(message: Message):
     """Показать статистику бота"""
     try:
-        stats = await database.get_stats()
         user_id = message.from_user.id
-        
-        # Получаем данные пользователя
-        user_recipes = await database.get_user_recipes(user_id, limit=5)
-        recipes_text = "\n".join([f"• {r['dish_name']} ({r['created_at'].strftime('%d.%m')})" 
-                                  for r in user_recipes]) if user_recipes else "Пока нет сохраненных рецептов"
+        async with database.connection():
+            stats = await database.get_stats()
+            
+            # Первая страница истории пользователя (кнопки, без текстов рецептов)
+            page = await recipe_history.page(user_id)
+            favourites = await database.ingredient_stats(user_id, limit=5) if page.recipes else []
+        recipes_text = "нажмите на рецепт, чтобы открыть его" if page.recipes else "Пока нет сохраненных рецептов"
+        favourites_text = ""
+        if favourites:
+            favourites_text = "🥕 Чаще всего в ваших рецептах: " + ", ".join(html.escape(f["ingredient"]) for f in favourites) + "\n\n"
         
         text = (
             "📊 <b>Статистика бота:</b>\n\n"
             f"👤 Всего пользователей: {stats['users']}\n"
             f"📱 Активных сессий: {stats['active_sessions']}\n"
             f"📝 Сохранённых рецептов: {stats['saved_recipes']}\n\n"
-            f"<b>Ваши последние рецепты:</b>\n{recipes_text}\n\n"
+            f"<b>Ваши рецепты:</b> {recipes_text}\n\n"
+            f"{favourites_text}"
             "💾 База данных: Supabase"
         )
-        await message.answer(text, reply_markup=get_stats_keyboard(), parse_mode="HTML")
+        await message.answer(text, reply_markup=get_stats_keyboard(page), parse_mode="HTML")
     except Exception as e:
         logger.error(f"Ошибка статистики: {e}")
         await message.answer("❌ Ошибка получения статистики")
 
-# --- ФУНКЦИИ ДЛЯ ОПРЕДЕЛЕНИЯ НАМЕРЕНИЯ ---
-
-def is_recipe_request(text: str) -> bool:
-    """Определяет, является ли текст запросом на рецепт"""
-    if not text:
-        return False
-    text_lower = text.lower().strip()
-    return (text_lower.startswith("дай рецепт") or 
-            text_lower.startswith("рецепт") or
-            text_lower.startswith("как приготовить") or
-            text_lower.startswith("how to cook") or
-            text_lower.startswith("recipe for"))
-
-def extract_dish_name_from_request(text: str) -> str:
-    """Извлекает название блюда из запроса"""
-    text_lower = text.lower().strip()
-    
-    # Убираем ключевые фразы
-    phrases_to_remove = [
-        "дай рецепт", "рецепт", "как приготовить", 
-        "how to cook", "recipe for", "please", "пожалуйста"
-    ]
-    
-    for phrase in phrases_to_remove:
-        if text_lower.startswith(phrase):
-            text_lower = text_lower[len(phrase):].strip()
-    
-    # Убираем знаки препинания в начале
-    text_lower = text_lower.lstrip(":,-. ")
-    
-    return text_lower
-
 # --- ОБРАБОТКА СООБЩЕНИЙ ---
 
-async def handle_direct_recipe(message: Message):
+async def handle_direct_recipe(message: Message, intent: Optional[IntentResult] = None):
     """Обработка 'Дай рецепт ...' и других запросов рецептов"""
     user_id = message.from_user.id
-    dish_name = extract_dish_name_from_request(message.text)
-    
+    # Фильтр уже разобрал текст; иначе разбираем здесь
+    dish_name = (intent or intent_engine.detect(message.text)).dish_name
+    # Сначала применяем продукты, набранные перед запросом
+    await input_debouncer.flush(user_id)
+    await send_direct_recipe(message, user_id, dish_name)
+
+async def send_direct_recipe(message: Message, user_id: int, dish_name: str):
+    """Рецепт по названию блюда, без сброса ввода (можно звать из-под debouncer)"""
     if len(dish_name) < 3:
         await message.answer("Напишите название блюда.", parse_mode="HTML")
         return
 
-    wait = await message.answer(f"⚡️ Ищу: <b>{dish_name}</b>...", parse_mode="HTML")
+    progress = await ProgressMessage.send(message, f"⚡️ Ищу: <b>{dish_name}</b>...", parse_mode="HTML")
+    await send_freestyle_recipe(progress, user_id, dish_name)
+
+async def find_stored_recipe(dish_name: str) -> Optional[str]:
+    """Рецепт этого блюда среди уже сгенерированных (на том же языке) или None"""
+    if not RECIPE_SEARCH_CACHE or not state_manager.db_connected:
+        return None
     try:
-        recipe = await groq_service.generate_freestyle_recipe(dish_name)
-        await wait.delete()
+        with span("recipe.search"):
+            matches = await database.search_recipes(dish_name, limit=5, extra_terms=RECIPE_SEARCH_EXTRA_TERMS)
+    except Exception as e:
+        RECIPE_CACHE_LOOKUPS.labels("error").inc()
+        logger.warning(f"Поиск сохранённого рецепта не удался: {e}")
+        return None
+
+    language = GroqService._detect_input_language(dish_name)
+    for match in matches:
+        if match["exact"] and GroqService._detect_input_language(match["dish_name"]) == language:
+            RECIPE_CACHE_LOOKUPS.labels("hit").inc()
+            logger.info(f"📚 Рецепт из сохранённых: {dish_name} -> {match['dish_name']} (id={match['id']})")
+            return match["recipe_text"]
+    RECIPE_CACHE_LOOKUPS.labels("miss").inc()
+    return None
+
+async def send_freestyle_recipe(progress: ProgressMessage, user_id: int, dish_name: str):
+    """Отдаёт рецепт по названию блюда (сохранённый или новый от Groq), редактируя заглушку"""
+    try:
+        recipe = await find_stored_recipe(dish_name)
+        if recipe is None:
+            async with flow_slot("recipe", progress):
+                recipe = await groq_service.generate_freestyle_recipe(dish_name)
         
         # Сохраняем состояние
-        await state_manager.set_current_dish(user_id, dish_name)
-        await state_manager.set_state(user_id, "recipe_sent")
+        async with state_manager.batch(user_id):
+            await state_manager.set_current_dish(user_id, dish_name)
+            await state_manager.set_state(user_id, "recipe_sent")
         
         # Сохраняем рецепт в историю БД
         await state_manager.save_recipe_to_history(user_id, dish_name, recipe)
         
-        await message.answer(recipe, reply_markup=get_hide_keyboard(), parse_mode="HTML")
+        await progress.finish(recipe, reply_markup=get_hide_keyboard(), parse_mode="HTML")
+    except AdmissionRejected:
+        await progress.finish(BUSY_TEXT)
     except Exception as e:
-        await wait.delete()
         logger.error(f"Ошибка генерации рецепта: {e}")
-        await message.answer("❌ Ошибка генерации рецепта.")
+        await progress.finish("❌ Ошибка генерации рецепта.")
 
 async def handle_delete_msg(callback: CallbackQuery):
     """Удалить сообщение"""
@@ -222,13 +316,14 @@ async def handle_delete_msg(callback: CallbackQuery):
 async def handle_voice(message: Message):
     """Обработка голосового сообщения"""
     user_id = message.from_user.id
-    processing_msg = await message.answer("🎧 Слушаю...")
+    progress = await ProgressMessage.send(message, "🎧 Слушаю...")
     temp_file = f"temp/voice_{user_id}_{message.voice.file_id}.ogg"
     
     try:
-        await message.bot.download(message.voice, destination=temp_file)
-        text = await voice_processor.process_voice(temp_file)
-        await processing_msg.delete()
+        async with flow_slot("voice", progress):
+            with span("voice.download"):
+                await message.bot.download(message.voice, destination=temp_file)
+            text = await voice_processor.process_voice(temp_file)
         
         # Удаляем голосовое сообщение для чистоты чата
         try: 
@@ -236,47 +331,34 @@ async def handle_voice(message: Message):
         except: 
             pass
         
-        # Проверяем, не является ли это запросом рецепта
-        if is_recipe_request(text):
-            await handle_direct_recipe_from_voice(message, text)
+        # Заглушка "Слушаю..." редактируется в ответ на распознанный текст
+        intent = intent_engine.detect(text)
+        if intent.intent == RECIPE:
+            await input_debouncer.flush(user_id)
+            await handle_direct_recipe_from_voice(message, intent.dish_name, progress)
         else:
-            await process_products_input(message, user_id, text)
+            await input_debouncer.submit(message, user_id, text, progress)
             
+    except AdmissionRejected:
+        await progress.finish(BUSY_TEXT)
     except Exception as e:
-        await processing_msg.delete()
-        await message.answer(f"😕 Не разобрал: {e}")
+        await progress.finish(f"😕 Не разобрал: {e}")
         if os.path.exists(temp_file):
             try: 
                 os.remove(temp_file)
             except: 
                 pass
 
-async def handle_direct_recipe_from_voice(message: Message, recognized_text: str):
+async def handle_direct_recipe_from_voice(message: Message, dish_name: str, progress: ProgressMessage):
     """Обработка запроса рецепта из голосового сообщения"""
     user_id = message.from_user.id
-    dish_name = extract_dish_name_from_request(recognized_text)
     
     if len(dish_name) < 3:
-        await message.answer("Название блюда слишком короткое.", parse_mode="HTML")
+        await progress.finish("Название блюда слишком короткое.", parse_mode="HTML")
         return
 
-    wait = await message.answer(f"⚡️ Ищу: <b>{dish_name}</b>...", parse_mode="HTML")
-    try:
-        recipe = await groq_service.generate_freestyle_recipe(dish_name)
-        await wait.delete()
-        
-        # Сохраняем состояние
-        await state_manager.set_current_dish(user_id, dish_name)
-        await state_manager.set_state(user_id, "recipe_sent")
-        
-        # Сохраняем рецепт в историю БД
-        await state_manager.save_recipe_to_history(user_id, dish_name, recipe)
-        
-        await message.answer(recipe, reply_markup=get_hide_keyboard(), parse_mode="HTML")
-    except Exception as e:
-        await wait.delete()
-        logger.error(f"Ошибка генерации рецепта: {e}")
-        await message.answer("❌ Ошибка генерации рецепта.")
+    await progress.update(f"⚡️ Ищу: <b>{dish_name}</b>...", parse_mode="HTML")
+    await send_freestyle_recipe(progress, user_id, dish_name)
 
 async def handle_text(message: Message):
     """Обработка текстового сообщения"""
@@ -287,26 +369,45 @@ async def handle_text(message: Message):
     if text.startswith('/'):
         return
     
-    # Проверяем, не является ли это запросом рецепта
-    if is_recipe_request(text):
-        await handle_direct_recipe(message)
+    # Запросы рецептов обычно перехватывает IntentFilter; это страховка
+    intent = intent_engine.detect(text)
+    if intent.intent == RECIPE:
+        await handle_direct_recipe(message, intent)
         return
     
-    await process_products_input(message, user_id, text)
+    # Быстрые сообщения подряд склеиваются в один ввод
+    await input_debouncer.submit(message, user_id, text)
 
 # --- ГЛАВНАЯ ЛОГИКА ОБРАБОТКИ ПРОДУКТОВ ---
 
-async def process_products_input(message: Message, user_id: int, text: str):
+async def process_products_input(
+    message: Message,
+    user_id: int,
+    text: str,
+    progress: Optional[ProgressMessage] = None
+):
     """Основная логика обработки ввода продуктов (ТОЛЬКО для продуктов)"""
-    # Сначала проверяем, что это не запрос рецепта (дополнительная защита)
-    if is_recipe_request(text):
-        await handle_direct_recipe(message)
+    # Ответ либо редактирует заглушку (голосовой ввод), либо уходит новым сообщением
+    async def reply(reply_text: str, **kwargs):
+        if progress:
+            await progress.finish(reply_text, **kwargs)
+        else:
+            await message.answer(reply_text, **kwargs)
+
+    # Сначала проверяем, что это не запрос рецепта (склеенный ввод мог им стать).
+    # Вызов идёт из-под lock debouncer: flush здесь — вечная блокировка, поэтому без handle_direct_recipe
+    intent = intent_engine.detect(text)
+    if intent.intent == RECIPE:
+        if progress:
+            await handle_direct_recipe_from_voice(message, intent.dish_name, progress)
+        else:
+            await send_direct_recipe(message, user_id, intent.dish_name)
         return
     
     # Пасхалка
-    if text.lower().strip(" .!") in ["спасибо", "спс", "благодарю"]:
+    if intent.intent == THANKS:
         if state_manager.get_state(user_id) == "recipe_sent":
-            await message.answer("На здоровье! 👨‍🍳")
+            await reply("На здоровье! 👨‍🍳")
             await state_manager.clear_state(user_id)
             return
 
@@ -321,7 +422,7 @@ async def process_products_input(message: Message, user_id: int, text: str):
         # Валидация при первом вводе
         is_valid = await groq_service.validate_ingredients(text)
         if not is_valid:
-            await message.answer(f"🤨 <b>\"{text}\"</b> — не похоже на продукты.", parse_mode="HTML")
+            await reply(f"🤨 <b>\"{text}\"</b> — не похоже на продукты.", parse_mode="HTML")
             return
         
         await state_manager.set_products(user_id, text)
@@ -332,56 +433,89 @@ async def process_products_input(message: Message, user_id: int, text: str):
         msg_text = f"➕ Добавлено: <b>{text}</b>\n🛒 <b>Всего:</b> {all_products}"
 
     # Показываем кнопки: Добавить еще или Готовить
-    await message.answer(msg_text, reply_markup=get_confirmation_keyboard(), parse_mode="HTML")
+    await reply(msg_text, reply_markup=get_confirmation_keyboard(), parse_mode="HTML")
+
+input_debouncer = InputDebouncer(process_products_input)
 
 # --- ЛОГИКА КАТЕГОРИЙ И БЛЮД ---
 
-async def start_category_flow(message: Message, user_id: int):
+async def start_category_flow(message: Message, user_id: int, progress: Optional[ProgressMessage] = None):
     """Начало выбора категории"""
     products = state_manager.get_products(user_id)
     if not products:
-        await message.answer("Список продуктов пуст. Начните заново /start")
+        if progress:
+            await progress.finish("Список продуктов пуст. Начните заново /start")
+        else:
+            await message.answer("Список продуктов пуст. Начните заново /start")
         return
 
-    wait = await message.answer("👨‍🍳 Думаю, что приготовить...")
+    if progress:
+        await progress.update("👨‍🍳 Думаю, что приготовить...")
+    else:
+        progress = await ProgressMessage.send(message, "👨‍🍳 Думаю, что приготовить...")
+
+    # Проверенные рецепты из индекса в памяти — без ожидания Groq
+    proven = pantry_index.match(products)
     
-    categories = await groq_service.analyze_categories(products)
+    try:
+        async with flow_slot("menu", progress):
+            categories = await groq_service.analyze_categories(products)
+    except AdmissionRejected:
+        await progress.finish(BUSY_TEXT)
+        return
     
-    await wait.delete()
     if not categories:
-        await message.answer("Из этого сложно что-то приготовить.")
+        if proven:
+            await progress.finish(proven_recipes_text(proven).rstrip(),
+                                  reply_markup=with_proven_recipes(InlineKeyboardMarkup(inline_keyboard=[]), proven),
+                                  parse_mode="HTML")
+        else:
+            await progress.finish("Из этого сложно что-то приготовить.")
         return
 
     await state_manager.set_categories(user_id, categories)
 
     if len(categories) == 1:
-        await show_dishes_for_category(message, user_id, products, categories[0])
+        await show_dishes_for_category(message, user_id, products, categories[0], progress, proven)
     else:
-        await message.answer("📂 <b>Выберите категорию:</b>", 
-                           reply_markup=get_categories_keyboard(categories), 
-                           parse_mode="HTML")
-
-async def show_dishes_for_category(message: Message, user_id: int, products: str, category: str):
+        await progress.finish(proven_recipes_text(proven) + "📂 <b>Выберите категорию:</b>", 
+                              reply_markup=with_proven_recipes(get_categories_keyboard(categories), proven), 
+                              parse_mode="HTML")
+
+async def show_dishes_for_category(
+    message: Message,
+    user_id: int,
+    products: str,
+    category: str,
+    progress: Optional[ProgressMessage] = None,
+    proven: Optional[List[PantryMatch]] = None
+):
     """Показать блюда выбранной категории"""
     cat_name = CATEGORY_MAP.get(category, "Блюда")
-    wait = await message.answer(f"🍳 Подбираю {cat_name}...")
+    if progress:
+        await progress.update(f"🍳 Подбираю {cat_name}...")
+    else:
+        progress = await ProgressMessage.send(message, f"🍳 Подбираю {cat_name}...")
     
-    dishes_list = await groq_service.generate_dishes_list(products, category)
+    try:
+        async with flow_slot("menu", progress):
+            dishes_list = await groq_service.generate_dishes_list(products, category)
+    except AdmissionRejected:
+        await progress.finish(BUSY_TEXT)
+        return
     
     if not dishes_list:
-        await wait.delete()
-        await message.answer("Не удалось придумать рецепты. Попробуйте другую категорию.")
+        await progress.finish("Не удалось придумать рецепты. Попробуйте другую категорию.")
         return
 
-    await state_manager.set_generated_dishes(user_id, dishes_list)
-    
     response_text = f"🍽 <b>Меню: {cat_name}</b>\n\n"
     for dish in dishes_list:
         response_text += f"🔸 <b>{dish['name']}</b>\n<i>{dish['desc']}</i>\n\n"
+    response_text += proven_recipes_text(proven)
     
-    await state_manager.add_message(user_id, "bot", response_text)
-    
-    await wait.delete()
+    async with state_manager.batch(user_id):
+        await state_manager.set_generated_dishes(user_id, dishes_list)
+        await state_manager.add_message(user_id, "bot", response_text)
     
     # Если это комплексный обед, показываем только одну кнопку
     if category == "mix":
@@ -392,28 +526,88 @@ async def show_dishes_for_category(message: Message, user_id: int, products: str
     else:
         kb = get_dishes_keyboard(dishes_list)
         
-    await message.answer(response_text, reply_markup=kb, parse_mode="HTML")
+    await progress.finish(response_text, reply_markup=with_proven_recipes(kb, proven), parse_mode="HTML")
 
 async def generate_and_send_recipe(message: Message, user_id: int, dish_name: str):
     """Генерация и отправка рецепта"""
-    wait = await message.answer(f"👨‍🍳 Пишу рецепт: <b>{dish_name}</b>...", parse_mode="HTML")
+    # Меню блюд остаётся на экране, заглушка редактируется в рецепт
+    progress = await ProgressMessage.send(message, f"👨‍🍳 Пишу рецепт: <b>{dish_name}</b>...", parse_mode="HTML")
     products = state_manager.get_products(user_id)
     
-    recipe = await groq_service.generate_recipe(dish_name, products)
-    
-    await wait.delete()
+    try:
+        async with flow_slot("recipe", progress):
+            recipe = await groq_service.generate_recipe(dish_name, products)
+    except AdmissionRejected:
+        await progress.finish(BUSY_TEXT)
+        return
     
     # Сохраняем состояние
-    await state_manager.set_current_dish(user_id, dish_name)
-    await state_manager.set_state(user_id, "recipe_sent")
+    async with state_manager.batch(user_id):
+        await state_manager.set_current_dish(user_id, dish_name)
+        await state_manager.set_state(user_id, "recipe_sent")
     
     # СОХРАНЯЕМ РЕЦЕПТ В БД
     await state_manager.save_recipe_to_history(user_id, dish_name, recipe)
     
-    await message.answer(recipe, reply_markup=get_recipe_back_keyboard(), parse_mode="HTML")
+    await progress.finish(recipe, reply_markup=get_recipe_back_keyboard(), parse_mode="HTML")
 
 # --- CALLBACK ОБРАБОТЧИКИ ---
 
+async def handle_history_page(callback: CallbackQuery):
+    """◀ ▶ в /stats: соседняя страница истории (меняется только клавиатура)"""
+    parsed = parse_page_callback(callback.data)
+    if not parsed:
+        await callback.answer()
+        return
+    direction, cursor = parsed
+    try:
+        page = await recipe_history.page(callback.from_user.id, cursor, direction)
+    except Exception as e:
+        logger.error(f"Ошибка листания истории: {e}")
+        await callback.answer("❌ История недоступна")
+        return
+    if not page.recipes:
+        await callback.answer("Дальше рецептов нет")
+        return
+    await callback.message.edit_reply_markup(reply_markup=get_stats_keyboard(page))
+    await callback.answer()
+
+async def handle_history_recipe(callback: CallbackQuery):
+    """Рецепт из истории: текст читается из БД только сейчас"""
+    cursor = parse_open_callback(callback.data)
+    recipe = None
+    if cursor:
+        try:
+            recipe = await recipe_history.recipe(callback.from_user.id, cursor)
+        except Exception as e:
+            logger.error(f"Ошибка чтения рецепта из истории: {e}")
+    if not recipe:
+        await callback.answer("Рецепт не найден")
+        return
+    await callback.message.answer(recipe["recipe_text"], reply_markup=get_hide_keyboard(), parse_mode="HTML")
+    await callback.answer()
+
+async def handle_proven_recipe(callback: CallbackQuery):
+    """Сохранённый рецепт по хешу тела (подсказки по продуктам и /quick): отдаём как сгенерированный, без Groq"""
+    user_id = callback.from_user.id
+    body_hash = parse_callback(callback.data)
+    recipe = None
+    if body_hash:
+        try:
+            recipe = await database.get_recipe_body(body_hash)
+        except Exception as e:
+            logger.error(f"Ошибка чтения сохранённого рецепта: {e}")
+    if not recipe:
+        await callback.answer("Рецепт не найден")
+        return
+    await callback.answer()
+
+    async with state_manager.batch(user_id):
+        await state_manager.set_current_dish(user_id, recipe["dish_name"])
+        await state_manager.set_state(user_id, "recipe_sent")
+    await state_manager.save_recipe_to_history(user_id, recipe["dish_name"], recipe["recipe_text"])
+    await callback.message.answer(recipe["recipe_text"], reply_markup=get_recipe_back_keyboard(), parse_mode="HTML")
+
 async def handle_callback(callback: CallbackQuery):
     """Обработка всех callback-запросов"""
     user_id = callback.from_user.id
@@ -429,9 +623,8 @@ async def handle_callback(callback: CallbackQuery):
     # 2. Очистка истории пользователя
     if data == "clear_my_history":
         try:
-            # Получаем ID пользователя из БД
-            async with database.pool.acquire() as conn:
-                await conn.execute("DELETE FROM recipes WHERE user_id = $1", user_id)
+            await database.clear_recipes(user_id)
+            recipe_history.invalidate(user_id)
             await callback.message.edit_text("✅ Ваша история рецептов очищена.")
         except Exception as e:
             logger.error(f"Ошибка очистки истории: {e}")
@@ -439,6 +632,20 @@ async def handle_callback(callback: CallbackQuery):
         await callback.answer()
         return
 
+    # История рецептов: листание страниц и открытие рецепта
+    if data.startswith(PAGE_PREFIX):
+        await handle_history_page(callback)
+        return
+
+    if data.startswith(OPEN_PREFIX):
+        await handle_history_recipe(callback)
+        return
+
+    # Проверенный рецепт из продуктов пользователя
+    if data.startswith(PANTRY_PREFIX):
+        await handle_proven_recipe(callback)
+        return
+
     # 3. Выбор: Добавить или Готовить
     if data == "action_add_more":
         await callback.message.answer("✏️ Напишите или продиктуйте, что добавить:")
@@ -446,18 +653,20 @@ async def handle_callback(callback: CallbackQuery):
         return
     
     if data == "action_cook":
-        await callback.message.delete()
-        await start_category_flow(callback.message, user_id)
         await callback.answer()
+        # Сообщение с кнопками само становится заглушкой
+        progress = await ProgressMessage.reuse(callback.message, "👨‍🍳 Думаю, что приготовить...")
+        await start_category_flow(callback.message, user_id, progress)
         return
 
     # 4. Выбор категории
     if data.startswith("cat_"):
         category = data.split("_")[1]
         products = state_manager.get_products(user_id)
-        await callback.message.delete()
-        await show_dishes_for_category(callback.message, user_id, products, category)
         await callback.answer()
+        cat_name = CATEGORY_MAP.get(category, "Блюда")
+        progress = await ProgressMessage.reuse(callback.message, f"🍳 Подбираю {cat_name}...")
+        await show_dishes_for_category(callback.message, user_id, products, category, progress)
         return
 
     # 5. Назад к категориям
@@ -467,14 +676,15 @@ async def handle_callback(callback: CallbackQuery):
             await callback.answer("Сессия истекла.")
             return
         
-        await callback.message.delete()
+        # Редактируем текущее сообщение вместо удаления и отправки нового
+        screen = ProgressMessage(callback.message)
         if len(categories) == 1:
-            await callback.message.answer("Категория была одна.", 
-                                        reply_markup=get_categories_keyboard(categories))
+            await screen.finish("Категория была одна.", 
+                                reply_markup=get_categories_keyboard(categories))
         else:
-            await callback.message.answer("📂 <b>Выберите категорию:</b>", 
-                                        reply_markup=get_categories_keyboard(categories), 
-                                        parse_mode="HTML")
+            await screen.finish("📂 <b>Выберите категорию:</b>", 
+                                reply_markup=get_categories_keyboard(categories), 
+                                parse_mode="HTML")
         await callback.answer()
         return
 
@@ -517,15 +727,18 @@ async def handle_callback(callback: CallbackQuery):
 # --- РЕГИСТРАЦИЯ ХЭНДЛЕРОВ (ИСПРАВЛЕННЫЙ ПОРЯДОК) ---
 
 def register_handlers(dp: Dispatcher):
+    # Накопленный ввод продуктов применяется до команд и callback'ов
+    dp.message.outer_middleware(InputDebounceFlushMiddleware(input_debouncer))
+    dp.callback_query.outer_middleware(InputDebounceFlushMiddleware(input_debouncer))
+    
     # Сначала специфичные обработчики команд
     dp.message.register(cmd_start, Command("start"))
     dp.message.register(cmd_author, Command("author"))
     dp.message.register(cmd_stats, Command("stats"))
+    dp.message.register(cmd_quick, Command("quick"))
     
     # Затем обработчик запросов рецептов (до общего обработчика текста!)
-    dp.message.register(handle_direct_recipe, F.text.lower().startswith("дай рецепт"))
-    dp.message.register(handle_direct_recipe, F.text.lower().startswith("рецепт"))
-    dp.message.register(handle_direct_recipe, F.text.lower().startswith("как приготовить"))
+    dp.message.register(handle_direct_recipe, F.text, IntentFilter(RECIPE))
     
     # Затем обработчики контента
     dp.message.register(handle_voice, F.voice)
@@ -0,0 +1,109 @@
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from config import HISTORY_PAGE_SIZE, HISTORY_CACHE_SECONDS
+from database import db
+
+logger = logging.getLogger(__name__)
+
+# Callback'и браузера истории: страница старше/новее курсора и открытие рецепта.
+# Курсор — (created_at, id) записи: keyset по индексу (user_id, created_at, id),
+# created_at в курсоре ещё и даёт отсечение партиций
+PAGE_PREFIX = "hist_"
+OPEN_PREFIX = "recipe_"
+OLDER = "o"
+NEWER = "n"
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+Cursor = Tuple[datetime, int]
+
+class HistoryPage(NamedTuple):
+    recipes: List[Dict]     # id, dish_name, created_at — без текста рецепта
+    has_older: bool
+    has_newer: bool
+
+def encode_cursor(recipe: Dict) -> str:
+    """(created_at, id) -> компактная строка для callback_data (лимит Telegram — 64 байта)"""
+    micros = (recipe["created_at"] - _EPOCH) // _MICROSECOND
+    return f"{micros:x}_{recipe['id']}"
+
+def decode_cursor(value: str) -> Optional[Cursor]:
+    try:
+        micros, recipe_id = value.split("_")
+        return _EPOCH + timedelta(microseconds=int(micros, 16)), int(recipe_id)
+    except ValueError:
+        return None
+
+def page_callback(direction: str, recipe: Dict) -> str:
+    return f"{PAGE_PREFIX}{direction}{encode_cursor(recipe)}"
+
+def open_callback(recipe: Dict) -> str:
+    return f"{OPEN_PREFIX}{encode_cursor(recipe)}"
+
+def parse_page_callback(data: str) -> Optional[Tuple[str, Cursor]]:
+    body = data[len(PAGE_PREFIX):]
+    if not body or body[0] not in (OLDER, NEWER):
+        return None
+    cursor = decode_cursor(body[1:])
+    return (body[0], cursor) if cursor else None
+
+def parse_open_callback(data: str) -> Optional[Cursor]:
+    return decode_cursor(data[len(OPEN_PREFIX):])
+
+class RecipeHistory:
+    """Постраничная история рецептов пользователя.
+
+    Страницы берутся keyset-запросом (без OFFSET) и только с колонками для
+    списка; текст рецепта читается, лишь когда пользователь открывает
+    запись. Листание туда-обратно обслуживается из короткого кеша страниц;
+    новый или удалённый рецепт сбрасывает кеш пользователя.
+    """
+
+    def __init__(self, page_size: int = HISTORY_PAGE_SIZE, ttl: float = HISTORY_CACHE_SECONDS, max_users: int = 10_000):
+        self.page_size = page_size
+        self.ttl = ttl
+        self.max_users = max_users
+        # user_id -> {(направление, курсор): (истекает, страница)}
+        self._cache: "OrderedDict[int, Dict[Tuple, Tuple[float, HistoryPage]]]" = OrderedDict()
+
+    async def page(self, user_id: int, cursor: Optional[Cursor] = None, direction: str = OLDER) -> HistoryPage:
+        key = (direction, cursor)
+        now = time.monotonic()
+        pages = self._cache.get(user_id)
+        if pages is not None:
+            self._cache.move_to_end(user_id)
+            cached = pages.get(key)
+            if cached and cached[0] > now:
+                return cached[1]
+
+        newer = direction == NEWER
+        rows = await db.get_recipe_page(user_id, self.page_size + 1, cursor, newer=newer)
+        more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if newer:
+            rows.reverse()  # запрос шёл по возрастанию
+            page = HistoryPage(rows, has_older=True, has_newer=more)
+        else:
+            page = HistoryPage(rows, has_older=more, has_newer=cursor is not None)
+
+        pages = self._cache.setdefault(user_id, {})
+        pages[key] = (now + self.ttl, page)
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.max_users:
+            self._cache.popitem(last=False)
+        return page
+
+    async def recipe(self, user_id: int, cursor: Cursor) -> Optional[Dict]:
+        created_at, recipe_id = cursor
+        return await db.get_recipe(user_id, recipe_id, created_at)
+
+    def invalidate(self, user_id: int):
+        self._cache.pop(user_id, None)
+
+# Глобальный экземпляр
+recipe_history = RecipeHistory()
@@ -0,0 +1,88 @@
+import re
+from typing import Any, Dict, NamedTuple, Union
+
+from aiogram.filters import BaseFilter
+from aiogram.types import Message
+
+# Намерения
+RECIPE = "recipe_request"
+THANKS = "thanks"
+PRODUCTS = "products_list"
+UNKNOWN = "unknown"
+
+# Начала запроса рецепта (фрагменты регулярного выражения, пробел = \s+)
+RECIPE_PHRASES = [
+    "дай рецепт(?:ы|ик)?", "рецепт(?:ы|ик)?", "как приготовить", "как сделать", "как готовить",
+    "хочу приготовить", "хочу сделать", "готовим", "приготовь", "сделай",
+    "recipe for", "recipe", "how to cook", "how to make",
+    "i want to cook", "i want to make", "cook", "make",
+]
+THANKS_WORDS = ["спасибо", "спс", "благодарю", "thanks", "thank you"]
+POLITE_WORDS = ["пожалуйста", "please", "плиз"]
+
+class IntentResult(NamedTuple):
+    intent: str
+    dish_name: str = ""
+
+def _alternation(phrases) -> str:
+    # Длинные фразы раньше коротких: "recipe for" не должен съесться "recipe"
+    ordered = sorted(phrases, key=len, reverse=True)
+    return "|".join(p.replace(" ", r"\s+") for p in ordered)
+
+class IntentEngine:
+    """Определение намерения за один проход скомпилированного выражения.
+
+    Одно выражение с именованными группами разбирает начало текста: фраза
+    запроса рецепта (дальше — название блюда) или благодарность. Всё
+    остальное — ввод продуктов. Используется фильтром хэндлеров, текстом и
+    голосом, поэтому все пути понимают запросы одинаково.
+    """
+
+    _PATTERN = re.compile(
+        r"^\s*(?:"
+        rf"(?P<recipe>{_alternation(RECIPE_PHRASES)})"
+        r"(?![a-zа-яё0-9])[\s,:;.\-!?]*(?P<dish>.*)"
+        r"|"
+        rf"(?P<thanks>{_alternation(THANKS_WORDS)})[\s.!)]*"
+        r")$",
+        re.IGNORECASE | re.DOTALL,
+    )
+    _POLITE_EDGES = re.compile(
+        rf"^(?:(?:{_alternation(POLITE_WORDS)})[\s,]*)+|(?:[\s,]*(?:{_alternation(POLITE_WORDS)}))+[\s.!?]*$|[\s.!?]+$",
+        re.IGNORECASE,
+    )
+    _SPACES = re.compile(r"\s+")
+
+    MIN_DISH_LENGTH = 3
+
+    def detect(self, text: str) -> IntentResult:
+        if not text or not text.strip():
+            return IntentResult(UNKNOWN)
+        match = self._PATTERN.match(text)
+        if match is None:
+            return IntentResult(PRODUCTS)
+        if match.group("thanks"):
+            return IntentResult(THANKS)
+        return IntentResult(RECIPE, self._clean_dish(match.group("dish")))
+
+    def _clean_dish(self, dish: str) -> str:
+        dish = self._POLITE_EDGES.sub("", dish)
+        return self._SPACES.sub(" ", dish).strip().lower()
+
+class IntentFilter(BaseFilter):
+    """Фильтр aiogram: пропускает сообщения с нужным намерением и передаёт
+    результат в хэндлер аргументом intent (повторно текст не разбирается)."""
+
+    def __init__(self, intent: str):
+        self.intent = intent
+
+    async def __call__(self, message: Message) -> Union[bool, Dict[str, Any]]:
+        if not message.text:
+            return False
+        result = intent_engine.detect(message.text)
+        if result.intent != self.intent:
+            return False
+        return {"intent": result}
+
+# Глобальный экземпляр
+intent_engine = IntentEngine()
@@ -0,0 +1,109 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Set
+
+logger = logging.getLogger(__name__)
+
+class WriteJournal:
+    """Локальный append-only журнал записей, не дошедших до хранилища.
+
+    Каждая запись — строка JSON. Перед воспроизведением журнал
+    переименовывается в *.replaying: новые записи во время replay идут в
+    свежий файл, а при сбое replay невоспроизведённый остаток остаётся
+    в *.replaying до следующей попытки. Сверх max_bytes (0 — без предела)
+    новые записи отбрасываются.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 0):
+        self.path = path
+        self.replaying_path = path + ".replaying"
+        self.max_bytes = max_bytes
+        self.appended = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def _append_sync(self, lines: List[str]):
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def append(self, op: str, **payload) -> bool:
+        """Дописывает запись; False — журнал переполнен и запись отброшена"""
+        if self.max_bytes and self.size() >= self.max_bytes:
+            if not self.dropped:
+                logger.error(f"❌ Журнал {self.path} переполнен ({self.max_bytes} байт), новые записи отбрасываются")
+            self.dropped += 1
+            return False
+        entry = {"op": op, "ts": time.time(), **payload}
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"), default=str) + "\n"
+        await asyncio.to_thread(self._append_sync, [line])
+        self.appended += 1
+        return True
+
+    def size(self) -> int:
+        return sum(os.path.getsize(p) for p in (self.replaying_path, self.path) if os.path.exists(p))
+
+    def has_entries(self) -> bool:
+        return self.size() > 0
+
+    @staticmethod
+    def _read_sync(path: str) -> List[Dict[str, Any]]:
+        if not os.path.exists(path):
+            return []
+        entries = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # Оборванная последняя строка после падения процесса
+                    logger.warning("⚠️ Пропущена повреждённая запись журнала")
+        return entries
+
+    def _user_ids_sync(self) -> Set[int]:
+        with self._lock:
+            entries = self._read_sync(self.replaying_path) + self._read_sync(self.path)
+        return {entry["user_id"] for entry in entries if "user_id" in entry}
+
+    async def user_ids(self) -> Set[int]:
+        """Пользователи, у которых в журнале есть записи"""
+        return await asyncio.to_thread(self._user_ids_sync)
+
+    def _take_sync(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            # Остаток прошлого неудачного replay идёт первым
+            if not os.path.exists(self.replaying_path) and os.path.exists(self.path):
+                os.replace(self.path, self.replaying_path)
+            elif os.path.exists(self.path):
+                with open(self.path, encoding="utf-8") as src, open(self.replaying_path, "a", encoding="utf-8") as dst:
+                    dst.write(src.read())
+                os.remove(self.path)
+        return self._read_sync(self.replaying_path)
+
+    async def take(self) -> List[Dict[str, Any]]:
+        """Забирает все записи на воспроизведение"""
+        return await asyncio.to_thread(self._take_sync)
+
+    def _finish_sync(self, remaining: List[Dict[str, Any]]):
+        with self._lock:
+            if remaining:
+                tmp = self.replaying_path + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    for entry in remaining:
+                        f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":"), default=str) + "\n")
+                os.replace(tmp, self.replaying_path)
+            elif os.path.exists(self.replaying_path):
+                os.remove(self.replaying_path)
+
+    async def finish(self, remaining: List[Dict[str, Any]]):
+        """Фиксирует итог replay: remaining — то, что воспроизвести не удалось"""
+        await asyncio.to_thread(self._finish_sync, remaining)
@@ -2,13 +2,28 @@ import asyncio
 import os
 import logging
 import sys
+from typing import Optional
 from aiogram import Bot, Dispatcher
 from aiogram.types import BotCommand
-from config import TELEGRAM_TOKEN
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+import hmac
+from config import (
+    TELEGRAM_TOKEN, BOT_MODE, WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET, DEBUG_TOKEN, CLUSTER_ROLE,
+    SESSION_RETENTION_DAYS, RECIPE_PARTITIONS_AHEAD, RECIPE_RETENTION_MONTHS
+)
 from handlers import register_handlers
 from state_manager import state_manager
 from aiohttp import web
-from database import db
+from database import db, job_runner, DatabaseUnavailable
+from sender import outbound_scheduler, api_call_stats
+from middlewares import register_middlewares
+from admission import admission
+from metrics import render_metrics, METRICS_CONTENT_TYPE
+from tracing import tracer
+from diagnostics import loop_monitor, profiler, dump_tasks
+from startup import StartupOrchestrator
+from cluster import cluster_dispatcher, WorkerAgent
+from pantry import pantry_index
 
 # Настройка логирования
 logging.basicConfig(
@@ -20,17 +35,124 @@ logger = logging.getLogger(__name__)
 
 # Инициализация
 bot = Bot(token=TELEGRAM_TOKEN)
+# Все вызовы Bot API идут через общую очередь с лимитами
+bot.session.middleware(outbound_scheduler)
 dp = Dispatcher()
+# В роли worker апдейты приходят от диспетчера кластера, а не от Telegram
+worker_agent = WorkerAgent(dp, bot) if CLUSTER_ROLE == "worker" else None
 
 # --- Веб-сервер для Render ---
 async def health_check(request):
     return web.Response(text="Bot is running OK")
 
+async def bot_api_stats(request):
+    """Среднее число вызовов Bot API на действие пользователя"""
+    return web.json_response(api_call_stats.snapshot())
+
+async def metrics_endpoint(request):
+    """Метрики в формате Prometheus"""
+    return web.Response(body=render_metrics(), headers={"Content-Type": METRICS_CONTENT_TYPE})
+
+async def job_stats(request):
+    """Фоновые задачи: кто лидер и сколько длился последний запуск"""
+    if db.pool is None:
+        return web.json_response({"error": "нет подключения к БД"}, status=503)
+    try:
+        return web.json_response(await job_runner.history())
+    except DatabaseUnavailable as e:
+        return web.json_response({"error": str(e)}, status=503)
+
+async def db_stats(request):
+    """Состояние БД: размыкатель и журнал невоспроизведённых записей"""
+    return web.json_response({
+        "connected": db.pool is not None,
+        "pool_mode": db.pool_mode,
+        "hot_path_functions": db.use_functions,
+        "breaker": db.breaker.snapshot(),
+        "pool": db.limit.snapshot(),
+        "recipe_storage": db.recipe_storage,
+        "degraded": state_manager.degraded,
+        "journal_pending": state_manager.journal.has_entries(),
+        "journal_dropped": state_manager.journal.dropped,
+    })
+
+async def admission_stats(request):
+    """Загрузка очередей дорогих потоков"""
+    return web.json_response(admission.snapshot())
+
+def require_debug_token(handler):
+    """Доступ к /debug/* только с заголовком Authorization: Bearer <DEBUG_TOKEN>"""
+    async def wrapper(request):
+        if not DEBUG_TOKEN:
+            raise web.HTTPNotFound()
+        supplied = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+        if not hmac.compare_digest(supplied, DEBUG_TOKEN):
+            raise web.HTTPForbidden()
+        return await handler(request)
+    return wrapper
+
+@require_debug_token
+async def debug_profile(request):
+    """Сэмплированный CPU-профиль event loop за ?seconds=N"""
+    try:
+        seconds = float(request.query.get("seconds", "10"))
+    except ValueError:
+        raise web.HTTPBadRequest(text="seconds должно быть числом")
+    if not profiler.available:
+        raise web.HTTPNotImplemented(text="Профилирование недоступно в этом процессе")
+    if profiler.busy:
+        raise web.HTTPConflict(text="Профилирование уже идёт")
+    return web.json_response(await profiler.profile(seconds))
+
+@require_debug_token
+async def debug_tasks(request):
+    """Список asyncio-задач со стеками"""
+    tasks = dump_tasks()
+    return web.json_response({"count": len(tasks), "tasks": tasks})
+
+@require_debug_token
+async def debug_loop(request):
+    """Последние блокировки event loop со стеками"""
+    return web.json_response(loop_monitor.snapshot())
+
+def create_web_app() -> web.Application:
+    """Создаёт aiohttp-приложение: health-check и (в режиме webhook) маршрут обновлений"""
+    app = web.Application()
+    app.router.add_get('/', health_check)
+    app.router.add_get('/health', health_check)
+    app.router.add_get('/stats/bot-api', bot_api_stats)
+    app.router.add_get('/stats/admission', admission_stats)
+    app.router.add_get('/stats/jobs', job_stats)
+    app.router.add_get('/stats/db', db_stats)
+    app.router.add_get('/metrics', metrics_endpoint)
+    app.router.add_get('/debug/profile', debug_profile)
+    app.router.add_get('/debug/tasks', debug_tasks)
+    app.router.add_get('/debug/loop', debug_loop)
+
+    if CLUSTER_ROLE == "dispatcher":
+        # Апдейты не обрабатываются здесь, а пересылаются воркеру-владельцу пользователя
+        cluster_dispatcher.register(
+            app, webhook_path=WEBHOOK_PATH if BOT_MODE == "webhook" else None, secret_token=WEBHOOK_SECRET
+        )
+        logger.info("🧭 Диспетчер кластера: маршруты /cluster/* зарегистрированы")
+    elif CLUSTER_ROLE == "worker":
+        worker_agent.register(app)
+    elif BOT_MODE == "webhook":
+        # Обновления обрабатываются в фоне: Telegram сразу получает 200,
+        # а апдейты разных пользователей идут параллельно
+        SimpleRequestHandler(
+            dispatcher=dp,
+            bot=bot,
+            handle_in_background=True,
+            secret_token=WEBHOOK_SECRET,
+        ).register(app, path=WEBHOOK_PATH)
+        logger.info(f"🔗 Webhook-маршрут зарегистрирован: {WEBHOOK_PATH}")
+
+    return app
+
 async def start_web_server():
     try:
-        app = web.Application()
-        app.router.add_get('/', health_check)
-        app.router.add_get('/health', health_check)
+        app = create_web_app()
         runner = web.AppRunner(app)
         await runner.setup()
         
@@ -38,15 +160,76 @@ async def start_web_server():
         site = web.TCPSite(runner, '0.0.0.0', port)
         await site.start()
         logger.info(f"✅ WEB SERVER STARTED ON PORT {port}")
+        return runner
     except Exception as e:
         logger.error(f"❌ Error starting web server: {e}")
+        return None
+
+# --- ПОЛУЧЕНИЕ ОБНОВЛЕНИЙ ---
+async def prepare_updates():
+    """Polling: снимаем webhook. Webhook: регистрируем его в Telegram"""
+    if BOT_MODE == "webhook":
+        webhook_url = f"{WEBHOOK_BASE_URL}{WEBHOOK_PATH}"
+        await bot.set_webhook(
+            url=webhook_url,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+            drop_pending_updates=True
+        )
+        logger.info(f"✅ Webhook установлен: {webhook_url}")
+    else:
+        await bot.delete_webhook(drop_pending_updates=True)
+
+async def run_polling():
+    """Классический long polling (диспетчер кластера только пересылает апдейты)"""
+    if CLUSTER_ROLE == "dispatcher":
+        await cluster_dispatcher.poll(bot, dp.resolve_used_update_types())
+    else:
+        await dp.start_polling(bot)
+
+async def run_worker():
+    """Воркер кластера: апдейты приходят на /worker/update, ждём остановки"""
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await worker_agent.leave()
+
+async def run_webhook():
+    """Ждёт остановки процесса, затем снимает webhook"""
+    try:
+        await asyncio.Event().wait()
+    finally:
+        try:
+            await bot.delete_webhook()
+            logger.info("🔌 Webhook удалён")
+        except Exception as e:
+            logger.error(f"❌ Не удалось удалить webhook: {e}")
+
+# --- ФОНОВЫЕ ЗАДАЧИ ---
+def register_jobs():
+    """Периодические задачи; каждая выполняется только на одном инстансе (advisory lock)"""
+    job_runner.add("session_cleanup", 6 * 3600, lambda: db.cleanup_old_sessions(SESSION_RETENTION_DAYS))
+    job_runner.add("stats_refresh", 10 * 60, db.refresh_stats)
+    job_runner.add("recipe_bodies_compact", 30 * 60, db.compact_recipe_bodies)
+    job_runner.add("recipe_bodies_parse", 10 * 60, db.parse_recipe_bodies)
+    job_runner.add(
+        "recipe_partitions", 24 * 3600,
+        lambda: db.maintain_recipe_partitions(RECIPE_PARTITIONS_AHEAD, RECIPE_RETENTION_MONTHS)
+    )
+
+async def start_jobs():
+    if not state_manager.db_connected:
+        raise RuntimeError("нет подключения к БД")
+    register_jobs()
+    await job_runner.start()
 
 # --- НАСТРОЙКА МЕНЮ БОТА ---
 async def setup_bot_commands(bot: Bot):
     commands = [
         BotCommand(command="/start", description="🔄 Рестарт / новые продукты"),
         BotCommand(command="/author", description="👨‍💻 Автор бота"),
-        BotCommand(command="/stats", description="📊 Статистика и история")
+        BotCommand(command="/stats", description="📊 Статистика и история"),
+        BotCommand(command="/quick", description="⏱ Быстрые рецепты")
     ]
     try:
         await bot.set_my_commands(commands)
@@ -57,46 +240,70 @@ async def setup_bot_commands(bot: Bot):
 # --- ГЛАВНАЯ ФУНКЦИЯ ---
 async def main():
     logger.info("🤖 Инициализация кулинарного бота с БД Supabase...")
-    
-    # 1. Инициализация базы данных
-    try:
-        await db.connect()
-        logger.info("✅ Подключение к Supabase установлено")
-    except Exception as e:
-        logger.error(f"❌ Критическая ошибка подключения к БД: {e}")
-        logger.warning("⚠️  Бот запускается в режиме без БД")
-    
-    # 2. Инициализация StateManager
-    try:
-        await state_manager.initialize()
-        logger.info("✅ StateManager инициализирован")
-    except Exception as e:
-        logger.error(f"❌ Ошибка инициализации StateManager: {e}")
-    
-    # 3. Запуск веб-сервера для Render
-    await start_web_server()
-    
-    # 4. Регистрация обработчиков (ВАЖНО: порядок имеет значение!)
+
+    # Регистрация обработчиков синхронная и нужна webhook-маршруту (ВАЖНО: порядок имеет значение!)
+    register_middlewares(dp)
     register_handlers(dp)
     logger.info("✅ Обработчики зарегистрированы (с правильным порядком)")
-    
-    # 5. Настройка команд бота
-    await setup_bot_commands(bot)
-    
-    logger.info("🚀 Запуск бота...")
-    
-    # 6. Удаляем вебхук и запускаем polling
-    await bot.delete_webhook(drop_pending_updates=True)
-    
+
+    runner: Optional[web.AppRunner] = None
+
+    async def start_web():
+        nonlocal runner
+        runner = await start_web_server()
+        if not runner and BOT_MODE == "webhook":
+            raise RuntimeError("веб-сервер не запущен, webhook недоступен")
+
+    async def init_db():
+        # Один пул на всё приложение: StateManager подключает db и работает через него
+        await state_manager.initialize()
+        if not state_manager.db_connected:
+            raise RuntimeError("бот запускается в режиме без БД")
+
+    # Независимые шаги идут параллельно; webhook регистрируем, когда сервер уже слушает
+    # Диспетчер кластера не работает с БД; воркеры не общаются с Telegram за апдейтами
+    startup = StartupOrchestrator()
+    startup.add("tracer", tracer.start)
+    startup.add("loop_monitor", loop_monitor.start)
+    startup.add("web_server", start_web, critical=BOT_MODE == "webhook" or CLUSTER_ROLE != "single")
+    if CLUSTER_ROLE != "dispatcher":
+        startup.add("db", init_db)
+        startup.add("jobs", start_jobs, after=["db"])
+        startup.add("pantry_index", pantry_index.start, after=["db"])
+    if CLUSTER_ROLE == "worker":
+        startup.add("cluster_join", worker_agent.join, after=["web_server", "db"], critical=True)
+    else:
+        startup.add("bot_commands", lambda: setup_bot_commands(bot))
+        # Апдейты — только после подключения БД: иначе сессии ранних пользователей уходят в журнал
+        # и их сохранённые сессии так и не загружаются
+        startup.add("updates", prepare_updates, after=[step for step in ("web_server", "db") if step in startup.steps],
+                    critical=True)
+
     try:
-        await dp.start_polling(bot)
+        await startup.run()
+        logger.info(f"🚀 Запуск бота в режиме {BOT_MODE} (роль {CLUSTER_ROLE})...")
+        # Получение обновлений: от диспетчера кластера, polling или webhook
+        if CLUSTER_ROLE == "worker":
+            await run_worker()
+        elif BOT_MODE == "webhook":
+            await run_webhook()
+        else:
+            await run_polling()
     except Exception as e:
-        logger.error(f"❌ Ошибка polling: {e}")
+        logger.error(f"❌ Ошибка получения обновлений ({BOT_MODE}): {e}")
     finally:
         # Graceful shutdown
         logger.info("🔄 Завершение работы бота...")
+        if runner:
+            await runner.cleanup()
+        await loop_monitor.stop()
+        await job_runner.stop()
+        await pantry_index.stop()
+        await tracer.shutdown()
         await state_manager.shutdown()
         await db.close()
+        await cluster_dispatcher.close()
+        await bot.session.close()
         logger.info("👋 Бот завершил работу")
 
 if __name__ == "__main__":
@@ -0,0 +1,140 @@
+import functools
+import time
+
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from admission import admission
+from tracing import span
+
+# Бакеты под реальные задержки: БД — миллисекунды, LLM и голос — секунды
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60)
+
+# ==================== GROQ ====================
+
+GROQ_REQUEST_SECONDS = Histogram(
+    "groq_request_seconds", "Время запроса к Groq", ["task_type"], buckets=SLOW_BUCKETS
+)
+GROQ_TOKENS = Counter(
+    "groq_tokens_total", "Токены Groq (prompt/completion)", ["task_type", "kind"]
+)
+GROQ_ERRORS = Counter("groq_errors_total", "Ошибки запросов к Groq", ["task_type"])
+GROQ_EMPTY_RESULTS = Counter("groq_empty_results_total", "Пустые ответы Groq", ["task_type"])
+RECIPE_CACHE_LOOKUPS = Counter(
+    "recipe_cache_lookups_total", "Поиск рецепта среди сохранённых перед Groq (hit/miss/error)", ["result"]
+)
+PANTRY_LOOKUPS = Counter(
+    "pantry_lookups_total", "Подбор сохранённых рецептов по продуктам пользователя (hit/miss)", ["result"]
+)
+PANTRY_INDEX_RECIPES = Gauge("pantry_index_recipes", "Рецепты в индексе ингредиентов в памяти")
+
+# ==================== БАЗА ДАННЫХ ====================
+
+DB_METHOD_SECONDS = Histogram(
+    "db_method_seconds", "Время выполнения методов Database", ["method"], buckets=FAST_BUCKETS
+)
+DB_METHOD_ERRORS = Counter("db_method_errors_total", "Ошибки методов Database", ["method"])
+DB_POOL_ACQUIRE_SECONDS = Histogram(
+    "db_pool_acquire_seconds", "Ожидание соединения из пула", buckets=FAST_BUCKETS
+)
+DB_POOL_IN_USE = Gauge("db_pool_in_use", "Соединения пула, занятые запросами")
+DB_POOL_WAITING = Gauge("db_pool_waiting", "Запросы в очереди за соединением")
+DB_POOL_LIMIT = Gauge("db_pool_limit", "Текущий предел одновременно занятых соединений")
+DB_POOL_OPEN = Gauge("db_pool_open", "Открытые соединения пула")
+
+CIRCUIT_STATE = Gauge("circuit_state", "Состояние размыкателя: 0 closed, 1 half-open, 2 open", ["name"])
+JOURNAL_WRITES = Counter("db_journal_writes_total", "Записи, отложенные в локальный журнал", ["op"])
+JOURNAL_REPLAYED = Counter("db_journal_replayed_total", "Воспроизведённые из журнала операции", ["op"])
+JOURNAL_DROPPED = Counter("db_journal_dropped_total", "Записи, отброшенные из-за переполнения журнала", ["op"])
+
+RECIPE_BODIES = Gauge("recipe_bodies", "Уникальные тела рецептов в recipe_bodies")
+RECIPE_STORAGE_BYTES = Gauge(
+    "recipe_storage_bytes",
+    "Объём хранения рецептов: raw_bytes/stored_bytes — тела до и после сжатия, *_table_bytes — таблицы с индексами",
+    ["kind"]
+)
+
+# ==================== ГОЛОС ====================
+
+VOICE_STAGE_SECONDS = Histogram(
+    "voice_stage_seconds", "Этапы обработки голоса (ffmpeg, asr)", ["stage"], buckets=SLOW_BUCKETS
+)
+VOICE_STAGE_ERRORS = Counter("voice_stage_errors_total", "Ошибки этапов обработки голоса", ["stage"])
+
+# ==================== BOT API ====================
+
+BOT_API_REQUEST_SECONDS = Histogram(
+    "bot_api_request_seconds", "Время вызова Bot API", ["method"], buckets=FAST_BUCKETS
+)
+BOT_API_QUEUE_WAIT_SECONDS = Histogram(
+    "bot_api_queue_wait_seconds", "Ожидание в очереди исходящих запросов", ["priority"], buckets=FAST_BUCKETS
+)
+BOT_API_ERRORS = Counter("bot_api_errors_total", "Ошибки Bot API", ["method", "error"])
+BOT_API_CALLS_PER_ACTION = Histogram(
+    "bot_api_calls_per_action", "Вызовов Bot API на одно действие пользователя", ["action"],
+    buckets=(0, 1, 2, 3, 4, 5, 6, 8, 10, 15)
+)
+
+# ==================== ХЭНДЛЕРЫ ====================
+
+HANDLER_SECONDS = Histogram(
+    "handler_seconds", "Полное время обработки апдейта", ["action"], buckets=SLOW_BUCKETS
+)
+
+# ==================== EVENT LOOP ====================
+
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "event_loop_lag_seconds", "Опоздание тика монитора event loop", buckets=FAST_BUCKETS
+)
+EVENT_LOOP_STALLS = Counter("event_loop_stalls_total", "Блокировки event loop дольше порога")
+
+# ==================== ФОНОВЫЕ ЗАДАЧИ ====================
+
+JOB_LAST_DURATION_SECONDS = Gauge(
+    "background_job_last_duration_seconds", "Длительность последнего запуска фоновой задачи", ["job"]
+)
+JOB_LEADER = Gauge("background_job_leader", "1 — задача закреплена за этим инстансом", ["job"])
+JOB_ERRORS = Counter("background_job_errors_total", "Ошибки фоновых задач", ["job"])
+
+def observe_db(func):
+    """Декоратор для методов Database: время, ошибки и спан по имени метода"""
+    # labels() разрешаем один раз при декорировании, а не на каждом вызове
+    seconds = DB_METHOD_SECONDS.labels(method=func.__name__)
+    errors = DB_METHOD_ERRORS.labels(method=func.__name__)
+    span_name = f"db.{func.__name__}"
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            with span(span_name):
+                return await func(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            seconds.observe(time.perf_counter() - start)
+
+    return wrapper
+
+class AdmissionCollector:
+    """Состояние очередей допуска считывается только в момент scrape"""
+
+    def collect(self):
+        active = GaugeMetricFamily("admission_active", "Выполняющиеся потоки", labels=["flow"])
+        queued = GaugeMetricFamily("admission_queued", "Потоки в очереди", labels=["flow"])
+        rejected = CounterMetricFamily("admission_rejected_total", "Отклонённые запросы", labels=["flow"])
+        for flow, stats in admission.snapshot().items():
+            active.add_metric([flow], stats["active"])
+            queued.add_metric([flow], stats["queued"])
+            rejected.add_metric([flow], stats["rejected"])
+        yield active
+        yield queued
+        yield rejected
+
+REGISTRY.register(AdmissionCollector())
+
+def render_metrics() -> bytes:
+    return generate_latest(REGISTRY)
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
@@ -0,0 +1,131 @@
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message, TelegramObject, Update
+from sender import api_call_stats
+from metrics import HANDLER_SECONDS, BOT_API_CALLS_PER_ACTION
+from tracing import tracer
+from state_manager import state_manager
+
+logger = logging.getLogger(__name__)
+
+# Callback'и с параметром после префикса: "cat_soup" -> "cat", "dish_3" -> "dish"
+DYNAMIC_CALLBACK_PREFIXES = ("cat_", "dish_", "hist_", "recipe_", "pantry_")
+# Метки метрик — из закрытого набора: текст команд и callback_data присылает пользователь,
+# и каждое новое значение иначе стало бы новой серией
+KNOWN_CALLBACKS = frozenset({
+    "restart", "clear_my_history", "action_add_more", "action_cook",
+    "back_to_categories", "repeat_recipe", "delete_msg",
+})
+KNOWN_COMMANDS = frozenset({"/start", "/author", "/stats", "/quick"})
+
+def callback_prefix(data: str) -> str:
+    """Нормализует callback_data до имени действия без параметров"""
+    if not data:
+        return "unknown"
+    for prefix in DYNAMIC_CALLBACK_PREFIXES:
+        if data.startswith(prefix):
+            return prefix[:-1]
+    return data if data in KNOWN_CALLBACKS else "other"
+
+def action_label(update: Update) -> str:
+    """Имя действия пользователя для метрик: команда, тип сообщения или callback"""
+    if update.message:
+        message = update.message
+        if message.voice:
+            return "voice"
+        if message.text:
+            if message.text.startswith('/'):
+                command = message.text.split()[0].split('@')[0].lower()
+                return command if command in KNOWN_COMMANDS else "command"
+            return "text"
+        return "message"
+    if update.callback_query:
+        return f"cb:{callback_prefix(update.callback_query.data)}"
+    return update.event_type
+
+class ActionMetricsMiddleware(BaseMiddleware):
+    """Время обработки апдейта и число вызовов Bot API на действие пользователя"""
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        counter = api_call_stats.start_action()
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            action = action_label(event)
+            HANDLER_SECONDS.labels(action).observe(time.perf_counter() - start)
+            BOT_API_CALLS_PER_ACTION.labels(action).observe(counter[0])
+            api_call_stats.record(action, counter[0])
+            logger.debug(f"📨 {action}: {counter[0]} вызовов Bot API")
+
+class InputDebounceFlushMiddleware(BaseMiddleware):
+    """Перед любым событием, кроме ввода продуктов, применяет накопленный ввод.
+
+    Текст без "/" и голосовые решают сами (хэндлер либо копит продукты,
+    либо сбрасывает буфер перед запросом рецепта).
+    """
+
+    def __init__(self, debouncer):
+        self.debouncer = debouncer
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        is_products_candidate = isinstance(event, Message) and (
+            event.voice or (event.text and not event.text.startswith('/'))
+        )
+        user = data.get("event_from_user")
+        if user and not is_products_candidate:
+            await self.debouncer.flush(user.id)
+        return await handler(event, data)
+
+class SessionAffinityMiddleware(BaseMiddleware):
+    """Сессия пользователя поднимается из БД при первом апдейте в процессе.
+
+    После перезапуска или переезда пользователя на другой воркер (shard_moved
+    от диспетчера кластера) кеш пуст или устарел — перечитываем его.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user:
+            await state_manager.ensure_session(user.id, reload=data.get("shard_moved", False))
+        return await handler(event, data)
+
+class TracingMiddleware(BaseMiddleware):
+    """Открывает трейс на каждый апдейт; спаны Groq/БД/голоса/Bot API вкладываются в него"""
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        if not tracer.enabled:
+            return await handler(event, data)
+        user = data.get("event_from_user")
+        action = action_label(event)
+        with tracer.trace(f"update {action}", action=action, update_id=event.update_id,
+                          user_id=user.id if user else 0):
+            return await handler(event, data)
+
+def register_middlewares(dp):
+    dp.update.outer_middleware(ActionMetricsMiddleware())
+    dp.update.outer_middleware(TracingMiddleware())
+    dp.update.outer_middleware(SessionAffinityMiddleware())
@@ -0,0 +1,40 @@
+-- Базовая схема бота (users, sessions, recipes).
+-- Выполняется один раз в SQL-редакторе Supabase или через `python loadtest.py --init-schema`
+-- для локального Postgres. Скрипт идемпотентен.
+
+CREATE TABLE IF NOT EXISTS users (
+    id BIGINT PRIMARY KEY,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    language TEXT DEFAULT 'ru',
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    last_active TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS sessions (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    products TEXT,
+    state TEXT,
+    categories JSONB DEFAULT '[]'::jsonb,
+    generated_dishes JSONB DEFAULT '[]'::jsonb,
+    current_dish TEXT,
+    history JSONB DEFAULT '[]'::jsonb,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS sessions_user_id_key ON sessions (user_id);
+CREATE INDEX IF NOT EXISTS sessions_updated_at_idx ON sessions (updated_at);
+
+CREATE TABLE IF NOT EXISTS recipes (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    dish_name TEXT NOT NULL,
+    recipe_text TEXT NOT NULL,
+    products_used TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS recipes_user_created_idx ON recipes (user_id, created_at DESC);
@@ -0,0 +1,22 @@
+-- Фоновые задачи (session cleanup, stats refresh) и снимок статистики.
+-- Задача выполняется только на инстансе, взявшем её advisory lock;
+-- job_runs хранит время последнего запуска, чтобы новый лидер не запускал её раньше срока.
+-- Скрипт идемпотентен.
+
+CREATE TABLE IF NOT EXISTS job_runs (
+    name TEXT PRIMARY KEY,
+    last_started TIMESTAMPTZ,
+    last_finished TIMESTAMPTZ,
+    last_duration_ms DOUBLE PRECISION,
+    last_error TEXT,
+    instance TEXT
+);
+
+-- Одна строка (id = 1): счётчики для /stats без COUNT(*) на каждый запрос
+CREATE TABLE IF NOT EXISTS bot_stats (
+    id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    users BIGINT NOT NULL DEFAULT 0,
+    active_sessions BIGINT NOT NULL DEFAULT 0,
+    saved_recipes BIGINT NOT NULL DEFAULT 0,
+    refreshed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
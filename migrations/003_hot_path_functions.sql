@@ -0,0 +1,58 @@
+-- Серверные функции для горячих путей (upsert и чтение сессии, сохранение рецепта).
+-- Нужны при подключении через transaction pooler (Supabase, порт 6543): там
+-- prepared statements клиента не переживают транзакцию, и каждый запрос
+-- заново разбирается и планируется. План запроса внутри plpgsql-функции
+-- кешируется на серверном соединении, то есть строится один раз.
+-- Скрипт идемпотентен.
+
+CREATE OR REPLACE FUNCTION bot_upsert_session(
+    p_user_id BIGINT,
+    p_products TEXT,
+    p_state TEXT,
+    p_categories JSONB,
+    p_generated_dishes JSONB,
+    p_current_dish TEXT,
+    p_history JSONB
+) RETURNS SETOF sessions
+LANGUAGE plpgsql AS $$
+BEGIN
+    -- NULL в параметре — поле не меняется (как в Database.create_or_update_session)
+    RETURN QUERY
+    INSERT INTO sessions AS s (user_id, products, state, categories, generated_dishes, current_dish, history)
+    VALUES (p_user_id, p_products, p_state, p_categories, p_generated_dishes, p_current_dish, p_history)
+    ON CONFLICT (user_id) DO UPDATE SET
+        products = COALESCE(EXCLUDED.products, s.products),
+        state = COALESCE(EXCLUDED.state, s.state),
+        categories = COALESCE(EXCLUDED.categories, s.categories),
+        generated_dishes = COALESCE(EXCLUDED.generated_dishes, s.generated_dishes),
+        current_dish = COALESCE(EXCLUDED.current_dish, s.current_dish),
+        history = COALESCE(EXCLUDED.history, s.history),
+        updated_at = NOW()
+    RETURNING s.*;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION bot_get_session(p_user_id BIGINT) RETURNS SETOF sessions
+LANGUAGE plpgsql STABLE AS $$
+BEGIN
+    RETURN QUERY
+    SELECT * FROM sessions WHERE user_id = p_user_id ORDER BY updated_at DESC LIMIT 1;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION bot_save_recipe(
+    p_user_id BIGINT,
+    p_dish_name TEXT,
+    p_recipe_text TEXT,
+    p_products_used TEXT
+) RETURNS BIGINT
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_id BIGINT;
+BEGIN
+    INSERT INTO recipes (user_id, dish_name, recipe_text, products_used)
+    VALUES (p_user_id, p_dish_name, p_recipe_text, p_products_used)
+    RETURNING id INTO v_id;
+    RETURN v_id;
+END;
+$$;
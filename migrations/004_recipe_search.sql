@@ -0,0 +1,31 @@
+-- Полнотекстовый поиск по сохранённым рецептам (русская и английская конфигурации).
+-- Название блюда весит больше текста рецепта (A против D), поэтому совпадение
+-- по названию всегда выше совпадения где-то в тексте. Вектор заполняет триггер,
+-- старые строки заполняются здесь же. Скрипт идемпотентен.
+
+ALTER TABLE recipes ADD COLUMN IF NOT EXISTS search_vector TSVECTOR;
+
+CREATE OR REPLACE FUNCTION recipe_search_vector(p_dish_name TEXT, p_recipe_text TEXT) RETURNS TSVECTOR
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT setweight(to_tsvector('russian', coalesce(p_dish_name, '')), 'A')
+        || setweight(to_tsvector('english', coalesce(p_dish_name, '')), 'A')
+        || setweight(to_tsvector('russian', coalesce(p_recipe_text, '')), 'D')
+        || setweight(to_tsvector('english', coalesce(p_recipe_text, '')), 'D')
+$$;
+
+CREATE OR REPLACE FUNCTION recipes_search_vector_trigger() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.search_vector := recipe_search_vector(NEW.dish_name, NEW.recipe_text);
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS recipes_search_vector ON recipes;
+CREATE TRIGGER recipes_search_vector
+    BEFORE INSERT OR UPDATE OF dish_name, recipe_text ON recipes
+    FOR EACH ROW EXECUTE FUNCTION recipes_search_vector_trigger();
+
+UPDATE recipes SET search_vector = recipe_search_vector(dish_name, recipe_text) WHERE search_vector IS NULL;
+
+CREATE INDEX IF NOT EXISTS recipes_search_idx ON recipes USING GIN (search_vector);
@@ -0,0 +1,82 @@
+-- Тела рецептов с адресацией по содержимому: одинаковый (после нормализации)
+-- текст хранится один раз. Ключ — sha256 нормализованного текста, body —
+-- текст, сжатый кодеком codec ('none' — не сжат: так пишут функция
+-- bot_save_recipe и бэкфилл ниже; фоновая задача recipe_bodies_compact
+-- сжимает такие тела). Нормализация совпадает с recipe_bodies.normalize_recipe.
+-- Скрипт идемпотентен.
+
+CREATE TABLE IF NOT EXISTS recipe_bodies (
+    hash BYTEA PRIMARY KEY,
+    body BYTEA NOT NULL,
+    codec TEXT NOT NULL DEFAULT 'none',
+    raw_size INTEGER NOT NULL,
+    stored_size INTEGER NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS recipe_bodies_uncompressed_idx ON recipe_bodies (created_at) WHERE codec = 'none';
+
+ALTER TABLE recipes ADD COLUMN IF NOT EXISTS body_hash BYTEA REFERENCES recipe_bodies (hash);
+ALTER TABLE recipes ALTER COLUMN recipe_text DROP NOT NULL;
+CREATE INDEX IF NOT EXISTS recipes_body_hash_idx ON recipes (body_hash);
+
+CREATE OR REPLACE FUNCTION recipe_normalize(p_text TEXT) RETURNS TEXT
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT regexp_replace(
+        regexp_replace(btrim(replace(p_text, E'\r\n', E'\n'), E' \t\r\n'), E'[ \t]+\n', E'\n', 'g'),
+        E'\n{3,}', E'\n\n', 'g'
+    )
+$$;
+
+-- Текст рецепта теперь в recipe_bodies: вектор поиска передаётся при вставке,
+-- триггер считает его, только если текст всё же пишут в recipes
+CREATE OR REPLACE FUNCTION recipes_search_vector_trigger() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF NEW.recipe_text IS NOT NULL THEN
+        NEW.search_vector := recipe_search_vector(NEW.dish_name, NEW.recipe_text);
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+-- Горячий путь для transaction pooler (см. 003): та же сигнатура, тело — в recipe_bodies
+CREATE OR REPLACE FUNCTION bot_save_recipe(
+    p_user_id BIGINT,
+    p_dish_name TEXT,
+    p_recipe_text TEXT,
+    p_products_used TEXT
+) RETURNS BIGINT
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_text TEXT := recipe_normalize(p_recipe_text);
+    v_raw BYTEA := convert_to(v_text, 'UTF8');
+    v_hash BYTEA := sha256(v_raw);
+    v_id BIGINT;
+BEGIN
+    INSERT INTO recipe_bodies (hash, body, codec, raw_size, stored_size)
+    VALUES (v_hash, v_raw, 'none', length(v_raw), length(v_raw))
+    ON CONFLICT (hash) DO NOTHING;
+
+    INSERT INTO recipes (user_id, dish_name, products_used, body_hash, search_vector)
+    VALUES (p_user_id, p_dish_name, p_products_used, v_hash, recipe_search_vector(p_dish_name, v_text))
+    RETURNING id INTO v_id;
+    RETURN v_id;
+END;
+$$;
+
+-- Бэкфилл: тела существующих рецептов переезжают в recipe_bodies
+INSERT INTO recipe_bodies (hash, body, codec, raw_size, stored_size)
+SELECT DISTINCT ON (hash) hash, raw, 'none', length(raw), length(raw)
+FROM (
+    SELECT sha256(convert_to(recipe_normalize(recipe_text), 'UTF8')) AS hash,
+           convert_to(recipe_normalize(recipe_text), 'UTF8') AS raw
+    FROM recipes
+    WHERE body_hash IS NULL AND recipe_text IS NOT NULL
+) bodies
+ON CONFLICT (hash) DO NOTHING;
+
+UPDATE recipes
+SET body_hash = sha256(convert_to(recipe_normalize(recipe_text), 'UTF8')),
+    recipe_text = NULL
+WHERE body_hash IS NULL AND recipe_text IS NOT NULL;
@@ -0,0 +1,6 @@
+-- Keyset-пагинация истории рецептов: (created_at, id) < курсор по индексу
+-- в том же порядке, без OFFSET. Заменяет индекс (user_id, created_at DESC).
+-- Скрипт идемпотентен.
+
+CREATE INDEX IF NOT EXISTS recipes_user_keyset_idx ON recipes (user_id, created_at DESC, id DESC);
+DROP INDEX IF EXISTS recipes_user_created_idx;
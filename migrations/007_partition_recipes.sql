@@ -0,0 +1,119 @@
+-- recipes секционируется по месяцам created_at. Секции создаются заранее
+-- (recipes_ensure_partitions), старые удаляются целиком
+-- (recipes_drop_partitions) — без DELETE и раздувания таблицы. Обе функции
+-- вызывает фоновая задача recipe_partitions. Секция по умолчанию ловит строки
+-- вне созданных диапазонов, чтобы вставка не падала.
+-- PK секционированной таблицы обязан включать ключ секционирования: (id, created_at).
+-- Нужен PostgreSQL 13+ (BEFORE-триггер на секционированной таблице).
+-- Скрипт идемпотентен.
+
+CREATE OR REPLACE FUNCTION recipes_partition_name(p_month DATE) RETURNS TEXT
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT 'recipes_y' || to_char(p_month, 'YYYY') || 'm' || to_char(p_month, 'MM')
+$$;
+
+-- Месячные секции с месяца p_from по текущий + p_ahead; возвращает число созданных
+CREATE OR REPLACE FUNCTION recipes_ensure_partitions(p_from DATE, p_ahead INTEGER) RETURNS INTEGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_month DATE := date_trunc('month', p_from)::date;
+    v_last DATE := (date_trunc('month', NOW() AT TIME ZONE 'UTC') + make_interval(months => p_ahead))::date;
+    v_name TEXT;
+    v_created INTEGER := 0;
+BEGIN
+    WHILE v_month <= v_last LOOP
+        v_name := recipes_partition_name(v_month);
+        IF to_regclass(v_name) IS NULL THEN
+            BEGIN
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF recipes FOR VALUES FROM (%L) TO (%L)',
+                    v_name,
+                    v_month::timestamp AT TIME ZONE 'UTC',
+                    (v_month + INTERVAL '1 month')::timestamp AT TIME ZONE 'UTC'
+                );
+                v_created := v_created + 1;
+            EXCEPTION WHEN check_violation THEN
+                -- В секции по умолчанию уже есть строки этого месяца
+                RAISE WARNING 'секция % не создана: строки этого месяца лежат в recipes_default', v_name;
+            END;
+        END IF;
+        v_month := (v_month + INTERVAL '1 month')::date;
+    END LOOP;
+    RETURN v_created;
+END;
+$$;
+
+-- Удаляет секции, целиком старше p_keep_months месяцев; возвращает их имена
+CREATE OR REPLACE FUNCTION recipes_drop_partitions(p_keep_months INTEGER) RETURNS SETOF TEXT
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_cutoff DATE := (date_trunc('month', NOW() AT TIME ZONE 'UTC') - make_interval(months => p_keep_months))::date;
+    v_name TEXT;
+BEGIN
+    FOR v_name IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'recipes'::regclass
+          AND c.relname ~ '^recipes_y[0-9]{4}m[0-9]{2}$'
+          AND to_date(substr(c.relname, 10), 'YYYY"m"MM') < v_cutoff
+        ORDER BY c.relname
+    LOOP
+        EXECUTE format('ALTER TABLE recipes DETACH PARTITION %I', v_name);
+        EXECUTE format('DROP TABLE %I', v_name);
+        RETURN NEXT v_name;
+    END LOOP;
+END;
+$$;
+
+DO $$
+DECLARE
+    v_index RECORD;
+    v_oldest DATE;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'recipes'::regclass) THEN
+        RETURN;
+    END IF;
+
+    -- Старая таблица уступает имена; последовательность id переходит к новой
+    ALTER TABLE recipes RENAME TO recipes_unpartitioned;
+    FOR v_index IN SELECT indexname FROM pg_indexes WHERE tablename = 'recipes_unpartitioned' LOOP
+        EXECUTE format('ALTER INDEX %I RENAME TO %I', v_index.indexname, 'old_' || v_index.indexname);
+    END LOOP;
+    ALTER SEQUENCE recipes_id_seq OWNED BY NONE;
+
+    CREATE TABLE recipes (
+        id BIGINT NOT NULL DEFAULT nextval('recipes_id_seq'),
+        user_id BIGINT NOT NULL,
+        dish_name TEXT NOT NULL,
+        recipe_text TEXT,
+        products_used TEXT,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        search_vector TSVECTOR,
+        body_hash BYTEA REFERENCES recipe_bodies (hash),
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at);
+    ALTER SEQUENCE recipes_id_seq OWNED BY recipes.id;
+
+    CREATE TABLE recipes_default PARTITION OF recipes DEFAULT;
+
+    SELECT COALESCE(MIN(created_at) AT TIME ZONE 'UTC', NOW() AT TIME ZONE 'UTC')::date
+    INTO v_oldest FROM recipes_unpartitioned;
+    PERFORM recipes_ensure_partitions(v_oldest, 3);
+
+    INSERT INTO recipes (id, user_id, dish_name, recipe_text, products_used, created_at, search_vector, body_hash)
+    SELECT id, user_id, dish_name, recipe_text, products_used, created_at, search_vector, body_hash
+    FROM recipes_unpartitioned;
+
+    DROP TABLE recipes_unpartitioned;
+END;
+$$;
+
+CREATE INDEX IF NOT EXISTS recipes_user_keyset_idx ON recipes (user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS recipes_search_idx ON recipes USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS recipes_body_hash_idx ON recipes (body_hash);
+
+DROP TRIGGER IF EXISTS recipes_search_vector ON recipes;
+CREATE TRIGGER recipes_search_vector
+    BEFORE INSERT OR UPDATE OF dish_name, recipe_text ON recipes
+    FOR EACH ROW EXECUTE FUNCTION recipes_search_vector_trigger();
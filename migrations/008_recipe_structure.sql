@@ -0,0 +1,22 @@
+-- Структура рецепта (recipe_parser.parse_recipe): полный разбор в jsonb и
+-- поля для запросов — в типизированных колонках тела. Структура — функция
+-- текста, поэтому живёт в recipe_bodies рядом с ним, один раз на одинаковый
+-- рецепт. Бот разбирает текст при сохранении; тела без структуры (бэкфилл,
+-- функция bot_save_recipe) разбирает фоновая задача recipe_bodies_parse.
+-- Скрипт идемпотентен.
+
+ALTER TABLE recipe_bodies
+    ADD COLUMN IF NOT EXISTS structure JSONB,
+    ADD COLUMN IF NOT EXISTS ingredients TEXT[],
+    ADD COLUMN IF NOT EXISTS cook_minutes SMALLINT,
+    ADD COLUMN IF NOT EXISTS servings SMALLINT,
+    ADD COLUMN IF NOT EXISTS difficulty TEXT,
+    ADD COLUMN IF NOT EXISTS kcal REAL;
+
+-- «Быстрые рецепты до N минут»: диапазон и сортировка по индексу
+CREATE INDEX IF NOT EXISTS recipe_bodies_cook_minutes_idx ON recipe_bodies (cook_minutes)
+    WHERE cook_minutes IS NOT NULL;
+
+-- Очередь задачи recipe_bodies_parse
+CREATE INDEX IF NOT EXISTS recipe_bodies_unparsed_idx ON recipe_bodies (created_at)
+    WHERE structure IS NULL;
@@ -0,0 +1,8 @@
+-- Первая версия recipe_parser брала имя ингредиента из скобок и в русских
+-- рецептах («Сахар (по желанию)») писала уточнение вместо продукта.
+-- Структуры без версии снова ставятся в очередь задачи recipe_bodies_parse.
+-- Скрипт идемпотентен.
+
+UPDATE recipe_bodies
+SET structure = NULL
+WHERE structure IS NOT NULL AND structure->>'version' IS NULL;
@@ -0,0 +1,282 @@
+"""Подбор сохранённых рецептов по продуктам пользователя.
+
+Обратный индекс в памяти: каноническое имя ингредиента (recipe_parser) ->
+битовая карта рецептов (Python int, бит = порядковый номер тела рецепта).
+Для набора продуктов число совпавших ингредиентов каждого рецепта
+считается сразу по всем рецептам — побитовым сложением карт в «срезы»
+счётчика; рецепты, у которых совпали все ингредиенты или их доля не ниже
+PANTRY_MIN_COVERAGE, находятся сравнением срезов с картами «рецепты из
+N ингредиентов». Это миллисекунды даже на сотнях тысяч рецептов.
+
+Индекс пополняется при сохранении рецепта и раз в
+PANTRY_INDEX_REFRESH_SECONDS перечитывается из recipe_bodies
+(migrations/008) — так в него попадают рецепты с других инстансов.
+"""
+import asyncio
+import base64
+import logging
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from config import PANTRY_SUGGESTIONS, PANTRY_MIN_COVERAGE, PANTRY_INDEX_REFRESH_SECONDS
+from database import db
+from metrics import PANTRY_LOOKUPS, PANTRY_INDEX_RECIPES
+import recipe_bodies
+import recipe_parser
+
+logger = logging.getLogger(__name__)
+
+# Callback открытия подсказки: хеш тела в base64url (43 символа, лимит Telegram — 64 байта)
+CALLBACK_PREFIX = "pantry_"
+
+# Рецепты из одного ингредиента (или неразобранные) не подсказываем
+MIN_INGREDIENTS = 2
+
+# Есть почти на любой кухне, в списке продуктов их не пишут
+STAPLES = ("соль", "вода", "черный перец", "молотый перец", "сахар", "растительное масло", "подсолнечное масло")
+
+_WORD = re.compile(r"[a-zа-я]+")
+_ENDINGS = "аяыиоеьйуюэ"
+_PANTRY_SPLIT = re.compile(r"[,;\n]|\s+и\s+")
+
+class PantryMatch(NamedTuple):
+    dish_name: str
+    body_hash: bytes
+    missing: List[str]      # ингредиенты рецепта, которых нет у пользователя
+    coverage: float
+
+def _stem(word: str) -> str:
+    """Грубая основа слова: «яйца»/«яйцо» -> «яйц», «помидоры» -> «помидор», «огурец» -> «огурц»"""
+    for _ in range(2):
+        if len(word) > 3 and word[-1] in _ENDINGS:
+            word = word[:-1]
+    if word.endswith("ец"):
+        word = word[:-2] + "ц"  # беглая гласная: огурец / огурцы
+    return word
+
+def _words(name: str) -> Set[str]:
+    return {_stem(word) for word in _WORD.findall(name.lower().replace("ё", "е")) if len(word) >= 3}
+
+def _bitmap(ordinals: Iterable[int], size: int) -> int:
+    bits = bytearray(size // 8 + 1)
+    for ordinal in ordinals:
+        bits[ordinal >> 3] |= 1 << (ordinal & 7)
+    return int.from_bytes(bits, "little")
+
+def encode_callback(body_hash: bytes) -> str:
+    return CALLBACK_PREFIX + base64.urlsafe_b64encode(body_hash).rstrip(b"=").decode()
+
+def parse_callback(data: str) -> Optional[bytes]:
+    value = data[len(CALLBACK_PREFIX):]
+    try:
+        return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+    except ValueError:
+        return None
+
+class _Postings:
+    """Снимок индекса: слоты рецептов и битовые карты"""
+
+    def __init__(self):
+        self.slots: List[Tuple[bytes, str, Tuple[str, ...]]] = []  # (хеш тела, блюдо, ингредиенты)
+        self.by_hash: Dict[bytes, int] = {}
+        self.postings: Dict[str, int] = {}      # ингредиент -> рецепты с ним
+        self.sizes: Dict[int, int] = {}         # число ингредиентов -> рецепты
+        self.words: Dict[str, Set[str]] = {}    # основа слова -> ингредиенты с ней
+        self.keys: Set[str] = set()
+
+    @classmethod
+    def build(cls, rows: List[Dict]) -> "_Postings":
+        """Массовая загрузка: номера копятся списками, карты собираются один раз"""
+        index = cls()
+        postings: Dict[str, List[int]] = {}
+        sizes: Dict[int, List[int]] = {}
+        for row in rows:
+            ordinal = index._slot(row["hash"], row["dish_name"], row["ingredients"])
+            if ordinal is None:
+                continue
+            keys = index.slots[ordinal][2]
+            for key in keys:
+                postings.setdefault(key, []).append(ordinal)
+            sizes.setdefault(len(keys), []).append(ordinal)
+        total = len(index.slots)
+        index.postings = {key: _bitmap(ordinals, total) for key, ordinals in postings.items()}
+        index.sizes = {size: _bitmap(ordinals, total) for size, ordinals in sizes.items()}
+        return index
+
+    def _slot(self, body_hash: bytes, dish_name: str, ingredients: Iterable[str]) -> Optional[int]:
+        keys = tuple(dict.fromkeys(key for key in ingredients if key))
+        if body_hash in self.by_hash or len(keys) < MIN_INGREDIENTS:
+            return None
+        ordinal = len(self.slots)
+        self.slots.append((body_hash, dish_name, keys))
+        self.by_hash[body_hash] = ordinal
+        for key in keys:
+            if key not in self.keys:
+                self.keys.add(key)
+                for word in _words(key):
+                    self.words.setdefault(word, set()).add(key)
+        return ordinal
+
+    def add(self, body_hash: bytes, dish_name: str, ingredients: Iterable[str]) -> bool:
+        ordinal = self._slot(body_hash, dish_name, ingredients)
+        if ordinal is None:
+            return False
+        bit = 1 << ordinal
+        keys = self.slots[ordinal][2]
+        for key in keys:
+            self.postings[key] = self.postings.get(key, 0) | bit
+        self.sizes[len(keys)] = self.sizes.get(len(keys), 0) | bit
+        return True
+
+    def resolve(self, items: Iterable[str]) -> Set[str]:
+        """Продукты пользователя -> ингредиенты индекса.
+
+        «сыр» подходит к «сыр твердый» (все слова продукта есть в имени
+        ингредиента); если целиком продукт не нашёлся («свежие помидоры
+        огурцы» без запятых) — слова ищутся по отдельности.
+        """
+        keys: Set[str] = set()
+        for item in items:
+            words = _words(item)
+            if not words:
+                continue
+            matched = set.intersection(*(self.words.get(word, set()) for word in words))
+            if not matched and len(words) > 1:
+                for word in words:
+                    matched |= self.words.get(word, set())
+            keys |= matched
+        return keys
+
+    def match(self, products: str, limit: int, min_coverage: float) -> List[PantryMatch]:
+        user_keys = self.resolve(_PANTRY_SPLIT.split(products))
+        # Рецепт должен использовать хотя бы один продукт пользователя, а не только соль с водой
+        used = 0
+        for key in user_keys:
+            used |= self.postings[key]
+        if not used:
+            return []
+        available = user_keys | self.resolve(STAPLES)
+
+        # Срезы счётчика: slices[i] — рецепты, у которых i-й бит числа совпадений равен 1
+        slices: List[int] = []
+        for key in available:
+            carry = self.postings[key]
+            for i, current in enumerate(slices):
+                slices[i], carry = current ^ carry, current & carry
+                if not carry:
+                    break
+            if carry:
+                slices.append(carry)
+
+        def exactly(count: int, candidates: int) -> int:
+            if count >> len(slices):
+                return 0
+            for i, bits in enumerate(slices):
+                candidates &= bits if count >> i & 1 else ~bits
+            return candidates
+
+        # by_missing[m] — рецепты, где не хватает m ингредиентов
+        by_missing: Dict[int, int] = {}
+        for size, recipes in self.sizes.items():
+            candidates = recipes & used
+            if not candidates:
+                continue
+            for missing in range(int(size * (1 - min_coverage) + 1e-9) + 1):
+                found = exactly(size - missing, candidates)
+                if found:
+                    by_missing[missing] = by_missing.get(missing, 0) | found
+
+        matches: List[PantryMatch] = []
+        seen_names: Set[str] = set()
+        for missing in sorted(by_missing):
+            bits = by_missing[missing]
+            while bits and len(matches) < limit:
+                ordinal = bits.bit_length() - 1  # сначала новые
+                bits ^= 1 << ordinal
+                body_hash, dish_name, keys = self.slots[ordinal]
+                if dish_name.lower() in seen_names:
+                    continue
+                seen_names.add(dish_name.lower())
+                absent = [key for key in keys if key not in available]
+                matches.append(PantryMatch(dish_name, body_hash, absent, 1 - len(absent) / len(keys)))
+        return matches
+
+class PantryIndex:
+    """Индекс ингредиентов сохранённых рецептов и фоновое перечитывание из БД"""
+
+    def __init__(self, refresh_interval: float = PANTRY_INDEX_REFRESH_SECONDS):
+        self.refresh_interval = refresh_interval
+        self.enabled = False
+        self._index = _Postings()
+        # Рецепты, добавленные во время перечитывания: в новый снимок их доливаем
+        self._added_during_load: Optional[List[Tuple[bytes, str, List[str]]]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._index.slots)
+
+    async def start(self):
+        """Первая загрузка и фоновое перечитывание (нужна migrations/008)"""
+        self.enabled = PANTRY_SUGGESTIONS > 0 and db.has_recipe_structure
+        if not self.enabled or self._task:
+            return
+        await self.load()
+        self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def load(self):
+        self._added_during_load = []
+        try:
+            rows = await db.get_pantry_entries(MIN_INGREDIENTS)
+            index = await asyncio.to_thread(_Postings.build, rows)
+            for entry in self._added_during_load:
+                index.add(*entry)
+            self._index = index
+        finally:
+            self._added_during_load = None
+        PANTRY_INDEX_RECIPES.set(len(self._index.slots))
+        logger.info(f"🧺 Индекс ингредиентов: {len(self._index.slots)} рецептов, {len(self._index.postings)} ингредиентов")
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.load()
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось перечитать индекс ингредиентов: {e}")
+
+    def add_recipe(self, dish_name: str, recipe_text: str):
+        """Новый сохранённый рецепт сразу попадает в индекс (ключ — хеш тела, как в recipe_bodies)"""
+        if not self.enabled:
+            return
+        normalized = recipe_bodies.normalize_recipe(recipe_text)
+        entry = (
+            recipe_bodies.body_hash(normalized),
+            dish_name,
+            recipe_parser.ingredient_names(recipe_parser.parse_recipe(normalized)),
+        )
+        if self._index.add(*entry):
+            PANTRY_INDEX_RECIPES.set(len(self._index.slots))
+        if self._added_during_load is not None:
+            self._added_during_load.append(entry)
+
+    def match(self, products: Optional[str], limit: int = PANTRY_SUGGESTIONS,
+              min_coverage: float = PANTRY_MIN_COVERAGE) -> List[PantryMatch]:
+        """Сохранённые рецепты, которые можно приготовить из products: сначала без
+        недостающих ингредиентов, затем с одним и т.д.; внутри — новые первыми"""
+        if not self.enabled or not products or limit <= 0:
+            return []
+        matches = self._index.match(products, limit, min_coverage)
+        PANTRY_LOOKUPS.labels("hit" if matches else "miss").inc()
+        return matches
+
+# Глобальный экземпляр
+pantry_index = PantryIndex()
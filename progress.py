@@ -0,0 +1,94 @@
+import logging
+from typing import Optional
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, InlineKeyboardMarkup
+
+logger = logging.getLogger(__name__)
+
+# Лимит Telegram на длину текста сообщения
+MAX_MESSAGE_LENGTH = 4096
+
+class ProgressMessage:
+    """Сообщение-заглушка ("Думаю...", "Пишу рецепт..."), которое
+    редактируется в итоговый ответ вместо схемы отправить-удалить-отправить.
+    """
+
+    def __init__(self, message: Message, text: str = "", parse_mode: Optional[str] = None):
+        self.message = message
+        self.text = text
+        self.parse_mode = parse_mode
+
+    @classmethod
+    async def send(cls, target: Message, text: str, parse_mode: Optional[str] = None) -> "ProgressMessage":
+        """Отправляет новую заглушку в чат target"""
+        return cls(await target.answer(text, parse_mode=parse_mode), text, parse_mode)
+
+    @classmethod
+    async def reuse(cls, message: Message, text: str, parse_mode: Optional[str] = None) -> "ProgressMessage":
+        """Превращает уже отправленное ботом сообщение (например, с кнопками) в заглушку"""
+        progress = cls(message)
+        if not await progress.update(text, parse_mode=parse_mode):
+            return await cls.send(message, text, parse_mode=parse_mode)
+        return progress
+
+    async def update(self, text: str, parse_mode: Optional[str] = None) -> bool:
+        """Промежуточное обновление текста заглушки (без клавиатуры)"""
+        self.text = text
+        self.parse_mode = parse_mode
+        return await self._edit(text, parse_mode)
+
+    async def show_queue_position(self, position: int):
+        """Показывает позицию в очереди над текущим текстом заглушки"""
+        await self._edit(f"⏳ Вы в очереди: {position}\n{self.text}", self.parse_mode)
+
+    async def restore(self):
+        """Возвращает текст заглушки после ожидания в очереди"""
+        await self._edit(self.text, self.parse_mode)
+
+    async def _edit(self, text: str, parse_mode: Optional[str]) -> bool:
+        try:
+            result = await self.message.edit_text(text, reply_markup=None, parse_mode=parse_mode)
+            if isinstance(result, Message):
+                self.message = result
+            return True
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                return True
+            logger.debug(f"Не удалось обновить заглушку: {e}")
+            return False
+
+    async def finish(
+        self,
+        text: str,
+        reply_markup=None,
+        parse_mode: Optional[str] = None
+    ) -> Message:
+        """Редактирует заглушку в итоговый ответ.
+
+        Если текст слишком длинный или клавиатура не inline (её нельзя
+        прикрепить через edit), отправляет новое сообщение и удаляет заглушку.
+        """
+        can_edit = len(text) <= MAX_MESSAGE_LENGTH and (
+            reply_markup is None or isinstance(reply_markup, InlineKeyboardMarkup)
+        )
+        if can_edit:
+            try:
+                result = await self.message.edit_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+                if isinstance(result, Message):
+                    self.message = result
+                return self.message
+            except TelegramBadRequest as e:
+                logger.debug(f"Редактирование заглушки не удалось, отправляем заново: {e}")
+
+        sent = await self.message.answer(text, reply_markup=reply_markup, parse_mode=parse_mode)
+        await self.discard()
+        self.message = sent
+        return sent
+
+    async def discard(self):
+        """Удаляет заглушку"""
+        try:
+            await self.message.delete()
+        except TelegramBadRequest as e:
+            logger.debug(f"Заглушка уже удалена: {e}")
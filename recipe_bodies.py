@@ -0,0 +1,77 @@
+"""Тексты рецептов с адресацией по содержимому.
+
+Популярные блюда генерируются тысячи раз почти одинаковым текстом, поэтому
+тело рецепта хранится один раз в recipe_bodies: ключ — sha256 от
+нормализованного текста, значение — сжатый текст. Строки recipes ссылаются
+на тело по хешу (migrations/005_recipe_bodies.sql).
+
+Нормализация повторяет SQL-функцию recipe_normalize: миграция считает хеши
+старых строк в БД, и они должны совпадать с хешами новых.
+"""
+import hashlib
+import re
+import zlib
+from typing import NamedTuple
+
+try:
+    import zstandard  # Сжимает лучше и быстрее zlib; без него — zlib
+except ImportError:
+    zstandard = None
+
+# Несжатое тело (так пишет функция bot_save_recipe и бэкфилл миграции);
+# фоновая задача recipe_bodies_compact потом сжимает такие тела
+CODEC_NONE = "none"
+CODEC_ZLIB = "zlib"
+CODEC_ZSTD = "zstd"
+
+ZLIB_LEVEL = 9
+ZSTD_LEVEL = 10
+
+_TRAILING_SPACES = re.compile(r"[ \t]+\n")
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+if zstandard is not None:
+    DEFAULT_CODEC = CODEC_ZSTD
+    _zstd_compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+    _zstd_decompressor = zstandard.ZstdDecompressor()
+else:
+    DEFAULT_CODEC = CODEC_ZLIB
+
+class RecipeBody(NamedTuple):
+    hash: bytes
+    text: str       # нормализованный текст
+    data: bytes     # сжатый текст
+    codec: str
+    raw_size: int
+
+def normalize_recipe(text: str) -> str:
+    """Единые переводы строк, без хвостовых пробелов и лишних пустых строк"""
+    text = text.replace("\r\n", "\n").strip(" \t\r\n")
+    text = _TRAILING_SPACES.sub("\n", text)
+    return _BLANK_LINES.sub("\n\n", text)
+
+def compress(raw: bytes, codec: str = DEFAULT_CODEC) -> bytes:
+    if codec == CODEC_ZSTD:
+        return _zstd_compressor.compress(raw)
+    if codec == CODEC_ZLIB:
+        return zlib.compress(raw, ZLIB_LEVEL)
+    return raw
+
+def decompress(data: bytes, codec: str) -> str:
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("тело рецепта сжато zstd, а пакет zstandard не установлен")
+        raw = _zstd_decompressor.decompress(data)
+    elif codec == CODEC_ZLIB:
+        raw = zlib.decompress(data)
+    else:
+        raw = data
+    return raw.decode("utf-8")
+
+def body_hash(normalized: str) -> bytes:
+    return hashlib.sha256(normalized.encode("utf-8")).digest()
+
+def make_body(text: str, codec: str = DEFAULT_CODEC) -> RecipeBody:
+    normalized = normalize_recipe(text)
+    raw = normalized.encode("utf-8")
+    return RecipeBody(hashlib.sha256(raw).digest(), normalized, compress(raw, codec), codec, len(raw))
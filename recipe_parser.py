@@ -0,0 +1,155 @@
+"""Разбор сгенерированного рецепта в структуру.
+
+Промпты требуют фиксированный макет (🔸 ингредиенты, 📊 пищевая ценность,
+⏱ время, 🪦 сложность, 👥 порции), поэтому хватает одного прохода по
+строкам: тип строки определяется по первому символу (эмодзи-маркеру), а
+если модель взяла другой эмодзи — по подписи перед двоеточием.
+
+    {"title": "Борщ",
+     "ingredients": [{"name": "свекла", "quantity": "2 шт", "amount": 2.0, "unit": "шт"}, ...],
+     "nutrition": {"protein": 6.0, "fat": 8.0, "carbs": 20.0, "kcal": 180.0},
+     "time_minutes": 90, "difficulty": "medium", "servings": 4}
+"""
+import re
+from typing import Any, Dict, List, Optional
+
+# Версия разбора, пишется в structure: migrations/009 ставит структуры без неё на повторный разбор
+PARSER_VERSION = 2
+
+_TAGS = re.compile(r"<[^>]+>")
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)?")
+_HOURS = re.compile(r"(\d+(?:[.,]\d+)?)\s*(?:ч|h)", re.IGNORECASE)
+_MINUTES = re.compile(r"(\d+)\s*(?:мин|m)", re.IGNORECASE)
+_QUANTITY_SPLIT = re.compile(r"\s+[-–—]\s+|\s*:\s+")
+_PARENS = re.compile(r"\s*\(([^)]*)\)")
+_SPACES = re.compile(r"\s+")
+_CYRILLIC = re.compile(r"[а-яё]", re.IGNORECASE)
+_LABEL = re.compile(
+    r"^\W*(?P<label>время|сложность|порци[иья]|белки|жиры|углеводы|энерг[^:]*|калорийность|"
+    r"time|difficulty|servings|protein|fat|carbs|calories)\s*:\s*(?P<value>.*)$",
+    re.IGNORECASE,
+)
+
+# Первый символ строки -> поле
+_MARKERS = {
+    "🍽": "title", "🔸": "ingredient",
+    "🥚": "protein", "🥑": "fat", "🌾": "carbs", "⚡": "kcal",
+    "⏱": "time", "🪦": "difficulty", "👥": "servings",
+}
+_LABELS = {
+    "время": "time", "time": "time",
+    "сложность": "difficulty", "difficulty": "difficulty",
+    "порции": "servings", "порций": "servings", "порция": "servings", "servings": "servings",
+    "белки": "protein", "protein": "protein",
+    "жиры": "fat", "fat": "fat",
+    "углеводы": "carbs", "carbs": "carbs",
+    "калорийность": "kcal", "calories": "kcal",
+}
+_DIFFICULTY = (
+    ("easy", ("лег", "прост", "easy", "низк")),
+    ("hard", ("слож", "высок", "hard", "difficult")),
+    ("medium", ("сред", "medium", "умерен")),
+)
+
+def _number(text: str) -> Optional[float]:
+    match = _NUMBER.search(text)
+    return float(match.group().replace(",", ".")) if match else None
+
+def parse_minutes(text: str) -> Optional[int]:
+    """«90 минут», «1 час 30 минут», «1,5 часа», «45 min» -> минуты"""
+    hours = _HOURS.search(text)
+    minutes = _MINUTES.search(text)
+    if not hours and not minutes:
+        value = _number(text)
+        return int(value) if value is not None else None
+    total = float(hours.group(1).replace(",", ".")) * 60 if hours else 0.0
+    if minutes:
+        total += int(minutes.group(1))
+    return int(round(total))
+
+def parse_difficulty(text: str) -> Optional[str]:
+    lowered = text.lower()
+    for level, stems in _DIFFICULTY:
+        if any(stem in lowered for stem in stems):
+            return level
+    return None
+
+def canonical_ingredient(name: str) -> str:
+    """Каноническое имя ингредиента: нижний регистр, ё -> е, без скобок.
+
+    Скобки — перевод только у нерусских рецептов («Eggs (Яйца)»): тогда
+    берётся перевод. В русских рецептах в скобках уточнения («Сахар (по
+    желанию)», «Масло (сливочное)»), и имя остаётся внешним.
+    """
+    translation = _PARENS.search(name)
+    outer = _PARENS.sub("", name)
+    if translation and translation.group(1).strip() and not _CYRILLIC.search(outer):
+        name = translation.group(1)
+    else:
+        name = outer
+    return _SPACES.sub(" ", name).strip(" .,;").lower().replace("ё", "е")
+
+def _ingredient(text: str) -> Optional[Dict[str, Any]]:
+    parts = _QUANTITY_SPLIT.split(text, maxsplit=1)
+    name = canonical_ingredient(parts[0])
+    if not name:
+        return None
+    quantity = parts[1].strip() if len(parts) > 1 else ""
+    amount = _number(quantity)
+    unit = _NUMBER.sub("", quantity, count=1).strip() if amount is not None else quantity
+    return {"name": name, "quantity": quantity, "amount": amount, "unit": unit}
+
+def parse_recipe(text: str) -> Dict[str, Any]:
+    """Один проход по строкам рецепта; поля, которых нет в тексте, — None"""
+    title = None
+    ingredients: List[Dict[str, Any]] = []
+    nutrition: Dict[str, Optional[float]] = {"protein": None, "fat": None, "carbs": None, "kcal": None}
+    time_minutes = difficulty = servings = None
+
+    for raw_line in _TAGS.sub("", text).splitlines():
+        line = raw_line.strip()
+        if not line:
+            continue
+        field = _MARKERS.get(line[0])
+        value = line[1:].lstrip("️ ").strip()
+        if field is None or field not in ("title", "ingredient"):
+            labelled = _LABEL.match(line)
+            if labelled:
+                label = labelled.group("label").lower()
+                field = _LABELS.get(label, "kcal" if label.startswith("энерг") else None)
+                value = labelled.group("value")
+            elif field is not None and ":" in value:
+                value = value.split(":", 1)[1]
+        if field is None:
+            continue
+
+        if field == "ingredient":
+            item = _ingredient(value)
+            if item:
+                ingredients.append(item)
+        elif field == "title":
+            if title is None:
+                title = value
+        elif field in nutrition:
+            nutrition[field] = _number(value)
+        elif field == "time":
+            time_minutes = parse_minutes(value)
+        elif field == "difficulty":
+            difficulty = parse_difficulty(value)
+        elif field == "servings":
+            count = _number(value)
+            servings = int(count) if count is not None else None
+
+    return {
+        "version": PARSER_VERSION,
+        "title": title,
+        "ingredients": ingredients,
+        "nutrition": nutrition,
+        "time_minutes": time_minutes,
+        "difficulty": difficulty,
+        "servings": servings,
+    }
+
+def ingredient_names(structure: Dict[str, Any]) -> List[str]:
+    """Уникальные канонические имена ингредиентов в порядке рецепта"""
+    return list(dict.fromkeys(item["name"] for item in structure["ingredients"]))
@@ -0,0 +1,300 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Set, Tuple
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from metrics import BOT_API_REQUEST_SECONDS, BOT_API_QUEUE_WAIT_SECONDS, BOT_API_ERRORS
+from tracing import span
+from config import TG_GLOBAL_RATE, TG_CHAT_RATE, TG_CHAT_BURST, TG_GROUP_RATE, TG_MAX_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# --- ПРИОРИТЕТЫ ---
+PRIORITY_HIGH = 0     # ответы пользователю
+PRIORITY_NORMAL = 1   # всё остальное
+PRIORITY_LOW = 2      # служебные удаления и настройка бота
+
+HIGH_PRIORITY_METHODS = {
+    "sendMessage", "editMessageText", "editMessageReplyMarkup",
+    "answerCallbackQuery", "sendPhoto", "sendChatAction",
+}
+LOW_PRIORITY_METHODS = {
+    "deleteMessage", "deleteMessages", "setMyCommands",
+}
+# Не проходят через лимиты: long polling и управление вебхуком
+UNTHROTTLED_METHODS = {
+    "getUpdates", "getMe", "setWebhook", "deleteWebhook", "getWebhookInfo", "close", "logOut",
+}
+
+MAX_CHAT_BUCKETS = 10000
+
+# Счётчик вызовов Bot API в рамках текущего действия пользователя (апдейта)
+_action_api_calls: ContextVar[Optional[List[int]]] = ContextVar("action_api_calls", default=None)
+
+class BotApiCallStats:
+    """Сколько вызовов Bot API приходится на одно действие пользователя.
+
+    Действия приходят из закрытого набора middlewares.action_label; на случай
+    нового источника меток число ключей ограничено, остальное идёт в "other".
+    """
+
+    MAX_ACTIONS = 100
+
+    def __init__(self):
+        self._stats: Dict[str, List[int]] = {}
+
+    def start_action(self) -> List[int]:
+        counter = [0]
+        _action_api_calls.set(counter)
+        return counter
+
+    @staticmethod
+    def count_call():
+        counter = _action_api_calls.get()
+        if counter is not None:
+            counter[0] += 1
+
+    def record(self, action: str, calls: int):
+        if action not in self._stats and len(self._stats) >= self.MAX_ACTIONS:
+            action = "other"
+        entry = self._stats.setdefault(action, [0, 0, 0])
+        entry[0] += 1
+        entry[1] += calls
+        entry[2] = max(entry[2], calls)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        return {
+            action: {
+                "actions": actions,
+                "api_calls": calls,
+                "avg_calls": round(calls / actions, 2) if actions else 0,
+                "max_calls": max_calls,
+            }
+            for action, (actions, calls, max_calls) in self._stats.items()
+        }
+
+api_call_stats = BotApiCallStats()
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше capacity"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self) -> float:
+        """Забирает токен. Возвращает 0 при успехе, иначе сколько секунд подождать"""
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def pause(self, seconds: float):
+        """Блокирует bucket (после RetryAfter от Telegram)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def is_idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity and time.monotonic() >= self.blocked_until
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """Центральная очередь исходящих запросов к Bot API.
+
+    Подключается как middleware сессии бота, поэтому через неё проходят
+    все вызовы (answer, delete, edit_text и т.д.). Сначала запрос ждёт токен
+    в bucket своего чата, затем — глобальный токен; обе очереди разбираются
+    по приоритету, так что служебное удаление не обгоняет ответ ни в чате,
+    ни в общем потоке.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = TG_GLOBAL_RATE,
+        chat_rate: float = TG_CHAT_RATE,
+        chat_burst: float = TG_CHAT_BURST,
+        group_rate: float = TG_GROUP_RATE,
+        max_retries: int = TG_MAX_RETRIES,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._chat_buckets: Dict[object, TokenBucket] = {}
+        self._queue: List[Tuple[int, int, asyncio.Future]] = []
+        # Ожидающие токен своего чата: куча (приоритет, seq, future) на чат
+        self._chat_waiters: Dict[object, List[Tuple[int, int, asyncio.Future]]] = {}
+        self._chat_drains: Set[asyncio.Task] = set()
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    # ==================== ЛИМИТЫ ====================
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= MAX_CHAT_BUCKETS:
+                self._evict_idle_buckets()
+            # Группы (отрицательный chat_id) ограничены сильнее
+            is_group = isinstance(chat_id, int) and chat_id < 0
+            rate = self.group_rate if is_group else self.chat_rate
+            bucket = TokenBucket(rate, self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _evict_idle_buckets(self):
+        for chat_id in [c for c, b in self._chat_buckets.items()
+                        if b.is_idle() and c not in self._chat_waiters]:
+            del self._chat_buckets[chat_id]
+
+    async def _acquire_chat(self, chat_id, priority: int):
+        bucket = self._chat_bucket(chat_id)
+        waiters = self._chat_waiters.get(chat_id)
+        # Быстрый путь: в чате никто не ждёт и токен есть
+        if not waiters and not bucket.try_take():
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        if not waiters:
+            waiters = self._chat_waiters[chat_id] = []
+            task = asyncio.create_task(self._drain_chat(chat_id, bucket, waiters))
+            self._chat_drains.add(task)
+            task.add_done_callback(self._chat_drains.discard)
+        heapq.heappush(waiters, (priority, next(self._seq), future))
+        await future
+
+    async def _drain_chat(self, chat_id, bucket: TokenBucket, waiters: List[Tuple[int, int, asyncio.Future]]):
+        """Выдаёт токены чата ожидающим в порядке приоритета, пока они есть"""
+        try:
+            while waiters:
+                wait = bucket.try_take()
+                if wait:
+                    await asyncio.sleep(wait)
+                    continue
+
+                # Пропускаем отменённые ожидания, токен отдаём следующему
+                while waiters:
+                    _, _, future = heapq.heappop(waiters)
+                    if not future.done():
+                        future.set_result(None)
+                        break
+        finally:
+            if self._chat_waiters.get(chat_id) is waiters:
+                del self._chat_waiters[chat_id]
+            for _, _, future in waiters:
+                if not future.done():
+                    future.set_exception(RuntimeError("очередь чата остановлена"))
+
+    async def _acquire_global(self, priority: int):
+        # Быстрый путь: очередь пуста и токен есть
+        if not self._queue and not self.global_bucket.try_take():
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), future))
+        self._ensure_worker()
+        self._wakeup.set()
+        await future
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.create_task(self._drain_queue())
+
+    async def _drain_queue(self):
+        """Выдаёт глобальные токены ожидающим в порядке приоритета"""
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            wait = self.global_bucket.try_take()
+            if wait:
+                await asyncio.sleep(wait)
+                continue
+
+            # Пропускаем отменённые ожидания, токен отдаём следующему
+            while self._queue:
+                _, _, future = heapq.heappop(self._queue)
+                if not future.done():
+                    future.set_result(None)
+                    break
+
+    # ==================== MIDDLEWARE ====================
+
+    @staticmethod
+    def method_priority(api_method: str) -> int:
+        if api_method in HIGH_PRIORITY_METHODS:
+            return PRIORITY_HIGH
+        if api_method in LOW_PRIORITY_METHODS:
+            return PRIORITY_LOW
+        return PRIORITY_NORMAL
+
+    @staticmethod
+    async def _timed_request(make_request, bot, method, api_method: str, queue_wait: float = 0.0):
+        start = time.perf_counter()
+        try:
+            with span(f"bot_api.{api_method}", queue_wait_ms=round(queue_wait * 1000, 2)):
+                return await make_request(bot, method)
+        except Exception as e:
+            BOT_API_ERRORS.labels(api_method, type(e).__name__).inc()
+            raise
+        finally:
+            BOT_API_REQUEST_SECONDS.labels(api_method).observe(time.perf_counter() - start)
+
+    async def __call__(self, make_request, bot, method):
+        api_method = method.__api_method__
+        api_call_stats.count_call()
+        if api_method in UNTHROTTLED_METHODS:
+            return await self._timed_request(make_request, bot, method, api_method)
+
+        chat_id = getattr(method, "chat_id", None)
+        priority = self.method_priority(api_method)
+
+        attempt = 0
+        while True:
+            queued_at = time.perf_counter()
+            if chat_id is not None:
+                await self._acquire_chat(chat_id, priority)
+            await self._acquire_global(priority)
+            queue_wait = time.perf_counter() - queued_at
+            BOT_API_QUEUE_WAIT_SECONDS.labels(priority).observe(queue_wait)
+            try:
+                return await self._timed_request(make_request, bot, method, api_method, queue_wait)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    logger.error(f"❌ Flood limit: {api_method} для chat_id={chat_id} не отправлен после {attempt} попыток")
+                    raise
+                # Экспоненциальная добавка поверх retry_after + jitter против синхронных повторов
+                delay = e.retry_after + min(2 ** (attempt - 1), 10) * random.uniform(0.5, 1.0)
+                if chat_id is not None:
+                    self._chat_bucket(chat_id).pause(delay)
+                else:
+                    self.global_bucket.pause(delay)
+                logger.warning(f"⏳ RetryAfter {e.retry_after}s: {api_method} chat_id={chat_id}, попытка {attempt}")
+
+# Глобальный экземпляр
+outbound_scheduler = OutboundScheduler()
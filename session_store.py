@@ -0,0 +1,174 @@
+"""Хранилища сессий для StateManagerDB.
+
+StateManagerDB держит сессии в памяти и работает с хранилищем через
+read-through (сессия поднимается при первом апдейте пользователя) и
+write-through (каждое изменение сразу уходит в хранилище). Реализации:
+
+  - local    — только память процесса, без персистентности (разработка, тесты);
+  - postgres — таблица sessions в Supabase (по умолчанию);
+  - redis    — общий кеш по протоколу Redis: несколько инстансов видят одни
+               и те же сессии; изменения нескольких полей уходят одним pipeline.
+"""
+import json
+import logging
+from typing import Any, Dict, Iterable, Optional
+
+from config import REDIS_URL, SESSION_BACKEND, SESSION_TTL_SECONDS
+from database import db
+
+logger = logging.getLogger(__name__)
+
+# Поля сессии (имена как в таблице sessions)
+SESSION_FIELDS = ("products", "state", "categories", "generated_dishes", "current_dish", "history")
+
+class SessionBackend:
+    """Интерфейс хранилища сессий"""
+
+    name = "base"
+    # True — хранилище общее для нескольких процессов, и сессию нужно
+    # перечитывать на каждом апдейте (кеш процесса может устареть)
+    shared = False
+
+    async def connect(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def load(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Сессия пользователя или None"""
+        raise NotImplementedError
+
+    async def save(self, user_id: int, session: Dict[str, Any], fields: Iterable[str]):
+        """Записывает изменённые поля fields (session — полная сессия)"""
+        raise NotImplementedError
+
+    async def delete(self, user_id: int):
+        raise NotImplementedError
+
+class LocalSessionBackend(SessionBackend):
+    """Сессии только в памяти процесса: после перезапуска теряются"""
+
+    name = "local"
+
+    async def load(self, user_id: int) -> Optional[Dict[str, Any]]:
+        return None
+
+    async def save(self, user_id: int, session: Dict[str, Any], fields: Iterable[str]):
+        pass
+
+    async def delete(self, user_id: int):
+        pass
+
+class PostgresSessionBackend(SessionBackend):
+    """Таблица sessions: строка целиком перезаписывается одним upsert"""
+
+    name = "postgres"
+
+    async def connect(self):
+        if db.pool is None:
+            await db.connect()
+
+    async def load(self, user_id: int) -> Optional[Dict[str, Any]]:
+        return await db.get_session(user_id)
+
+    async def save(self, user_id: int, session: Dict[str, Any], fields: Iterable[str]):
+        await db.create_or_update_session(
+            telegram_id=user_id,
+            products=session.get("products"),
+            state=session.get("state"),
+            categories=session.get("categories"),
+            generated_dishes=session.get("generated_dishes"),
+            current_dish=session.get("current_dish"),
+            history=session.get("history", [])
+        )
+
+    async def delete(self, user_id: int):
+        await db.clear_session(user_id)
+
+class RedisSessionBackend(SessionBackend):
+    """Сессия — hash session:<user_id> с короткими именами полей.
+
+    Значения — компактный JSON; пустые поля не хранятся (HDEL). Все
+    изменения одной записи и продление TTL уходят одним pipeline, то есть
+    за один round trip.
+    """
+
+    name = "redis"
+    shared = True
+
+    # Короткие имена полей в hash
+    _KEYS = {
+        "products": "p", "state": "s", "categories": "c",
+        "generated_dishes": "d", "current_dish": "cd", "history": "h",
+    }
+    _FIELDS = {short: field for field, short in _KEYS.items()}
+
+    def __init__(self, url: str = REDIS_URL, ttl: int = SESSION_TTL_SECONDS):
+        self.url = url
+        self.ttl = ttl
+        self._redis = None
+
+    async def connect(self):
+        # Зависимость нужна только этому хранилищу
+        import redis.asyncio as redis
+        self._redis = redis.from_url(self.url)
+        await self._redis.ping()
+
+    async def close(self):
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+    @staticmethod
+    def _key(user_id: int) -> str:
+        return f"session:{user_id}"
+
+    @staticmethod
+    def encode(value: Any) -> str:
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+    async def load(self, user_id: int) -> Optional[Dict[str, Any]]:
+        raw = await self._redis.hgetall(self._key(user_id))
+        if not raw:
+            return None
+        session = {}
+        for short, value in raw.items():
+            field = self._FIELDS.get(short.decode())
+            if field:
+                session[field] = json.loads(value)
+        return session
+
+    async def save(self, user_id: int, session: Dict[str, Any], fields: Iterable[str]):
+        key = self._key(user_id)
+        mapping = {}
+        empty = []
+        for field in fields:
+            value = session.get(field)
+            if value in (None, "", [], {}):
+                empty.append(self._KEYS[field])
+            else:
+                mapping[self._KEYS[field]] = self.encode(value)
+
+        pipe = self._redis.pipeline(transaction=False)
+        if mapping:
+            pipe.hset(key, mapping=mapping)
+        if empty:
+            pipe.hdel(key, *empty)
+        pipe.expire(key, self.ttl)
+        await pipe.execute()
+
+    async def delete(self, user_id: int):
+        await self._redis.delete(self._key(user_id))
+
+_BACKENDS = {
+    "local": LocalSessionBackend,
+    "postgres": PostgresSessionBackend,
+    "redis": RedisSessionBackend,
+}
+
+def create_session_backend(name: str = SESSION_BACKEND) -> SessionBackend:
+    try:
+        return _BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Неизвестное хранилище сессий: {name} (есть: {', '.join(_BACKENDS)})")
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class StartupStep:
+    __slots__ = ("name", "func", "after", "critical", "started", "finished", "error")
+
+    def __init__(self, name: str, func: Callable[[], Awaitable], after: Iterable[str] = (), critical: bool = False):
+        self.name = name
+        self.func = func
+        self.after = tuple(after)
+        self.critical = critical
+        self.started = 0.0
+        self.finished = 0.0
+        self.error: Optional[BaseException] = None
+
+    @property
+    def duration(self) -> float:
+        return self.finished - self.started
+
+class StartupOrchestrator:
+    """Запускает шаги инициализации параллельно с учётом зависимостей.
+
+    Шаг стартует, как только завершились все шаги из его after. Упавший
+    некритичный шаг только логируется (бот работает в деградированном
+    режиме, как раньше); упавший critical-шаг прерывает запуск. В конце
+    в лог пишется разбивка по времени.
+    """
+
+    def __init__(self):
+        self.steps: Dict[str, StartupStep] = {}
+
+    def add(self, name: str, func: Callable[[], Awaitable], after: Iterable[str] = (), critical: bool = False):
+        self.steps[name] = StartupStep(name, func, after, critical)
+
+    def ok(self, name: str) -> bool:
+        step = self.steps.get(name)
+        return step is not None and step.finished > 0 and step.error is None
+
+    async def run(self):
+        for step in self.steps.values():
+            missing = [dep for dep in step.after if dep not in self.steps]
+            if missing:
+                raise ValueError(f"Шаг {step.name} зависит от неизвестных шагов: {missing}")
+
+        begin = time.perf_counter()
+        done: Dict[str, asyncio.Event] = {name: asyncio.Event() for name in self.steps}
+
+        async def run_step(step: StartupStep):
+            try:
+                for dep in step.after:
+                    await done[dep].wait()
+                step.started = time.perf_counter()
+                try:
+                    await step.func()
+                except Exception as e:
+                    step.error = e
+                    if step.critical:
+                        raise
+                    logger.error(f"❌ Шаг запуска «{step.name}» не выполнен: {e}")
+                finally:
+                    step.finished = time.perf_counter()
+            finally:
+                done[step.name].set()
+
+        try:
+            await asyncio.gather(*(run_step(step) for step in self.steps.values()))
+        finally:
+            self._log_timings(begin)
+
+    def _log_timings(self, begin: float):
+        total = time.perf_counter() - begin
+        lines: List[str] = []
+        for step in sorted(self.steps.values(), key=lambda s: s.started or float("inf")):
+            if not step.started:
+                lines.append(f"  {step.name:<16} не запускался")
+                continue
+            status = "❌" if step.error else "✅"
+            lines.append(
+                f"  {status} {step.name:<16} +{(step.started - begin) * 1000:7.0f} мс"
+                f"  {step.duration * 1000:7.0f} мс"
+            )
+        logger.info(f"⏱ Запуск за {total * 1000:.0f} мс:\n" + "\n".join(lines))
@@ -1,11 +1,31 @@
+import asyncio
 import logging
+from contextlib import asynccontextmanager
 from typing import Dict, List, Optional
 from datetime import datetime
-from database import db
-from config import MAX_HISTORY_MESSAGES
+from database import db, DatabaseUnavailable
+from config import MAX_HISTORY_MESSAGES, DB_JOURNAL_PATH, DB_JOURNAL_REPLAY_BATCH, DB_JOURNAL_MAX_MB
+from session_store import SESSION_FIELDS, create_session_backend
+from journal import WriteJournal
+from history import recipe_history
+from pantry import pantry_index
+from metrics import JOURNAL_WRITES, JOURNAL_REPLAYED, JOURNAL_DROPPED
 
 logger = logging.getLogger(__name__)
 
+# Как часто проверять, не вернулась ли БД (переподключение и replay журнала)
+RECOVERY_INTERVAL = 5.0
+
+# Поле сессии -> раздел кеша
+_FIELD_CACHE = {
+    'products': 'products',
+    'state': 'states',
+    'categories': 'categories',
+    'generated_dishes': 'dishes',
+    'current_dish': 'current_dish',
+    'history': 'history',
+}
+
 class StateManagerDB:
     def __init__(self):
         # Кеш в памяти для быстрого доступа
@@ -20,28 +40,209 @@ class StateManagerDB:
             'products_lang': {}
         }
         
+        # Пользователи, чья сессия уже поднята из хранилища в кеш этого процесса
+        self._loaded = set()
+        # Отложенная запись: user_id -> изменённые поля (см. batch())
+        self._batches: Dict[int, set] = {}
+
+        # Хранилище сессий (SESSION_BACKEND)
+        self.sessions = create_session_backend()
+        self.sessions_ready = False
+
+        # Журнал записей, не дошедших до хранилища, и пользователи с такими записями:
+        # для них память главнее хранилища, пока журнал не воспроизведён
+        self.journal = WriteJournal(DB_JOURNAL_PATH, int(DB_JOURNAL_MAX_MB * 1024 * 1024))
+        self._dirty = set()
+        self._recovery_task: Optional[asyncio.Task] = None
+
         # Флаг инициализации БД
         self.db_connected = False
 
     async def initialize(self):
-        """Инициализация подключения к БД"""
+        """Подключение к БД (пул общий с db, второй не создаём) и к хранилищу сессий"""
         try:
-            await db.connect()
+            if db.pool is None:
+                await db.connect()
             self.db_connected = True
             logger.info("✅ StateManagerDB инициализирован с БД")
         except Exception as e:
             logger.error(f"❌ Ошибка инициализации БД: {e}")
             self.db_connected = False
 
+        await self._connect_sessions()
+        await self._recover_leftover_journal()
+        if self._recovery_task is None:
+            self._recovery_task = asyncio.create_task(self._recovery_loop())
+
+    async def _connect_sessions(self):
+        try:
+            if self.sessions.name != "postgres" or self.db_connected:
+                await self.sessions.connect()
+                self.sessions_ready = True
+                logger.info(f"✅ Хранилище сессий: {self.sessions.name}")
+        except Exception as e:
+            logger.error(f"❌ Хранилище сессий {self.sessions.name} недоступно: {e}")
+
+    async def _recover_leftover_journal(self):
+        """Журнал прошлого запуска: его записи новее хранилища. Воспроизводим до
+        первых апдейтов, а если не вышло — его пользователи не читают хранилище,
+        иначе поздний replay перезапишет их новые данные старыми"""
+        if not self.journal.has_entries():
+            return
+        self._dirty |= await self.journal.user_ids()
+        logger.warning(f"📼 Журнал прошлого запуска: {len(self._dirty)} пользователей")
+        if self.sessions_ready and db.available:
+            try:
+                await self.replay_journal()
+            except Exception as e:
+                logger.warning(f"⚠️ Replay журнала при старте не удался: {e}")
+
+    # ==================== ДЕГРАДАЦИЯ И ЖУРНАЛ ====================
+
+    @property
+    def degraded(self) -> bool:
+        """Записи копятся в журнале, бот работает из памяти"""
+        return bool(self._dirty) or not self.db_connected or not db.available
+
+    async def _journal(self, op: str, user_id: int, **payload):
+        if await self.journal.append(op, user_id=user_id, **payload):
+            JOURNAL_WRITES.labels(op).inc()
+        else:
+            JOURNAL_DROPPED.labels(op).inc()
+        self._dirty.add(user_id)
+        # Сессия в памяти теперь новее хранилища — не перечитываем её
+        self._loaded.add(user_id)
+
+    async def _recovery_loop(self):
+        while True:
+            await asyncio.sleep(RECOVERY_INTERVAL)
+            try:
+                if db.pool is None:
+                    await db.connect()
+                    self.db_connected = True
+                    logger.info("✅ Подключение к БД восстановлено")
+                if not self.sessions_ready:
+                    await self._connect_sessions()
+                if db.pool is not None and not db.available:
+                    # Размыкатель выходит из open только на вызове, а пользователи с журналом
+                    # и фоновые задачи в БД не ходят — пробуем сами (до reset_timeout guarded откажет)
+                    await db.ping()
+                if self.sessions_ready and db.available and self.journal.has_entries():
+                    await self.replay_journal()
+            except Exception as e:
+                logger.debug(f"БД всё ещё недоступна: {e}")
+
+    @staticmethod
+    def _coalesce(entries: List[Dict]) -> List[List[Dict]]:
+        """Схлопывает журнал: по сессии пользователя — одна запись (delete и/или
+        save последних значений полей), рецепты — все по порядку, язык — последний"""
+        sessions: Dict[int, Dict] = {}
+        recipes: List[Dict] = []
+        langs: Dict[int, Dict] = {}
+        for entry in entries:
+            op, user_id = entry["op"], entry["user_id"]
+            if op in ("save", "delete"):
+                item = sessions.setdefault(user_id, {"delete": None, "fields": set(), "record": {}})
+                if op == "delete":
+                    item.update(delete=entry, fields=set(), record={})
+                else:
+                    item["fields"].update(entry["fields"])
+                    item["record"].update({field: entry["record"].get(field) for field in entry["fields"]})
+            elif op == "recipe":
+                recipes.append(entry)
+            elif op == "lang":
+                langs[user_id] = entry
+
+        items = []
+        for user_id, item in sessions.items():
+            group = [item["delete"]] if item["delete"] else []
+            if item["fields"]:
+                group.append({"op": "save", "user_id": user_id, "fields": sorted(item["fields"]), "record": item["record"]})
+            items.append(group)
+        items.extend([entry] for entry in recipes)
+        items.extend([entry] for entry in langs.values())
+        return items
+
+    async def _apply(self, group: List[Dict]):
+        for entry in group:
+            op, user_id = entry["op"], entry["user_id"]
+            if op == "delete":
+                await self.sessions.delete(user_id)
+            elif op == "save":
+                await self.sessions.save(user_id, entry["record"], entry["fields"])
+            elif op == "recipe":
+                await db.save_recipe(
+                    telegram_id=user_id,
+                    dish_name=entry["dish_name"],
+                    recipe_text=entry["recipe_text"],
+                    products_used=entry.get("products_used")
+                )
+                recipe_history.invalidate(user_id)
+                pantry_index.add_recipe(entry["dish_name"], entry["recipe_text"])
+            elif op == "lang":
+                await db.update_user_language(user_id, entry["lang"])
+            JOURNAL_REPLAYED.labels(op).inc()
+
+    async def replay_journal(self):
+        """Воспроизводит журнал пачками; при новом сбое остаток ждёт следующей попытки"""
+        while self.journal.has_entries():
+            items = self._coalesce(await self.journal.take())
+            logger.info(f"📼 Replay журнала: {len(items)} операций")
+            remaining: List[List[Dict]] = []
+            for start in range(0, len(items), DB_JOURNAL_REPLAY_BATCH):
+                batch = items[start:start + DB_JOURNAL_REPLAY_BATCH]
+                results = await asyncio.gather(*(self._apply(group) for group in batch), return_exceptions=True)
+                failed = False
+                for group, result in zip(batch, results):
+                    if isinstance(result, DatabaseUnavailable):
+                        remaining.append(group)
+                        failed = True
+                    elif isinstance(result, Exception):
+                        # Ошибка данных, а не связи: повтор не поможет
+                        logger.error(f"❌ Запись журнала отброшена ({group[0]['op']}): {result}")
+                if failed:
+                    remaining.extend(items[start + DB_JOURNAL_REPLAY_BATCH:])
+                    break
+            await self.journal.finish([entry for group in remaining for entry in group])
+            if remaining:
+                logger.warning(f"⚠️ Replay прерван, осталось {len(remaining)} операций")
+                return
+        # Между проверкой и очисткой нет await — новых записей появиться не могло
+        if not self.journal.has_entries():
+            self._dirty.clear()
+            logger.info("✅ Журнал воспроизведён, запись идёт напрямую в хранилище")
+
     # ==================== ОСНОВНЫЕ МЕТОДЫ ====================
 
+    async def ensure_session(self, user_id: int, reload: bool = False):
+        """Read-through: поднимает сессию при первом апдейте пользователя в процессе.
+
+        reload=True — пользователь переехал с другого воркера: локальный кеш
+        мог устареть, перечитываем. Общее хранилище (redis) читается на каждом
+        апдейте — сессию могли изменить другие инстансы.
+        """
+        if user_id in self._dirty:
+            return  # в памяти свежее, чем в хранилище
+        if reload or self.sessions.shared:
+            self.evict(user_id)
+        elif user_id in self._loaded:
+            return
+        await self.load_user_session(user_id)
+
+    def evict(self, user_id: int):
+        """Убирает сессию пользователя из кеша (БД не трогает)"""
+        for cache in self._cache.values():
+            cache.pop(user_id, None)
+        self._loaded.discard(user_id)
+
     async def load_user_session(self, user_id: int) -> bool:
-        """Загружаем сессию пользователя из БД в кеш"""
-        if not self.db_connected:
+        """Загружаем сессию пользователя из хранилища в кеш"""
+        if not self.sessions_ready:
             return False
             
         try:
-            session = await db.get_session(user_id)
+            session = await self.sessions.load(user_id)
+            self._loaded.add(user_id)
             if session:
                 # Загружаем данные в кеш
                 self._cache['products'][user_id] = session.get('products', '')
@@ -51,32 +252,59 @@ class StateManagerDB:
                 self._cache['current_dish'][user_id] = session.get('current_dish', '')
                 self._cache['history'][user_id] = session.get('history', [])
                 
-                logger.debug(f"📥 Сессия загружена из БД для user_id={user_id}")
+                logger.debug(f"📥 Сессия загружена для user_id={user_id}")
                 return True
         except Exception as e:
-            logger.error(f"Ошибка загрузки сессии из БД: {e}")
+            logger.error(f"Ошибка загрузки сессии: {e}")
         
         return False
 
-    async def save_session_to_db(self, user_id: int):
-        """Сохраняем сессию пользователя в БД"""
-        if not self.db_connected:
+    def _session_record(self, user_id: int) -> Dict:
+        record = {field: self._cache[section].get(user_id) for field, section in _FIELD_CACHE.items()}
+        record['history'] = (record['history'] or [])[-MAX_HISTORY_MESSAGES:]  # Ограничиваем историю
+        return record
+
+    async def save_session_to_db(self, user_id: int, fields=SESSION_FIELDS):
+        """Write-through: сохраняем изменённые поля сессии в хранилище.
+
+        Если хранилище недоступно (или у пользователя уже есть записи в
+        журнале — порядок важен), запись уходит в локальный журнал.
+        """
+        if self.sessions.name == "local":
             return
-            
+
+        pending = self._batches.get(user_id)
+        if pending is not None:
+            pending.update(fields)
+            return
+
+        record = self._session_record(user_id)
+        if self.sessions_ready and user_id not in self._dirty:
+            try:
+                await self.sessions.save(user_id, record, fields)
+                logger.debug(f"💾 Сессия сохранена для user_id={user_id}")
+                return
+            except DatabaseUnavailable as e:
+                logger.warning(f"⚠️ Хранилище недоступно, запись в журнал: {e}")
+            except Exception as e:
+                logger.error(f"Ошибка сохранения сессии: {e}")
+                if self.sessions.name == "postgres":
+                    return
+        await self._journal("save", user_id, fields=list(fields), record=record)
+
+    @asynccontextmanager
+    async def batch(self, user_id: int):
+        """Несколько изменений сессии подряд — одна запись в хранилище на выходе"""
+        if user_id in self._batches:
+            yield
+            return
+        self._batches[user_id] = set()
         try:
-            # Собираем все данные из кеша
-            await db.create_or_update_session(
-                telegram_id=user_id,
-                products=self._cache['products'].get(user_id),
-                state=self._cache['states'].get(user_id),
-                categories=self._cache['categories'].get(user_id),
-                generated_dishes=self._cache['dishes'].get(user_id),
-                current_dish=self._cache['current_dish'].get(user_id),
-                history=self._cache['history'].get(user_id, [])[-MAX_HISTORY_MESSAGES:]  # Ограничиваем историю
-            )
-            logger.debug(f"💾 Сессия сохранена в БД для user_id={user_id}")
-        except Exception as e:
-            logger.error(f"Ошибка сохранения сессии в БД: {e}")
+            yield
+        finally:
+            fields = self._batches.pop(user_id)
+            if fields:
+                await self.save_session_to_db(user_id, fields)
 
     # ==================== ИСТОРИЯ (с автосохранением) ====================
 
@@ -98,7 +326,7 @@ class StateManagerDB:
             self._cache['history'][user_id] = self._cache['history'][user_id][-MAX_HISTORY_MESSAGES:]
         
         # Автосохранение в БД
-        await self.save_session_to_db(user_id)
+        await self.save_session_to_db(user_id, ('history',))
 
     def get_last_bot_message(self, user_id: int) -> Optional[str]:
         hist = self.get_history(user_id)
@@ -114,7 +342,7 @@ class StateManagerDB:
 
     async def set_products(self, user_id: int, products: str):
         self._cache['products'][user_id] = products
-        await self.save_session_to_db(user_id)
+        await self.save_session_to_db(user_id, ('products',))
 
     async def append_products(self, user_id: int, new_products: str):
         current = self._cache['products'].get(user_id)
@@ -123,7 +351,7 @@ class StateManagerDB:
         else:
             self._cache['products'][user_id] = new_products
         
-        await self.save_session_to_db(user_id)
+        await self.save_session_to_db(user_id, ('products',))
 
     # ==================== СТАТУСЫ (с автосохранением) ====================
 
@@ -132,25 +360,25 @@ class StateManagerDB:
 
     async def set_state(self, user_id: int, state: str):
         self._cache['states'][user_id] = state
-        await self.save_session_to_db(user_id)
+        await self.save_session_to_db(user_id, ('state',))
 
     async def clear_state(self, user_id: int):
         if user_id in self._cache['states']:
             del self._cache['states'][user_id]
-        await self.save_session_to_db(user_id)
+        await self.save_session_to_db(user_id, ('state',))
 
     # ==================== КАТЕГОРИИ И БЛЮДА ====================
 
     async def set_categories(self, user_id: int, categories: List[str]):
         self._cache['categories'][user_id] = categories
-        await self.save_session_to_db(user_id)
+        await self.save_session_to_db(user_id, ('categories',))
 
     def get_categories(self, user_id: int) -> List[str]:
         return self._cache['categories'].get(user_id, [])
 
     async def set_generated_dishes(self, user_id: int, dishes: List[Dict]):
         self._cache['dishes'][user_id] = dishes
-        await self.save_session_to_db(user_id)
+        await self.save_session_to_db(user_id, ('generated_dishes',))
 
     def get_generated_dishes(self, user_id: int) -> List[Dict]:
         return self._cache['dishes'].get(user_id, [])
@@ -163,7 +391,7 @@ class StateManagerDB:
 
     async def set_current_dish(self, user_id: int, dish_name: str):
         self._cache['current_dish'][user_id] = dish_name
-        await self.save_session_to_db(user_id)
+        await self.save_session_to_db(user_id, ('current_dish',))
 
     def get_current_dish(self, user_id: int) -> Optional[str]:
         return self._cache['current_dish'].get(user_id)
@@ -174,10 +402,15 @@ class StateManagerDB:
         self._cache['user_lang'][user_id] = lang
         # Сохраняем в БД (в таблицу users)
         try:
-            if self.db_connected:
+            if self.db_connected and user_id not in self._dirty:
                 await db.update_user_language(user_id, lang)
+                return
+        except DatabaseUnavailable:
+            pass
         except Exception as e:
             logger.error(f"Ошибка сохранения языка: {e}")
+            return
+        await self._journal("lang", user_id, lang=lang)
 
     def get_user_lang(self, user_id: int) -> str:
         return self._cache['user_lang'].get(user_id, 'ru')
@@ -191,21 +424,28 @@ class StateManagerDB:
     # ==================== РЕЦЕПТЫ (сохранение в БД) ====================
 
     async def save_recipe_to_history(self, user_id: int, dish_name: str, recipe_text: str):
-        """Сохраняем рецепт в историю БД"""
-        if not self.db_connected:
-            return
-            
+        """Сохраняем рецепт в историю БД (при недоступной БД — в журнал)"""
+        products = self.get_products(user_id)
         try:
-            products = self.get_products(user_id)
-            await db.save_recipe(
-                telegram_id=user_id,
-                dish_name=dish_name,
-                recipe_text=recipe_text,
-                products_used=products
-            )
-            logger.info(f"📝 Рецепт сохранён в историю: {dish_name}")
+            if self.db_connected:
+                await db.save_recipe(
+                    telegram_id=user_id,
+                    dish_name=dish_name,
+                    recipe_text=recipe_text,
+                    products_used=products
+                )
+                logger.info(f"📝 Рецепт сохранён в историю: {dish_name}")
+                recipe_history.invalidate(user_id)
+                pantry_index.add_recipe(dish_name, recipe_text)
+                return
+        except DatabaseUnavailable as e:
+            logger.warning(f"⚠️ БД недоступна, рецепт в журнал: {e}")
         except Exception as e:
             logger.error(f"Ошибка сохранения рецепта: {e}")
+            return
+        await self._journal(
+            "recipe", user_id, dish_name=dish_name, recipe_text=recipe_text, products_used=products
+        )
 
     # ==================== ОЧИСТКА ====================
 
@@ -216,18 +456,30 @@ class StateManagerDB:
             if user_id in self._cache[cache_key]:
                 del self._cache[cache_key][user_id]
         
-        # Очищаем БД
-        if self.db_connected:
+        # Очищаем хранилище
+        if self.sessions.name == "local":
+            return
+        if self.sessions_ready and user_id not in self._dirty:
             try:
-                await db.clear_session(user_id)
+                await self.sessions.delete(user_id)
                 logger.info(f"🧹 Сессия очищена для user_id={user_id}")
+                return
+            except DatabaseUnavailable:
+                pass
             except Exception as e:
                 logger.error(f"Ошибка очистки сессии в БД: {e}")
+                return
+        await self._journal("delete", user_id)
 
     async def shutdown(self):
-        """Graceful shutdown - закрываем соединение с БД"""
+        """Graceful shutdown (пул закрывает владелец — db.close())"""
+        if self._recovery_task:
+            self._recovery_task.cancel()
+            self._recovery_task = None
+        if self.sessions_ready:
+            await self.sessions.close()
+            self.sessions_ready = False
         if self.db_connected:
-            await db.close()
             self.db_connected = False
             logger.info("💤 StateManagerDB завершил работу")
 
@@ -0,0 +1,75 @@
+from recipe_parser import canonical_ingredient, ingredient_names, parse_recipe
+
+# Макет из промптов groq_service.py (рецепт на русском — без переводов в скобках)
+RU_RECIPE = """🍽️ <b>Блинчики</b>
+
+📦 <b>Ингредиенты:</b>
+🔸 Мука - 200 г
+🔸 Сахар (по желанию) - 1 ст. л.
+🔸 Масло (сливочное) - 30 г
+🔸 Перец черный (молотый) - щепотка
+🔸 Яйца — 2 шт
+
+📊 <b>Пищевая ценность на 1 порцию:</b>
+🥚 Белки: 7 г
+🥑 Жиры: 9,5 г
+🌾 Углеводы: 35 г
+⚡ Энерг. ценность: 250 ккал
+
+⏱ <b>Время:</b> 30 минут
+🪦 <b>Сложность:</b> Легкая
+👥 <b>Порции:</b> 4 человека
+
+🔪 <b>Приготовление:</b>
+1. Смешайте муку и яйца - 5 минут.
+
+💡 <b>Совет шеф-повара:</b> Дайте тесту постоять.
+"""
+
+# Рецепт на другом языке: в скобках русский перевод
+FOREIGN_RECIPE = """🍽️ <b>Pancakes (Блинчики)</b>
+
+📦 <b>Ингредиенты:</b>
+🔸 Flour (Мука) - 200 g
+🔸 Eggs (Яйца) - 2 pcs
+🔸 面粉 (мука) - 100 g
+
+⏱ <b>Время:</b> 1 час 15 минут
+🪦 <b>Сложность:</b> Средняя
+👥 <b>Порции:</b> 2 человека
+"""
+
+def test_russian_parentheses_are_qualifiers():
+    assert canonical_ingredient("Сахар (по желанию)") == "сахар"
+    assert canonical_ingredient("Масло (сливочное)") == "масло"
+    assert canonical_ingredient("Перец черный (молотый)") == "перец черный"
+
+def test_foreign_parentheses_are_translations():
+    assert canonical_ingredient("Eggs (Яйца)") == "яйца"
+    assert canonical_ingredient("面粉 (мука)") == "мука"
+    assert canonical_ingredient("Flour") == "flour"
+
+def test_russian_recipe():
+    structure = parse_recipe(RU_RECIPE)
+    assert structure["title"] == "Блинчики"
+    assert ingredient_names(structure) == ["мука", "сахар", "масло", "перец черный", "яйца"]
+    assert structure["ingredients"][0] == {"name": "мука", "quantity": "200 г", "amount": 200.0, "unit": "г"}
+    assert structure["ingredients"][3]["amount"] is None
+    assert structure["nutrition"] == {"protein": 7.0, "fat": 9.5, "carbs": 35.0, "kcal": 250.0}
+    assert structure["time_minutes"] == 30
+    assert structure["difficulty"] == "easy"
+    assert structure["servings"] == 4
+
+def test_foreign_recipe():
+    structure = parse_recipe(FOREIGN_RECIPE)
+    assert ingredient_names(structure) == ["мука", "яйца"]
+    assert structure["time_minutes"] == 75
+    assert structure["difficulty"] == "medium"
+    assert structure["servings"] == 2
+    assert structure["nutrition"]["kcal"] is None
+
+def test_labels_without_markers():
+    structure = parse_recipe("Время: 1,5 часа\nСложность: высокая\nПорции: 2-3")
+    assert structure["time_minutes"] == 90
+    assert structure["difficulty"] == "hard"
+    assert structure["servings"] == 2
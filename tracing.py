@@ -0,0 +1,304 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+from config import (
+    TRACE_EXPORTER, TRACE_SAMPLE_RATE, TRACE_SLOW_SECONDS,
+    TRACE_FILE, TRACE_FILE_MAX_BYTES, TRACE_OTLP_ENDPOINT
+)
+
+logger = logging.getLogger(__name__)
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+EXPORT_QUEUE_SIZE = 1000
+EXPORT_BATCH_SIZE = 100
+EXPORT_INTERVAL = 2.0
+
+class _NoopSpan:
+    """Заглушка вне трейса: стоимость — один вызов ContextVar.get()"""
+
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def record_error(self, exc: BaseException):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NOOP_SPAN = _NoopSpan()
+
+class Trace:
+    __slots__ = ("trace_id", "spans")
+
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.spans: List["Span"] = []
+
+class Span:
+    __slots__ = ("trace", "name", "span_id", "parent_id", "start_ns", "end_ns", "attrs", "error", "_token")
+
+    def __init__(self, trace: Trace, name: str, parent_id: Optional[str], attrs: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attrs = attrs
+        self.start_ns = 0
+        self.end_ns = 0
+        self.error: Optional[str] = None
+        self._token = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def record_error(self, exc: BaseException):
+        """Ошибка, которую код перехватил сам: спан всё равно считается упавшим"""
+        self.error = repr(exc)[:300]
+
+    @property
+    def duration(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e9
+
+    def __enter__(self):
+        self.start_ns = time.time_ns()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.time_ns()
+        if exc is not None:
+            self.error = repr(exc)[:300]
+        _current_span.reset(self._token)
+        self.trace.spans.append(self)
+        return False
+
+class RootSpan(Span):
+    """Корневой спан апдейта: при закрытии решает, экспортировать ли трейс"""
+
+    __slots__ = ("tracer",)
+
+    def __init__(self, tracer: "Tracer", name: str, attrs: Dict[str, Any]):
+        super().__init__(Trace(), name, None, attrs)
+        self.tracer = tracer
+
+    def __exit__(self, exc_type, exc, tb):
+        super().__exit__(exc_type, exc, tb)
+        self.tracer._finish(self)
+        return False
+
+def span(name: str, **attrs):
+    """with span("db.get_session"): ... — дочерний спан текущего трейса (или no-op)"""
+    parent = _current_span.get()
+    if parent is None:
+        return NOOP_SPAN
+    return Span(parent.trace, name, parent.span_id, attrs)
+
+def current_trace_id() -> Optional[str]:
+    parent = _current_span.get()
+    return parent.trace.trace_id if parent else None
+
+# ==================== ЭКСПОРТ ====================
+
+class JsonlExporter:
+    """Трейсы в JSON lines с ротацией файла; запись идёт в отдельном потоке"""
+
+    def __init__(self, path: str, max_bytes: int):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=5, encoding="utf-8")
+        self._handler.setFormatter(logging.Formatter("%(message)s"))
+
+    def _write(self, lines: List[str]):
+        for line in lines:
+            self._handler.emit(logging.makeLogRecord({"msg": line}))
+        self._handler.flush()
+
+    async def export(self, roots: List[RootSpan]):
+        lines = [json.dumps(self._to_record(root), ensure_ascii=False, default=str) for root in roots]
+        await asyncio.to_thread(self._write, lines)
+
+    @staticmethod
+    def _to_record(root: RootSpan) -> Dict[str, Any]:
+        return {
+            "trace_id": root.trace.trace_id,
+            "name": root.name,
+            "start": root.start_ns // 1000,
+            "duration_ms": round(root.duration * 1000, 2),
+            "attrs": root.attrs,
+            "error": root.error,
+            "spans": [
+                {
+                    "name": s.name,
+                    "span_id": s.span_id,
+                    "parent_id": s.parent_id,
+                    "offset_ms": round((s.start_ns - root.start_ns) / 1e6, 2),
+                    "duration_ms": round(s.duration * 1000, 2),
+                    "attrs": s.attrs,
+                    "error": s.error,
+                }
+                for s in root.trace.spans if s is not root
+            ],
+        }
+
+    async def close(self):
+        self._handler.close()
+
+class OtlpHttpExporter:
+    """OTLP/HTTP JSON (например, локальный OpenTelemetry Collector на :4318)"""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @staticmethod
+    def _attributes(attrs: Dict[str, Any]) -> List[Dict]:
+        result = []
+        for key, value in attrs.items():
+            if isinstance(value, bool):
+                result.append({"key": key, "value": {"boolValue": value}})
+            elif isinstance(value, int):
+                result.append({"key": key, "value": {"intValue": str(value)}})
+            elif isinstance(value, float):
+                result.append({"key": key, "value": {"doubleValue": value}})
+            else:
+                result.append({"key": key, "value": {"stringValue": str(value)}})
+        return result
+
+    def _to_otlp(self, roots: List[RootSpan]) -> Dict:
+        spans = []
+        for root in roots:
+            for s in root.trace.spans:
+                item = {
+                    "traceId": s.trace.trace_id,
+                    "spanId": s.span_id,
+                    "name": s.name,
+                    "kind": 2 if s is root else 1,
+                    "startTimeUnixNano": str(s.start_ns),
+                    "endTimeUnixNano": str(s.end_ns),
+                    "attributes": self._attributes(s.attrs),
+                    "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+                }
+                if s.parent_id:
+                    item["parentSpanId"] = s.parent_id
+                spans.append(item)
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": self._attributes({"service.name": "foodwizard-bot"})},
+                "scopeSpans": [{"scope": {"name": "foodwizard.tracing"}, "spans": spans}],
+            }]
+        }
+
+    async def export(self, roots: List[RootSpan]):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5))
+        async with self._session.post(self.endpoint, json=self._to_otlp(roots)) as response:
+            if response.status >= 400:
+                logger.warning(f"OTLP collector ответил {response.status}")
+
+    async def close(self):
+        if self._session:
+            await self._session.close()
+
+# ==================== ТРЕЙСЕР ====================
+
+class Tracer:
+    """Трейс на каждый апдейт.
+
+    Спаны пишутся в память всегда (это дёшево), а экспортируется трейс,
+    только если он попал в выборку sample_rate, оказался медленнее
+    slow_seconds или завершился ошибкой. Экспорт — пакетами в фоне.
+    """
+
+    def __init__(self, exporter=None, sample_rate: float = 0.05, slow_seconds: float = 5.0):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.dropped = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def trace(self, name: str, **attrs):
+        """Корневой спан (начало трейса) — для апдейта или фоновой задачи"""
+        if not self.enabled:
+            return NOOP_SPAN
+        return RootSpan(self, name, attrs)
+
+    def _finish(self, root: RootSpan):
+        # Ошибка в любом спане (перехваченная обработчиком тоже) — трейс сохраняется
+        keep = (
+            any(span.error is not None for span in root.trace.spans)
+            or root.duration >= self.slow_seconds
+            or random.random() < self.sample_rate
+        )
+        if not keep or self._queue is None:
+            return
+        try:
+            self._queue.put_nowait(root)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def start(self):
+        if not self.enabled:
+            return
+        self._queue = asyncio.Queue(maxsize=EXPORT_QUEUE_SIZE)
+        self._worker = asyncio.create_task(self._export_loop())
+        logger.info(f"🔭 Трейсинг включён: {type(self.exporter).__name__}, sample_rate={self.sample_rate}")
+
+    async def _export_loop(self):
+        while True:
+            batch = [await self._queue.get()]
+            # Собираем пакет, не дольше EXPORT_INTERVAL
+            deadline = time.monotonic() + EXPORT_INTERVAL
+            while len(batch) < EXPORT_BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._export(batch)
+
+    async def _export(self, batch: List[RootSpan]):
+        try:
+            await self.exporter.export(batch)
+        except Exception as e:
+            logger.warning(f"Ошибка экспорта трейсов: {e}")
+
+    async def shutdown(self):
+        if not self._worker:
+            return
+        self._worker.cancel()
+        batch = []
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        if batch:
+            await self._export(batch)
+        await self.exporter.close()
+
+def _build_exporter():
+    if TRACE_EXPORTER == "jsonl":
+        return JsonlExporter(TRACE_FILE, TRACE_FILE_MAX_BYTES)
+    if TRACE_EXPORTER == "otlp":
+        return OtlpHttpExporter(TRACE_OTLP_ENDPOINT)
+    return None
+
+# Глобальный экземпляр
+tracer = Tracer(_build_exporter(), sample_rate=TRACE_SAMPLE_RATE, slow_seconds=TRACE_SLOW_SECONDS)